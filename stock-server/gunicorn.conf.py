@@ -0,0 +1,24 @@
+# Gunicorn configuration for the backend, see https://docs.gunicorn.org/en/stable/settings.html
+# Every setting can be overridden through the environment.
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+chdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "src")
+wsgi_app = "main:create_app()"
+
+# Simulations live in the memory of a worker process, so more than one worker
+# needs STATE_BACKEND set to share them, or sticky sessions in front of it.
+workers = int(os.getenv("GUNICORN_WORKERS", "1"))
+# Every open /api/events stream holds a thread for as long as it is connected
+threads = int(os.getenv("GUNICORN_THREADS", "32"))
+worker_class = "gthread"
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
@@ -0,0 +1,330 @@
+"""Benchmarks the back-end offline against synthetic market data.
+
+Run it from stock-server/src:
+
+    python benchmark.py [--quick] [--output results.json] [--compare baseline.json]
+
+The results are printed as a table and can be written as JSON, which a later
+run can be compared against to see how a change affected performance.
+
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from data_handler.analytics import HistoryAnalytics
+from data_handler.handler import Handler, Order
+from data_handler.providers import SyntheticProvider
+from data_handler.sessions import SessionManager
+from data_handler.store import PriceStore
+from flask_server import server
+
+start_date = pd.Timestamp("2020-03-02 10:00:00")
+
+init_cash = 1e12
+
+
+def get_tickers(count: int) -> list:
+    """This function gets the names of count synthetic tickers."""
+    return [f"T{i:04d}" for i in range(count)]
+
+
+def create_handler(store: PriceStore) -> Handler:
+    """This function creates a handler that reads synthetic bars through the given store."""
+    return Handler(start_date, init_cash, store, provider=SyntheticProvider())
+
+
+def measure(run, iterations: int, setup=None) -> dict:
+    """This function times run over a number of iterations, calling setup untimed before each."""
+    durations = []
+    for _ in range(iterations):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        run(argument)
+        durations.append(time.perf_counter() - start)
+    durations = np.array(durations) * 1000
+    return {
+        "iterations": iterations,
+        "median_ms": float(np.median(durations)),
+        "p95_ms": float(np.percentile(durations, 95)),
+        "mean_ms": float(durations.mean()),
+        "ops_per_s": float(1000 / durations.mean()),
+    }
+
+
+# benchmarks
+def benchmark_trades(store: PriceStore, quick: bool) -> list:
+    """This function measures the throughput of alternating buys and sells."""
+    stock_handler = create_handler(store)
+    tickers = get_tickers(10)
+    for ticker in tickers:
+        stock_handler.buy(ticker, 1)
+    trades = iter(range(sys.maxsize))
+
+    def trade(_):
+        i = next(trades)
+        ticker = tickers[i % len(tickers)]
+        if i % 2 == 0:
+            stock_handler.buy(ticker, 1)
+        else:
+            stock_handler.sell(ticker, 1)
+
+    return [
+        {
+            "name": "trade",
+            "params": {"tickers": len(tickers)},
+            **measure(trade, 200 if quick else 2000),
+        }
+    ]
+
+
+def benchmark_rebalance(store: PriceStore, quick: bool) -> list:
+    """This function measures rebalancing a portfolio with a trade per ticker against one batch."""
+    tickers = get_tickers(30)
+
+    def trade_each(stock_handler: Handler):
+        for ticker in tickers:
+            stock_handler.buy(ticker, 1)
+
+    def trade_batch(stock_handler: Handler):
+        stock_handler.execute_orders([Order("buy", ticker, 1) for ticker in tickers])
+
+    def setup() -> Handler:
+        # A fresh handler has nothing cached, so every rebalance has to price its tickers
+        return create_handler(store)
+
+    setup().get_prices(tickers)
+    return [
+        {
+            "name": "rebalance",
+            "params": {"tickers": len(tickers), "mode": mode},
+            **measure(run, 10 if quick else 50, setup),
+        }
+        for mode, run in [("each", trade_each), ("batch", trade_batch)]
+    ]
+
+
+def benchmark_portfolio_value(store: PriceStore, quick: bool) -> list:
+    """This function measures get_portfolio_value against the number of positions."""
+    results = []
+    for positions in [1, 10, 100] if quick else [1, 10, 100, 1000]:
+        stock_handler = create_handler(store)
+        for ticker in get_tickers(positions):
+            stock_handler.buy(ticker, 1)
+        # After a new day the first valuation reprices every held ticker, later ones are marked
+        for state, setup in [
+            ("marked", None),
+            ("next_day", lambda: stock_handler.progress_time(days=1)),
+        ]:
+            results.append(
+                {
+                    "name": "portfolio_value",
+                    "params": {"positions": positions, "state": state},
+                    **measure(
+                        lambda _: stock_handler.get_portfolio_value(),
+                        20 if quick else 100,
+                        setup,
+                    ),
+                }
+            )
+    return results
+
+
+def benchmark_progress_time(store: PriceStore, quick: bool) -> list:
+    """This function measures progressing the time over long ranges with a held portfolio."""
+    tickers = get_tickers(10)
+
+    def setup() -> Handler:
+        stock_handler = create_handler(store)
+        for ticker in tickers:
+            stock_handler.buy(ticker, 1)
+        return stock_handler
+
+    results = []
+    for days in [30, 365] if quick else [30, 365, 1825]:
+        # The first run loads the bars into the store, so the timed runs only measure the handler
+        setup().progress_time(days=days)
+        results.append(
+            {
+                "name": "progress_time",
+                "params": {"days": days, "positions": len(tickers)},
+                **measure(
+                    lambda stock_handler: stock_handler.progress_time(days=days),
+                    5 if quick else 20,
+                    setup,
+                ),
+            }
+        )
+    return results
+
+
+def benchmark_analytics(store: PriceStore, quick: bool) -> list:
+    """This function measures the analytics of a multi-year history, from scratch and after a day."""
+    stock_handler = create_handler(store)
+    for ticker in get_tickers(10):
+        stock_handler.buy(ticker, 1)
+    stock_handler.progress_time(days=1825 if quick else 3650)
+
+    def from_scratch(_):
+        stock_handler.analytics = HistoryAnalytics()
+        stock_handler.get_analytics()
+
+    def next_day(_):
+        stock_handler.on_next_day()
+        stock_handler.get_analytics()
+
+    results = []
+    for state, run in [("from_scratch", from_scratch), ("next_day", next_day)]:
+        results.append(
+            {
+                "name": "analytics",
+                "params": {"state": state, "rows": len(stock_handler.history_rows)},
+                **measure(run, 5 if quick else 20),
+            }
+        )
+    return results
+
+
+def benchmark_routes(store: PriceStore, quick: bool) -> list:
+    """This function measures the end-to-end latency of the Flask routes."""
+    # Logging every request would measure the terminal rather than the server
+    os.environ.setdefault("LOG_SAMPLE_RATE", "0")
+    sessions = SessionManager(lambda: create_handler(store))
+    client = server.create_app(sessions).test_client()
+    for ticker in get_tickers(10):
+        client.post(f"/api/buy/{ticker}/1")
+    requests = [
+        ("GET", "/api/cash"),
+        ("GET", "/api/portfolio"),
+        ("GET", "/api/portfolio/value"),
+        ("GET", "/api/price/T0000"),
+        ("GET", "/api/stocks/T0000/2019-01-01/2020-01-01"),
+        ("GET", "/api/stocks/T0000/2019-01-01/2020-01-01?format=columnar"),
+        ("POST", "/api/buy/T0000/1"),
+    ]
+    results = []
+    for method, url in requests:
+        client.open(url, method=method)
+        results.append(
+            {
+                "name": "route",
+                "params": {"method": method, "url": url},
+                **measure(
+                    lambda _: client.open(url, method=method),
+                    50 if quick else 500,
+                ),
+            }
+        )
+    return results
+
+
+def benchmark_startup(store: PriceStore, quick: bool) -> list:
+    """This function measures starting a fresh interpreter that imports the server and creates the app."""
+    code = "import main; main.create_app()"
+    env = dict(
+        os.environ, JOURNAL_PATH="", PYTHONPATH=os.path.dirname(os.path.abspath(__file__))
+    )
+    cwd = tempfile.mkdtemp()
+
+    def start(_):
+        subprocess.run(
+            [sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True, check=True
+        )
+
+    return [
+        {
+            "name": "startup",
+            "params": {"command": code},
+            **measure(start, 3 if quick else 10),
+        }
+    ]
+
+
+benchmarks = [
+    benchmark_trades,
+    benchmark_rebalance,
+    benchmark_portfolio_value,
+    benchmark_progress_time,
+    benchmark_analytics,
+    benchmark_routes,
+    benchmark_startup,
+]
+
+
+# reporting
+def get_commit() -> str or None:
+    """This function gets the commit the benchmarks are run on, if in a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_key(result: dict) -> str:
+    """This function gets the key that identifies a result across runs."""
+    return json.dumps([result["name"], result["params"]], sort_keys=True)
+
+
+def print_results(results: list, baseline: dict or None = None) -> None:
+    """This function prints the results, with the change from the baseline if given."""
+    for result in results:
+        line = (
+            f"{result['name']:<16} {json.dumps(result['params']):<72} "
+            f"median {result['median_ms']:10.3f} ms  p95 {result['p95_ms']:10.3f} ms"
+        )
+        if baseline is not None and get_key(result) in baseline:
+            ratio = result["median_ms"] / baseline[get_key(result)]["median_ms"]
+            line += f"  {ratio:6.2f}x baseline"
+        print(line)
+
+
+def run_benchmarks(quick: bool = False) -> dict:
+    """This function runs all the benchmarks against a fresh price store."""
+    store = PriceStore(tempfile.mkdtemp())
+    results = []
+    for benchmark in benchmarks:
+        print(f"Running benchmark: {benchmark.__name__}", file=sys.stderr)
+        results += benchmark(store, quick)
+    return {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "quick": quick,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the back-end offline.")
+    parser.add_argument("--quick", action="store_true", help="run fewer iterations")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="compare against the results in this file")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.quick)
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = {get_key(result): result for result in json.load(file)["results"]}
+    print_results(report["results"], baseline)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
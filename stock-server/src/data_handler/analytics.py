@@ -0,0 +1,136 @@
+import threading
+
+import numpy as np
+import pandas as pd
+from data_handler.positions import History
+
+# History rows are trading days
+TRADING_DAYS = 252
+
+_COLUMNS = ("date", "equity", "returns", "drawdown", "max_drawdown")
+
+# Daily volatility below this is rounding noise of a flat equity, as returns are relative
+_MIN_VOLATILITY = 1e-12
+
+
+def _to_float(value: float) -> float or None:
+    return None if np.isnan(value) else float(value)
+
+
+class HistoryAnalytics:
+    """Returns, drawdowns and volatility of a history of daily cash and portfolio values
+
+    The statistics are kept as running columns with a row per history row: the
+    equity (cash plus portfolio value), the daily return, the drawdown from the
+    running peak and the deepest drawdown so far. Rows are only ever appended
+    to a history, so update only computes the rows appended since the last
+    call. The volatility is computed from the returns when it is read, as
+    differences of running sums of squares cancel out the digits of a flat
+    history. A history that is replaced, by a reset or a restored state, is
+    computed from its first row.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start(None)
+
+    def _start(self, history: History or None) -> None:
+        self._history = history
+        self._size = 0
+        self._peak = np.nan
+        self._columns = {name: np.empty(64) for name in _COLUMNS}
+        self._columns["date"] = np.empty(64, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def update(self, history: History, size: int) -> None:
+        """Computes the statistics of the rows of the history appended since the last update, up to size"""
+        with self._lock:
+            if history is not self._history:
+                self._start(history)
+            start = self._size
+            if size <= start:
+                return
+            dates, cash, portfolio_values = history.get_columns(start, size)
+            equity = cash + portfolio_values
+            columns = self._columns
+            if size > len(columns["date"]):
+                capacity = max(size, 2 * len(columns["date"]))
+                for name, column in columns.items():
+                    columns[name] = np.resize(column, capacity)
+            previous = columns["equity"][start - 1] if start else np.nan
+            prior = np.concatenate([[previous], equity[:-1]])
+            with np.errstate(divide="ignore", invalid="ignore"):
+                # A return needs a previous day with something to lose
+                returns = np.where(prior > 0, equity / prior - 1, np.nan)
+                peak = np.fmax.accumulate(np.concatenate([[self._peak], equity]))[1:]
+                drawdown = np.where(peak > 0, equity / peak - 1, np.nan)
+            deepest = columns["max_drawdown"][start - 1] if start else np.nan
+            max_drawdown = np.fmin.accumulate(np.concatenate([[deepest], drawdown]))[1:]
+            columns["date"][start:size] = dates
+            columns["equity"][start:size] = equity
+            columns["returns"][start:size] = returns
+            columns["drawdown"][start:size] = drawdown
+            columns["max_drawdown"][start:size] = max_drawdown
+            self._peak = peak[-1]
+            self._size = size
+
+    def get_series(self, size: int, window: int) -> pd.DataFrame:
+        """Gets the equity, return, drawdown and annualized volatility over window days of the first size rows
+
+        The volatility of a row is the one of the window returns up to it, and
+        is missing until there are that many returns.
+
+        """
+        with self._lock:
+            size = min(size, self._size)
+            columns = {name: column[:size] for name, column in self._columns.items()}
+        volatility = np.full(size, np.nan)
+        if window >= 2 and size > window:
+            # The windows ending at each row from the first one without the missing first return
+            windows = np.lib.stride_tricks.sliding_window_view(
+                np.nan_to_num(columns["returns"]), window
+            )[1:]
+            deviation = np.std(windows, axis=1, ddof=1)
+            deviation[deviation < _MIN_VOLATILITY] = 0.0
+            volatility[window:] = deviation * np.sqrt(TRADING_DAYS)
+        return pd.DataFrame(
+            {
+                "equity": columns["equity"],
+                "returns": columns["returns"],
+                "drawdown": columns["drawdown"],
+                "volatility": volatility,
+            },
+            index=pd.DatetimeIndex(columns["date"].astype("datetime64[ns]"), name="date"),
+        )
+
+    def get_summary(self, size: int) -> dict:
+        """Gets the total return, max drawdown, annualized volatility and Sharpe ratio of the first size rows
+
+        The Sharpe ratio is the annualized mean daily return over its volatility,
+        with no risk-free rate. It is missing for a history without volatility.
+
+        """
+        with self._lock:
+            size = min(size, self._size)
+            if size == 0:
+                return dict.fromkeys(["total_return", "max_drawdown", "volatility", "sharpe"])
+            columns = self._columns
+            first, last = columns["equity"][0], columns["equity"][size - 1]
+            max_drawdown = columns["max_drawdown"][size - 1]
+            returns = np.nan_to_num(columns["returns"][1:size])
+        volatility = sharpe = np.nan
+        if len(returns) >= 2:
+            deviation = np.std(returns, ddof=1)
+            if deviation < _MIN_VOLATILITY:
+                volatility = 0.0
+            else:
+                volatility = deviation * np.sqrt(TRADING_DAYS)
+                sharpe = np.mean(returns) / deviation * np.sqrt(TRADING_DAYS)
+        return {
+            "total_return": _to_float(last / first - 1) if first > 0 else None,
+            "max_drawdown": _to_float(max_drawdown),
+            "volatility": _to_float(volatility),
+            "sharpe": _to_float(sharpe),
+        }
@@ -0,0 +1,252 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from data_handler.metrics import Counter, Gauge
+
+# The columns bars are kept with and their dtypes. Prices are float32, which
+# holds 7 significant digits, so cents are exact up to $99,999.99
+BAR_DTYPES = {
+    "Open": np.float32,
+    "High": np.float32,
+    "Low": np.float32,
+    "Close": np.float32,
+    "Volume": np.int64,
+}
+
+SEGMENT_LOOKUPS = Counter(
+    "bar_cache_lookups_total", "Lookups of bar segments held in memory", ("result",)
+)
+SEGMENT_EVICTIONS = Counter(
+    "bar_cache_evictions_total", "Bar segments evicted to stay within the memory budget"
+)
+
+
+def to_bar_columns(data: pd.DataFrame) -> dict:
+    """Converts the bar columns of a frame to compact arrays, leaving out every other column"""
+    columns = {}
+    for name, dtype in BAR_DTYPES.items():
+        if name not in data.columns:
+            continue
+        values = data[name].to_numpy()
+        if np.issubdtype(dtype, np.integer):
+            # Bars without a volume traded nothing
+            values = np.nan_to_num(values.astype(float))
+        columns[name] = np.ascontiguousarray(values, dtype=dtype)
+    return columns
+
+
+# Powers of ten for every number of decimals a float32 may need to be told apart
+_SCALES = 10.0 ** np.arange(64)
+
+
+def get_decimals(values: np.ndarray) -> np.ndarray:
+    """Gets the decimals of the shortest decimal that is stored as the same float32 for each price
+
+    A price stored from 123.45 is the float32 123.44999694824219, and has 2
+    decimals. Prices that are zero or missing have -1.
+
+    """
+    values = values.astype(np.float64)
+    decimals = np.full(len(values), -1, dtype=np.int8)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        magnitude = np.nan_to_num(np.floor(np.log10(np.abs(values))), posinf=0, neginf=0)
+    pending = np.flatnonzero(np.isfinite(values) & (values != 0))
+    # Every float32 is told apart by 9 significant digits, most prices by far fewer
+    for digits in range(1, 10):
+        if len(pending) == 0:
+            break
+        places = np.clip(digits - 1 - magnitude[pending], 0, len(_SCALES) - 1).astype(np.int8)
+        scale = _SCALES[places]
+        found = (np.round(values[pending] * scale) / scale).astype(np.float32) == values[pending]
+        decimals[pending[found]] = places[found]
+        pending = pending[~found]
+    return decimals
+
+
+def decode_prices(values: np.ndarray, decimals: np.ndarray) -> np.ndarray:
+    """Decodes float32 prices to the float64 of their decimals from get_decimals
+
+    123.44999694824219 with 2 decimals decodes to 123.45 again, so stored prices
+    trade and serialize as they were fetched.
+
+    """
+    values = values.astype(np.float64)
+    # Scaling by a power of ten and dividing by it again gives the nearest float64 of the decimal
+    scale = _SCALES[np.maximum(decimals, 0)]
+    return np.where(decimals >= 0, np.round(values * scale) / scale, values)
+
+
+def _get_missing_value(dtype) -> float:
+    return 0 if np.issubdtype(dtype, np.integer) else np.nan
+
+
+def merge_bars(
+    index: np.ndarray, columns: dict, new_index: np.ndarray, new_columns: dict
+) -> (np.ndarray, dict):
+    """Merges new bars into sorted bars, the new ones replacing any at the same time"""
+    merged_index = np.concatenate([index, new_index])
+    # A stable sort keeps the new bars after the old ones they replace
+    order = np.argsort(merged_index, kind="stable")
+    merged_index = merged_index[order]
+    last = np.append(merged_index[1:] != merged_index[:-1], True)
+    merged = {}
+    for name, dtype in BAR_DTYPES.items():
+        if name not in columns and name not in new_columns:
+            continue
+        missing = _get_missing_value(dtype)
+        old = columns.get(name, np.full(len(index), missing, dtype=dtype))
+        new = new_columns.get(name, np.full(len(new_index), missing, dtype=dtype))
+        merged[name] = np.concatenate([old, new]).astype(dtype, copy=False)[order][last]
+    return merged_index[last], merged
+
+
+class Bars:
+    """The bars of a ticker at an interval, held in compact arrays
+
+    The timestamps are int64 nanoseconds of exchange wall-clock time and every
+    column has the dtype of BAR_DTYPES. The decimals of the prices are found
+    once, as the bars are read or written, so reads decode them in one pass.
+    A segment costs 32 bytes per bar and a byte for the decimals of each price.
+    """
+
+    __slots__ = ("index", "columns", "decimals", "tz", "index_name", "coverage", "token")
+
+    index: np.ndarray
+    columns: dict
+    decimals: dict
+    tz: str or None
+    index_name: str
+    coverage: list
+    token: tuple or None
+
+    def __init__(
+        self,
+        index: np.ndarray,
+        columns: dict,
+        tz: str or None,
+        index_name: str,
+        coverage: list,
+        token: tuple or None = None,
+    ):
+        self.index = index
+        self.columns = columns
+        self.decimals = {
+            name: get_decimals(values)
+            for name, values in columns.items()
+            if values.dtype == np.float32
+        }
+        self.tz = tz
+        self.index_name = index_name
+        self.coverage = coverage
+        # Identifies the stored generation the bars were read from
+        self.token = token
+
+    @property
+    def nbytes(self) -> int:
+        """The bytes held by the arrays of the segment"""
+        arrays = [self.index, *self.columns.values(), *self.decimals.values()]
+        return sum(values.nbytes for values in arrays)
+
+    def to_frame(self, start_ns: int, end_ns: int) -> pd.DataFrame:
+        """Builds a DataFrame of the bars in [start_ns, end_ns), with the prices decoded to float64"""
+        low, high = np.searchsorted(self.index, [start_ns, end_ns])
+        data = pd.DataFrame(
+            {
+                name: decode_prices(values[low:high], self.decimals[name][low:high])
+                if name in self.decimals
+                else values[low:high]
+                for name, values in self.columns.items()
+            },
+            index=pd.DatetimeIndex(
+                self.index[low:high].view("datetime64[ns]"), name=self.index_name
+            ),
+        )
+        if self.tz is not None:
+            data.index = data.index.tz_localize(self.tz)
+        return data
+
+
+class BarCache:
+    """Holds bar segments in memory within a budget of bytes for the whole process
+
+    Segments are whole ticker and interval partitions of the price store. When
+    the resident bytes exceed max_bytes, the least recently used segments are
+    evicted and read from disk again on their next use. A segment larger than
+    the whole budget is never held.
+    """
+
+    max_bytes: int
+    resident_bytes: int
+
+    def __init__(self, max_bytes: int = 256 * 1024**2):
+        self.max_bytes = max_bytes
+        self.resident_bytes = 0
+        self._segments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Bars or None:
+        """Gets the segment for the given key, marking it as recently used"""
+        with self._lock:
+            bars = self._segments.get(key)
+            if bars is not None:
+                self._segments.move_to_end(key)
+        SEGMENT_LOOKUPS.inc("miss" if bars is None else "hit")
+        return bars
+
+    def put(self, key: tuple, bars: Bars) -> None:
+        """Holds the segment for the given key, evicting the least recently used ones beyond the budget"""
+        with self._lock:
+            self._discard(key)
+            if bars.nbytes > self.max_bytes:
+                return
+            self._segments[key] = bars
+            self.resident_bytes += bars.nbytes
+            self._evict()
+
+    def discard(self, key: tuple) -> None:
+        """Stops holding the segment for the given key"""
+        with self._lock:
+            self._discard(key)
+
+    def resize(self, max_bytes: int) -> None:
+        """Sets the budget, evicting segments until they fit in it"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self) -> None:
+        """Stops holding every segment"""
+        with self._lock:
+            self._segments.clear()
+            self.resident_bytes = 0
+
+    def _discard(self, key: tuple) -> None:
+        bars = self._segments.pop(key, None)
+        if bars is not None:
+            self.resident_bytes -= bars.nbytes
+
+    def _evict(self) -> None:
+        while self.resident_bytes > self.max_bytes:
+            _, bars = self._segments.popitem(last=False)
+            self.resident_bytes -= bars.nbytes
+            SEGMENT_EVICTIONS.inc()
+
+    def __len__(self) -> int:
+        return len(self._segments)
+
+
+# Every price store in the process shares this budget
+BAR_CACHE = BarCache()
+
+Gauge(
+    "bar_cache_resident_bytes",
+    "Bytes of bar segments held in memory",
+    lambda: BAR_CACHE.resident_bytes,
+)
+Gauge(
+    "bar_cache_budget_bytes",
+    "Budget of bytes for bar segments held in memory",
+    lambda: BAR_CACHE.max_bytes,
+)
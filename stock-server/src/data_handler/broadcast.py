@@ -0,0 +1,170 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+class Subscription:
+    """The updates a single client has not received yet
+
+    Updates of the same kind are merged, so a client that reads slowly gets
+    the latest values rather than a growing backlog.
+    """
+
+    tickers: frozenset
+
+    def __init__(self, tickers: list):
+        self.tickers = frozenset(tickers)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def push(self, kind: str, update: dict) -> None:
+        """Merges an update into the ones that have not been received yet"""
+        if not update:
+            return
+        with self._lock:
+            self._pending.setdefault(kind, {}).update(update)
+        self._ready.set()
+
+    def pop(self, timeout: float or None = None) -> list:
+        """Waits up to timeout seconds for updates and returns them as (kind, update) pairs"""
+        self._ready.wait(timeout)
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._ready.clear()
+        return list(pending.items())
+
+
+def _get_state(snapshot, value: float) -> dict:
+    return {
+        "version": snapshot.version,
+        "date": snapshot.date.strftime("%Y-%m-%d %H:%M:%S"),
+        "cash": snapshot.cash,
+        "value": float(value),
+        "portfolio": [
+            # Dates are in epoch milliseconds, like in GET /api/portfolio
+            {"ticker": ticker, "quantity": quantity, "date": date.value // 1_000_000}
+            for ticker, quantity, date in snapshot.positions
+        ],
+        "history_size": snapshot.history_size,
+    }
+
+
+def _to_prices(prices: dict) -> dict:
+    return {
+        ticker: None if price is None or np.isnan(price) else float(price)
+        for ticker, price in prices.items()
+    }
+
+
+def _diff(previous: dict, current: dict) -> dict:
+    return {key: value for key, value in current.items() if previous.get(key) != value}
+
+
+class Broadcaster:
+    """Pushes the changes of a handler's state and the prices of subscribed tickers
+
+    The handler notifies the broadcaster whenever it publishes a snapshot. While
+    there are subscribers, a background thread then compares the latest snapshot
+    with the last one it sent and pushes only the fields that changed. Prices of
+    the tickers any subscriber follows are looked up once per move of the clock
+    and fanned out to the subscribers that follow them. With shared state, the
+    handler is synced every poll_interval seconds, so changes made on other
+    replicas are pushed too.
+    """
+
+    poll_interval: float
+
+    def __init__(self, handler, poll_interval: float = 1.0):
+        self.poll_interval = poll_interval
+        self._handler = handler
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def subscribe(self, tickers: list = ()) -> Subscription:
+        """Subscribes to the state and the prices of the given tickers, starting with their current values"""
+        subscription = Subscription(tickers)
+        while True:
+            # Reading the state outside of the lock, so a slow price lookup does not
+            # hold up the broadcaster and other subscribers
+            snapshot = self._handler.snapshot
+            state = _get_state(snapshot, self._handler.get_portfolio_value(snapshot))
+            prices = {}
+            if subscription.tickers:
+                prices = _to_prices(
+                    self._handler.get_prices(sorted(subscription.tickers), snapshot.date)
+                )
+            with self._lock:
+                # A snapshot published in between might already have been broadcast
+                # without this subscription, so it is read again
+                if self._handler.snapshot.version != snapshot.version:
+                    continue
+                self._subscriptions.add(subscription)
+                subscription.push("state", state)
+                subscription.push("prices", prices)
+                # The thread is started lazily and stops without subscribers. It diffs against
+                # what the first subscriber was sent
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run,
+                        args=(state, prices, snapshot.date),
+                        name="broadcaster",
+                        daemon=True,
+                    )
+                    self._thread.start()
+                break
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Stops pushing updates to the subscription"""
+        with self._lock:
+            self._subscriptions.discard(subscription)
+        self._wake.set()
+
+    def notify(self) -> None:
+        """Tells the broadcaster that the handler published a snapshot"""
+        if self._subscriptions:
+            self._wake.set()
+
+    def _run(self, sent: dict, prices: dict, priced_date: pd.Timestamp) -> None:
+        handler = self._handler
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            with self._lock:
+                if not self._subscriptions:
+                    self._thread = None
+                    return
+                subscriptions = list(self._subscriptions)
+            try:
+                handler.sync()
+                snapshot = handler.snapshot
+                state = _get_state(snapshot, handler.get_portfolio_value(snapshot))
+                changed = _diff(sent, state)
+                sent = state
+                tickers = sorted(set().union(*(s.tickers for s in subscriptions)))
+                changed_prices = {}
+                # Prices only change with the clock, and are looked up once for every subscriber
+                if tickers and (snapshot.date != priced_date or not set(tickers) <= prices.keys()):
+                    latest = _to_prices(handler.get_prices(tickers, snapshot.date))
+                    changed_prices = _diff(prices, latest)
+                    prices, priced_date = latest, snapshot.date
+            except Exception as e:
+                print(f"Broadcasting failed: {e}")
+                continue
+            for subscription in subscriptions:
+                subscription.push("state", changed)
+                subscription.push(
+                    "prices",
+                    {
+                        ticker: price
+                        for ticker, price in changed_prices.items()
+                        if ticker in subscription.tickers
+                    },
+                )
@@ -0,0 +1,54 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from data_handler.metrics import Counter
+
+FETCHES = Counter(
+    "upstream_fetches_total",
+    "Upstream fetches, by whether they joined an in-flight fetch",
+    ("coalesced",),
+)
+
+
+class Fetcher:
+    """Runs upstream fetches on a bounded thread pool
+
+    Concurrent fetches of the same key share a single in-flight call, so a burst
+    of identical requests only reaches the data provider once. Callers wait at
+    most timeout seconds, but the fetch itself keeps running in the background
+    so its result can still be stored for the next request.
+    """
+
+    max_workers: int
+    timeout: float or None
+
+    def __init__(self, max_workers: int = 4, timeout: float or None = 30.0):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="fetcher")
+        self._in_flight = {}
+        # The done callback may run right away in the submitting thread, which holds the lock
+        self._lock = threading.RLock()
+
+    def fetch(self, key: tuple, fetch):
+        """Calls fetch, or waits for the in-flight call with the same key, and returns its result
+
+        Raises concurrent.futures.TimeoutError if the result is not ready in time.
+
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            FETCHES.inc("false" if future is None else "true")
+            if future is None:
+                future = self._executor.submit(fetch)
+                self._in_flight[key] = future
+                future.add_done_callback(lambda done: self._forget(key, done))
+        return future.result(timeout=self.timeout)
+
+    def _forget(self, key: tuple, future: Future) -> None:
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
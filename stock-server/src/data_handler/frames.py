@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+
+def to_epoch_ms(index: pd.Index) -> np.ndarray:
+    """Converts a DatetimeIndex to epoch milliseconds, in UTC if it has a timezone"""
+    if len(index) == 0:
+        return np.array([], dtype=np.int64)
+    return index.values.astype("datetime64[ms]").view(np.int64)
+
+
+def paginate(
+    data: pd.DataFrame, cursor: int or None, limit: int or None
+) -> (pd.DataFrame, int or None):
+    """Gets the page of at most limit bars starting at the cursor as well as the cursor of the next page
+
+    Cursors are bar timestamps in epoch milliseconds.
+
+    """
+    if data.empty:
+        return data, None
+    timestamps = to_epoch_ms(data.index)
+    start = 0 if cursor is None else int(np.searchsorted(timestamps, cursor))
+    end = len(data) if limit is None else min(start + limit, len(data))
+    next_cursor = int(timestamps[end]) if end < len(data) else None
+    return data.iloc[start:end], next_cursor
+
+
+def downsample_ohlc(data: pd.DataFrame, max_points: int) -> pd.DataFrame:
+    """Aggregates the bars into at most max_points buckets of consecutive bars
+
+    Each bucket keeps the timestamp and open of its first bar, the highest high,
+    the lowest low, the close of its last bar and the summed volume.
+
+    """
+    if len(data) <= max_points:
+        return data
+    starts = np.linspace(0, len(data), max_points, endpoint=False).astype(int)
+    ends = np.append(starts[1:], len(data)) - 1
+    columns = {}
+    for column in data.columns:
+        values = data[column].to_numpy()
+        if column == "Open":
+            columns[column] = values[starts]
+        elif column == "High":
+            columns[column] = np.fmax.reduceat(values, starts)
+        elif column == "Low":
+            columns[column] = np.fmin.reduceat(values, starts)
+        elif column == "Volume":
+            columns[column] = np.add.reduceat(np.nan_to_num(values), starts)
+        else:
+            columns[column] = values[ends]
+    return pd.DataFrame(columns, index=data.index[starts])
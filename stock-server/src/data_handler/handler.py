@@ -1,15 +1,129 @@
-import yfinance as yf
+import copy
+import itertools
+import threading
+from concurrent.futures import TimeoutError
+from functools import partial
+from typing import NamedTuple
+
+import numpy as np
 import pandas as pd
 from numpy import float64
+from data_handler.store import PriceStore
+from data_handler.analytics import HistoryAnalytics
+from data_handler.broadcast import Broadcaster
+from data_handler.fetcher import Fetcher
+from data_handler.prefetch import Prefetcher
+from data_handler.price_cache import PriceCache
+from data_handler.metrics import Counter, Histogram
+from data_handler.providers import Provider, YahooProvider
+from data_handler.journal import SessionJournal
+from data_handler.shared_state import SharedSession
+from data_handler.positions import History, PositionBook, positions_to_frame
+from data_handler.trading_calendar import NYSE, TradingCalendar
+
+# Versions are unique across all handlers in the process, so a restored session never reuses one
+_versions = itertools.count(1)
+
+DOWNLOAD_SECONDS = Histogram(
+    "upstream_download_seconds", "Duration of data provider downloads", ("interval",)
+)
+DOWNLOAD_ERRORS = Counter(
+    "upstream_download_errors_total", "Data provider downloads that raised", ("interval",)
+)
+VALUATION_SECONDS = Histogram(
+    "portfolio_valuation_seconds", "Duration of portfolio valuations", ("method",)
+)
+
+# How far back a daily price may come from when a ticker has no bar on the last session
+DAILY_LOOKBACK = pd.Timedelta(days=10)
+
+
+def _get_bar_ns(data: pd.DataFrame) -> np.ndarray:
+    """Gets the bar timestamps of a frame as int64 nanoseconds of exchange wall-clock time"""
+    index = data.index
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.values.astype("datetime64[ns]").view(np.int64)
+
+
+def get_close_as_of(data: pd.DataFrame, bar: pd.Timestamp) -> float or None:
+    """Gets the close of the last bar at or before the given bar time with a binary search"""
+    if data.empty:
+        return None
+    i = np.searchsorted(_get_bar_ns(data), bar.value, side="right") - 1
+    return None if i < 0 else data["Close"].iloc[i]
+
+
+class Snapshot(NamedTuple):
+    """An immutable copy of a handler's state that can be read without locking"""
+
+    version: int
+    date: pd.Timestamp
+    cash: float
+    positions: tuple
+    history_rows: History
+    history_size: int
+    value: float or None
+
+
+class Order(NamedTuple):
+    """A leg of a batch of orders"""
+
+    side: str
+    ticker: str
+    quantity: float
 
 
 class Handler:
-    """Handles parsing historical stock data"""
+    """Handles parsing historical stock data
+
+    Every mutation of the state (date, cash, positions and history) happens while
+    holding the handler's lock and ends by publishing a new immutable snapshot
+    with a new version, so readers such as /api/cash, /api/portfolio and
+    /api/history never lock, and can tell from the version if anything changed.
+    Prices are fetched before taking the lock; if the state changed while
+    fetching, the operation is retried with fresh prices.
+
+    The price at any time is the close of the last bar known at that time,
+    found with the trading calendar: a daily bar is only known once its session
+    closed. When the market is closed, prices are those of the last session, so
+    nothing is fetched for the time it was closed.
+
+    With a journal, every mutation is also recorded as an event that can be
+    replayed with apply_event without fetching prices. With shared state, every
+    mutation is committed to it before it is published; if another replica
+    committed first, the handler loads its state and the operation is retried.
+
+    The portfolio is marked to market as it changes: the handler keeps the last
+    price of every ticker it holds and the total value at those prices. Trades
+    adjust the total by the traded quantity, and after the clock moves the first
+    valuation reprices the held tickers and only adjusts the total for those
+    whose price changed. Until then the snapshot has no value.
+    """
 
     date: pd.Timestamp
     initial_cash: float
+    store: PriceStore or None
+    fetcher: Fetcher or None
+    prefetcher: Prefetcher or None
+    provider: Provider
+    calendar: TradingCalendar
+    journal: SessionJournal or None
+    shared: SharedSession or None
+    max_recent_tickers: int = 16
+    version: int
+    snapshot: Snapshot
 
-    def __init__(self, date: pd.Timestamp, initial_cash: float):
+    def __init__(
+        self,
+        date: pd.Timestamp,
+        initial_cash: float,
+        store: PriceStore or None = None,
+        fetcher: Fetcher or None = None,
+        prefetcher: Prefetcher or None = None,
+        provider: Provider or None = None,
+        calendar: TradingCalendar = NYSE,
+    ):
         if not isinstance(date, pd.Timestamp):
             if isinstance(date, str):
                 date = pd.to_datetime(date)
@@ -25,9 +139,111 @@ class Handler:
 
         self.date = date
         self.initial_cash = initial_cash
-        self.portfolio = pd.DataFrame(columns=["ticker", "quantity", "date"])
+        self.store = store
+        self.fetcher = fetcher
+        self.prefetcher = prefetcher
+        self.provider = provider if provider is not None else YahooProvider()
+        self.calendar = calendar
+        self.journal = None
+        self.shared = None
+        self.price_cache = PriceCache()
+        self.recent_tickers = {}
+        self.positions = PositionBook()
         self.cash = initial_cash
-        self.history = pd.DataFrame(columns=["date", "cash", "portfolio_value"])
+        self.history_rows = History()
+        self._clear_marks()
+        self._lock = threading.RLock()
+        self.broadcaster = Broadcaster(self)
+        self.analytics = HistoryAnalytics()
+        self._publish()
+
+    def _commit(self) -> bool:
+        """Commits a mutation to the shared state, must be called while holding the lock
+
+        Returns False if another replica changed the state first. The handler
+        then holds that state, and the mutation has to be retried on it.
+
+        """
+        return self.shared is None or self.shared.commit(self)
+
+    def sync(self) -> None:
+        """Loads the shared state if another replica changed it"""
+        with self._lock:
+            if self.shared is not None:
+                self.shared.sync(self)
+
+    def _record(self, kind: str, **payload) -> None:
+        """Records a mutation to the journal, must be called while holding the lock"""
+        if self.journal is not None:
+            self.journal.record(self, kind, **payload)
+
+    def _publish(self) -> None:
+        """Publishes a snapshot of the state, must be called while holding the lock"""
+        self.version = next(_versions)
+        positions = self.positions.freeze()
+        if not any(position[1] for position in positions):
+            # Without shares the value is known on any date
+            self.value = 0.0
+            self.marks_date = self.date
+            self.marks_bar = self.get_bar(self.date)
+        elif self.marks_date != self.date and self.marks_bar == self.get_bar(self.date):
+            # Every date up to the next bar shares its prices, so the marks still hold
+            self.marks_date = self.date
+        self.snapshot = Snapshot(
+            version=self.version,
+            date=self.date,
+            cash=self.cash,
+            positions=positions,
+            history_rows=self.history_rows,
+            history_size=len(self.history_rows),
+            value=self.value if self.marks_date == self.date else None,
+        )
+        self.broadcaster.notify()
+
+    def _clear_marks(self) -> None:
+        """Forgets the marked prices, must be called while holding the lock"""
+        # The value is always the sum of the held quantities at their marked prices
+        self.marks = {}
+        self.marks_date = None
+        self.marks_bar = None
+        self.value = 0.0
+
+    def _mark_trade(self, ticker: str, quantity: float, price: float) -> None:
+        """Adjusts the value for a trade at the given price, must be called while holding the lock
+
+        Must be called before the quantity is added to the position.
+
+        """
+        if self.marks_date != self.date:
+            # The other tickers are still marked on another date
+            self.marks_bar = None
+        position = self.positions.get(ticker)
+        held = 0 if position is None else position.quantity
+        self.value += held * (price - self.marks.get(ticker, 0.0)) + quantity * price
+        self.marks[ticker] = price
+
+    def _mark(self, prices: dict, date: pd.Timestamp) -> None:
+        """Marks the held tickers to the given prices on the given date, must be called while holding the lock"""
+        for ticker, price in prices.items():
+            # Tickers without a price are valued as if they were worth nothing
+            price = 0.0 if price is None or np.isnan(price) else float(price)
+            mark = self.marks.get(ticker, 0.0)
+            if price != mark:
+                self.value += self.positions.get(ticker).quantity * (price - mark)
+                self.marks[ticker] = price
+        self.marks_date = date
+        self.marks_bar = self.get_bar(date)
+
+    @property
+    def portfolio(self) -> pd.DataFrame:
+        """The portfolio as a DataFrame with a row per position"""
+        return positions_to_frame(self.snapshot.positions)
+
+    @property
+    def history(self) -> pd.DataFrame:
+        """The history as a DataFrame with a row per day"""
+        snapshot = self.snapshot
+        return snapshot.history_rows.to_frame(snapshot.history_size)
 
     def get_date_with_time(
         self,
@@ -47,143 +263,669 @@ class Handler:
         )
 
     def get_data(
-        self, ticker: str, start: pd.Timestamp or None, end: pd.Timestamp or None
+        self,
+        ticker: str,
+        start: pd.Timestamp or None,
+        end: pd.Timestamp or None,
+        interval: str or None = None,
     ) -> pd.DataFrame:
         """Gets the historical data for the given ticker"""
-        interval = "1m"
-        today = pd.Timestamp.today()
         if start is None:
             start = self.get_date_with_time(self.date)[0]
         if end is None:
             end = self.get_date_with_time(self.date, days=1)[0]
+        if interval is None:
+            interval = self.get_interval(start, end)
+        if self.store is None:
+            data = self.fetch(
+                (ticker, interval, start, end),
+                partial(self.download, ticker, interval, start, end),
+            )
+            return pd.DataFrame() if data is None else data
+        for missing_start, missing_end in self.store.get_missing(
+            ticker, interval, start, end
+        ):
+            self.fetch(
+                (ticker, interval, missing_start, missing_end),
+                partial(
+                    self.download_to_store,
+                    [ticker],
+                    interval,
+                    missing_start,
+                    missing_end,
+                ),
+            )
+        return self.store.read(ticker, interval, start, end)
+
+    def is_complete(
+        self,
+        ticker: str,
+        start: pd.Timestamp or None,
+        end: pd.Timestamp or None,
+        interval: str or None = None,
+    ) -> bool:
+        """Checks if the store holds every bar get_data returns for the given range, which a failed download leaves it without"""
+        if self.store is None:
+            return True
+        if start is None:
+            start = self.get_date_with_time(self.date)[0]
+        if end is None:
+            end = self.get_date_with_time(self.date, days=1)[0]
+        if interval is None:
+            interval = self.get_interval(start, end)
+        return not self.store.get_missing(ticker, interval, start, end)
+
+    def fetch(self, key: tuple, fetch) -> object or None:
+        """Runs the given fetch through the shared fetcher if there is one and returns its result, or None if it timed out"""
+        if self.fetcher is None:
+            return fetch()
+        try:
+            return self.fetcher.fetch(key, fetch)
+        except TimeoutError:
+            return None
+
+    def download_to_store(
+        self, tickers: list, interval: str, start: pd.Timestamp, end: pd.Timestamp
+    ) -> None:
+        """Downloads the historical data for the given tickers into the store"""
+        if len(tickers) == 1:
+            downloaded = {tickers[0]: self.download(tickers[0], interval, start, end)}
+        else:
+            downloaded = self.download_many(tickers, interval, start, end)
+        for ticker, data in downloaded.items():
+            # An empty frame may just be a failed download, so it is never recorded as covered
+            if not data.empty:
+                self.store.write(ticker, interval, start, end, data)
+
+    def get_interval(self, start: pd.Timestamp, end: pd.Timestamp) -> str:
+        """Gets the bar interval used to fetch data between the given dates"""
+        today = pd.Timestamp.today()
         # We can only get 7 days of 1m data at a time, and want to avoid getting 1d data if possible
         # We also don't want to try to get data from the future or too far in the past
         if abs((end - start).days) > 7 or end > today or (today - end).days >= 30:
-            interval = "1d"
-        data: pd.DataFrame = yf.download(
-            ticker,
-            interval=interval,
-            start=start,
-            end=end,
-            progress=False,
-        )
+            return "1d"
+        return "1m"
+
+    def download(
+        self, ticker: str, interval: str, start: pd.Timestamp, end: pd.Timestamp
+    ) -> pd.DataFrame:
+        """Downloads the historical data for the given ticker from the provider"""
+        try:
+            with DOWNLOAD_SECONDS.time(interval):
+                data = self.provider.download([ticker], interval, start, end)
+        except Exception:
+            DOWNLOAD_ERRORS.inc(interval)
+            raise
+        if data is None:
+            return pd.DataFrame()
+        # Newer yfinance versions return (price, ticker) columns even for a single ticker
+        if isinstance(data.columns, pd.MultiIndex):
+            data = data.droplevel(-1, axis=1)
         return data
 
-    def get_price(self, ticker: str) -> float or None:
+    def get_data_many(
+        self,
+        tickers: list,
+        start: pd.Timestamp or None,
+        end: pd.Timestamp or None,
+        interval: str or None = None,
+    ) -> dict:
+        """Gets the historical data for the given tickers with as few downloads as possible"""
+        if len(tickers) == 1:
+            return {tickers[0]: self.get_data(tickers[0], start, end, interval)}
+        if start is None:
+            start = self.get_date_with_time(self.date)[0]
+        if end is None:
+            end = self.get_date_with_time(self.date, days=1)[0]
+        if interval is None:
+            interval = self.get_interval(start, end)
+        if self.store is None:
+            downloaded = self.fetch(
+                (tuple(tickers), interval, start, end),
+                partial(self.download_many, tickers, interval, start, end),
+            )
+            if downloaded is None:
+                return {ticker: pd.DataFrame() for ticker in tickers}
+            return downloaded
+        # Tickers missing the same ranges are downloaded together in one request per range
+        groups = {}
+        for ticker in tickers:
+            missing = tuple(self.store.get_missing(ticker, interval, start, end))
+            groups.setdefault(missing, []).append(ticker)
+        for missing, group in groups.items():
+            for missing_start, missing_end in missing:
+                self.fetch(
+                    (tuple(group), interval, missing_start, missing_end),
+                    partial(
+                        self.download_to_store,
+                        group,
+                        interval,
+                        missing_start,
+                        missing_end,
+                    ),
+                )
+        return {
+            ticker: self.store.read(ticker, interval, start, end) for ticker in tickers
+        }
+
+    def download_many(
+        self, tickers: list, interval: str, start: pd.Timestamp, end: pd.Timestamp
+    ) -> dict:
+        """Downloads the historical data for the given tickers from the provider in one request"""
+        try:
+            with DOWNLOAD_SECONDS.time(interval):
+                data = self.provider.download(list(tickers), interval, start, end)
+        except Exception:
+            DOWNLOAD_ERRORS.inc(interval)
+            raise
+        if data is None or data.empty:
+            return {ticker: pd.DataFrame() for ticker in tickers}
+        if not isinstance(data.columns, pd.MultiIndex):
+            return {tickers[0]: data}
+        found = set(data.columns.get_level_values(-1))
+        # Rows are the union of all tickers' bars, so each ticker drops the rows it has no bar for
+        return {
+            ticker: data.xs(ticker, axis=1, level=-1).dropna(how="all")
+            if ticker in found
+            else pd.DataFrame()
+            for ticker in tickers
+        }
+
+    def get_price(
+        self, ticker: str, date: pd.Timestamp or None = None
+    ) -> float or None:
         """Gets the price of the given ticker on the given date"""
-        date = self.get_date_with_time(self.date)[0]
-        data = self.get_data(ticker, date, None)
-        if data.empty:
-            return None
-        return data["Close"].iloc[0]
+        return self.get_prices([ticker], date)[ticker]
+
+    def get_bar(self, date: pd.Timestamp) -> (str, pd.Timestamp or None):
+        """Gets the interval and start of the bar that prices the given date
+
+        The price is the last bar known at the date, the previous session's until
+        a session closes for daily bars, so every date up to the next bar shares
+        it. The bar is None before the first session of the calendar.
+
+        """
+        interval = self.get_interval(date, self.get_date_with_time(date, days=1)[0])
+        return interval, self.calendar.get_bar(date, interval)
+
+    def get_window(self, interval: str, bar: pd.Timestamp) -> (pd.Timestamp, pd.Timestamp):
+        """Gets the range of bars fetched to price the given bar"""
+        if interval == "1m":
+            # The whole session is fetched at once, so its later bars are already at hand
+            day = bar.normalize()
+            return day, day + pd.Timedelta(days=1)
+        return bar - DAILY_LOOKBACK, bar + pd.Timedelta(days=1)
+
+    def get_prices(self, tickers: list, date: pd.Timestamp or None = None) -> dict:
+        """Gets the prices of the given tickers on the given date, fetching all uncached prices at once"""
+        if date is None:
+            date = self.date
+        with self._lock:
+            for ticker in tickers:
+                self.recent_tickers.pop(ticker, None)
+                self.recent_tickers[ticker] = None
+            while len(self.recent_tickers) > self.max_recent_tickers:
+                del self.recent_tickers[next(iter(self.recent_tickers))]
+        interval, bar = self.get_bar(date)
+        if bar is None:
+            return {ticker: None for ticker in tickers}
+        prices = {}
+        uncached = []
+        for ticker in dict.fromkeys(tickers):
+            found, price = self.price_cache.lookup((ticker, interval, bar))
+            if found:
+                prices[ticker] = price
+            else:
+                uncached.append(ticker)
+        if uncached:
+            start, end = self.get_window(interval, bar)
+            for ticker, data in self.get_data_many(uncached, start, end, interval).items():
+                price = get_close_as_of(data, bar)
+                # No price may just be a failed download, so it is only cached once the store holds the window
+                if price is not None or (
+                    self.store is not None and self.is_complete(ticker, start, end, interval)
+                ):
+                    self.price_cache.put((ticker, interval, bar), price)
+                prices[ticker] = price
+        return prices
+
+    def warm_up(self, tickers: list) -> list:
+        """Prices the given tickers from the price store only and returns the ones that were priced"""
+        if self.store is None:
+            return []
+        interval, bar = self.get_bar(self.date)
+        if bar is None:
+            return []
+        start, end = self.get_window(interval, bar)
+        # Tickers the store is missing bars of are left to the first request rather than downloaded
+        stored = [
+            ticker
+            for ticker in tickers
+            if not self.store.get_missing(ticker, interval, start, end)
+        ]
+        if stored:
+            self.get_prices(stored)
+        return stored
 
     def buy(self, ticker: str, quantity: int) -> (bool, str or None):
         """Buys the given quantity of the given ticker on the given date"""
-        price = self.get_price(ticker)
         quantity = float64(quantity)
-        if price is None:
-            return (False, "Ticker not found")
-        if price * quantity > self.cash:
-            return (False, "Not enough cash")
-        self.cash -= price * quantity
-        df = pd.DataFrame(
-            [
-                {
-                    "ticker": ticker,
-                    "quantity": quantity,
-                    "date": self.date,
-                }
-            ]
-        )
-        if self.portfolio.empty:
-            self.portfolio = df
-            return (True, None)
-        elif ticker in self.portfolio["ticker"].values:
-            self.portfolio.loc[
-                self.portfolio["ticker"] == ticker, "quantity"
-            ] += quantity
-            return (True, None)
-        else:
-            self.portfolio = pd.concat(
-                [
-                    self.portfolio,
-                    df,
-                ],
-                ignore_index=True,
-            )
-            return (True, None)
+        while True:
+            date = self.date
+            price = self.get_price(ticker, date)
+            with self._lock:
+                # The price was fetched without the lock, so it is stale if the clock moved
+                if self.date != date:
+                    continue
+                if price is None:
+                    return (False, "Ticker not found")
+                if price * quantity > self.cash:
+                    return (False, "Not enough cash")
+                self.cash -= price * quantity
+                self._mark_trade(ticker, quantity, price)
+                self.positions.add(ticker, quantity, self.date, price)
+                if not self._commit():
+                    continue
+                self._record(
+                    "trade",
+                    ticker=ticker,
+                    quantity=quantity,
+                    price=price,
+                    cash=self.cash,
+                    date=self.date,
+                )
+                self._publish()
+                return (True, None)
 
     def sell(self, ticker: str, quantity: int) -> (bool, str or None):
         """Sells the given quantity of the given ticker on the given date"""
-        if ticker not in self.portfolio["ticker"].values:
-            return (False, "Ticker not found in portfolio")
-        price = self.get_price(ticker)
         quantity = float64(quantity)
-        if price is None:
-            return (False, "Ticker not found. The market may be closed.")
-        if (
-            quantity
-            > (self.portfolio.loc[self.portfolio["ticker"] == ticker, "quantity"].iloc[0])
-        ):
-            return (False, "Not enough shares")
-        self.cash += price * quantity
-        self.portfolio.loc[
-            self.portfolio["ticker"] == ticker, "quantity"
-        ] -= quantity
-        return (True, None)
+        while True:
+            if self.positions.get(ticker) is None:
+                return (False, "Ticker not found in portfolio")
+            date = self.date
+            price = self.get_price(ticker, date)
+            with self._lock:
+                # The price was fetched without the lock, so it is stale if the clock moved
+                if self.date != date:
+                    continue
+                position = self.positions.get(ticker)
+                if position is None:
+                    return (False, "Ticker not found in portfolio")
+                if price is None:
+                    return (False, "Ticker not found. The market may be closed.")
+                if quantity > position.quantity:
+                    return (False, "Not enough shares")
+                self.cash += price * quantity
+                self._mark_trade(ticker, -quantity, price)
+                position.fill(-quantity, price)
+                if not self._commit():
+                    continue
+                self._record(
+                    "trade",
+                    ticker=ticker,
+                    quantity=-quantity,
+                    price=price,
+                    cash=self.cash,
+                    date=self.date,
+                )
+                self._publish()
+                return (True, None)
+
+    def execute_orders(self, orders: list) -> (bool, str or None):
+        """Executes a batch of buy and sell orders all at once, or none of them
+
+        The prices of all legs are fetched in one lookup. The batch is checked
+        as a whole, so sells can pay for buys in the same batch: it fails if it
+        would leave less than no cash or less than no shares of any ticker.
+
+        """
+        orders = [
+            Order(order.side, order.ticker, float64(order.quantity)) for order in orders
+        ]
+        if not orders:
+            return (False, "No orders given")
+        for order in orders:
+            if order.side not in ("buy", "sell"):
+                return (False, f"Unknown side: {order.side}")
+            if not order.quantity > 0:
+                return (False, f"Quantity must be positive: {order.ticker}")
+        bought = {order.ticker for order in orders if order.side == "buy"}
+        tickers = list(dict.fromkeys(order.ticker for order in orders))
+        while True:
+            date = self.date
+            prices = self.get_prices(tickers, date)
+            with self._lock:
+                # The prices were fetched without the lock, so they are stale if the clock moved
+                if self.date != date:
+                    continue
+                cash = self.cash
+                shares = {}
+                trades = []
+                for order in orders:
+                    price = prices[order.ticker]
+                    if order.side == "buy":
+                        if price is None:
+                            return (False, f"Ticker not found: {order.ticker}")
+                        quantity = order.quantity
+                    else:
+                        if order.ticker not in self.positions and order.ticker not in bought:
+                            return (False, f"Ticker not found in portfolio: {order.ticker}")
+                        if price is None:
+                            return (
+                                False,
+                                f"Ticker not found. The market may be closed: {order.ticker}",
+                            )
+                        quantity = -order.quantity
+                    cash -= price * quantity
+                    shares[order.ticker] = shares.get(order.ticker, 0) + quantity
+                    trades.append((order.ticker, quantity, price))
+                if cash < 0:
+                    return (False, "Not enough cash")
+                for ticker, change in shares.items():
+                    position = self.positions.get(ticker)
+                    if (0 if position is None else position.quantity) + change < 0:
+                        return (False, f"Not enough shares: {ticker}")
+                # Buys are filled first, so shares bought in the batch are held before they are sold
+                trades.sort(key=lambda trade: trade[1] < 0)
+                for ticker, quantity, price in trades:
+                    self._mark_trade(ticker, quantity, price)
+                    self.positions.add(ticker, quantity, self.date, price)
+                self.cash = cash
+                if not self._commit():
+                    continue
+                self._record(
+                    "orders",
+                    trades=[(ticker, quantity) for ticker, quantity, _ in trades],
+                    prices=[price for _, _, price in trades],
+                    cash=self.cash,
+                    date=self.date,
+                )
+                self._publish()
+                return (True, None)
 
     def set_date(self, date: pd.Timestamp) -> None:
         """Sets the date"""
+        with self._lock:
+            while True:
+                self._move_clock(date)
+                if self._commit():
+                    break
+            self._record("date", date=date)
+            self._publish()
+        self.prefetch()
+
+    def _move_clock(self, date: pd.Timestamp) -> None:
+        """Sets the date, must be called while holding the lock"""
+        # Prices are cached by bar, so they only go stale when the clock moves to another bar
+        if self.get_bar(date) != self.get_bar(self.date):
+            self.price_cache.clear()
         self.date = date
 
-    def on_next_day(self) -> None:
+    def prefetch(self) -> None:
+        """Asks the prefetcher to load the upcoming bars of the held and recently priced tickers"""
+        if self.prefetcher is None:
+            return
+        snapshot = self.snapshot
+        with self._lock:
+            recent = list(self.recent_tickers)
+        held = [position[0] for position in snapshot.positions if position[1]]
+        self.prefetcher.notify(self, list(dict.fromkeys(held + recent)), snapshot.date)
+
+    def on_next_day(self, portfolio_value: float or None = None) -> None:
         """Updates history and portfolio for the day"""
-        df = pd.DataFrame(
-            [
-                {
-                    "date": self.date,
-                    "cash": self.cash,
-                    "portfolio_value": self.get_portfolio_value(),
-                },
-            ]
-        )
-        if self.history.empty:
-            self.history = df
-        else:
-            self.history = pd.concat(
-                [
-                    self.history,
-                    df,
-                ],
-                ignore_index=True,
-            )
+        while True:
+            value = portfolio_value
+            if value is None:
+                value = self.get_portfolio_value()
+            with self._lock:
+                self.history_rows.append(self.date, self.cash, value)
+                if not self._commit():
+                    continue
+                self._record("history", dates=[self.date], cash=self.cash, values=[value])
+                self._publish()
+                return
 
     def progress_time(
-        self, days: int = 0, hours: int = 0, minutes: int = 0, seconds: int = 0
-    ) -> None:
-        """Progresses the time by the given number of days, hours, minutes, and seconds"""
-        new_date, new_day = self.get_date_with_time(
-            self.date, days=days, hours=hours, minutes=minutes, seconds=seconds
+        self,
+        days: int = 0,
+        hours: int = 0,
+        minutes: int = 0,
+        seconds: int = 0,
+        is_cancelled=None,
+    ) -> bool:
+        """Progresses the time by the given number of days, hours, minutes, and seconds
+
+        is_cancelled is called once the values of the days passed are computed,
+        and the time is left as it is if it returns True. Returns if the time
+        was progressed.
+
+        """
+        while True:
+            snapshot = self.snapshot
+            new_date, new_day = self.get_date_with_time(
+                snapshot.date, days=days, hours=hours, minutes=minutes, seconds=seconds
+            )
+            # Jumps over several days are fast-forwarded with a history row per trading day
+            fast_forward = (new_date.normalize() - snapshot.date.normalize()).days > 1
+            if fast_forward:
+                dates, portfolio_values = self.get_daily_values(
+                    snapshot.date, new_date, snapshot
+                )
+            elif new_day:
+                portfolio_value = self.get_portfolio_value(snapshot)
+            if is_cancelled is not None and is_cancelled():
+                return False
+            with self._lock:
+                # The value was computed without the lock, so it is stale if anything changed
+                if self.version != snapshot.version:
+                    continue
+                if fast_forward:
+                    self.history_rows.extend(dates, self.cash, portfolio_values)
+                elif new_day:
+                    self.history_rows.append(self.date, self.cash, portfolio_value)
+                previous_date = self.date
+                self._move_clock(new_date)
+                if not self._commit():
+                    continue
+                if fast_forward:
+                    self._record(
+                        "history", dates=dates, cash=self.cash, values=portfolio_values
+                    )
+                elif new_day:
+                    self._record(
+                        "history",
+                        dates=[previous_date],
+                        cash=self.cash,
+                        values=[portfolio_value],
+                    )
+                self._record("date", date=new_date)
+                self._publish()
+            self.prefetch()
+            return True
+
+    @VALUATION_SECONDS.time("daily_values")
+    def get_daily_values(
+        self, start: pd.Timestamp, end: pd.Timestamp, snapshot: Snapshot or None = None
+    ) -> (np.ndarray, np.ndarray):
+        """Gets the days from start up to end and the portfolio value on each of them
+
+        The days are start itself and every following session at the same time,
+        up to the last one before the day of end. The close prices of all held
+        tickers over the range are loaded at once, so the values are a single
+        matrix product of prices and quantities.
+
+        """
+        if snapshot is None:
+            snapshot = self.snapshot
+        sessions = self.calendar.get_sessions(
+            start.normalize() + pd.Timedelta(days=1), end.normalize()
+        )
+        days = pd.DatetimeIndex([start]).append(sessions + (start - start.normalize()))
+        # Like get_price, a day is priced by the last daily bar that closed by then
+        targets = self.calendar.get_daily_bars(days)
+        held = [position for position in snapshot.positions if position[1]]
+        if not held:
+            return days.values, np.zeros(len(days))
+        tickers = [position[0] for position in held]
+        quantities = np.array([position[1] for position in held], dtype=float)
+        data = self.get_data_many(
+            tickers, days[0] - DAILY_LOOKBACK, days[-1] + pd.Timedelta(days=1), "1d"
         )
-        if new_day:
-            self.on_next_day()
-        self.date = new_date
-
-    def get_portfolio_value(self) -> float:
-        """Gets the value of the portfolio"""
-        portfolio_value = 0
-        for index, row in self.portfolio.iterrows():
-            quantity = row["quantity"]
-            ticker = row["ticker"]
-            price = self.get_price(ticker)
-            if price is None:
+        prices = np.full((len(days), len(tickers)), np.nan)
+        for column, ticker in enumerate(tickers):
+            bars = data[ticker]
+            if bars.empty:
                 continue
-            portfolio_value += quantity * price
-        return portfolio_value
+            bar_ns = _get_bar_ns(bars)
+            close = bars["Close"].to_numpy(dtype=float)
+            # The last bar at or before each day's bar, as long as it is within the lookback
+            position = np.searchsorted(bar_ns, targets, side="right") - 1
+            clipped = np.maximum(position, 0)
+            found = (position >= 0) & (bar_ns[clipped] + DAILY_LOOKBACK.value >= targets)
+            prices[:, column] = np.where(found, close[clipped], np.nan)
+        # Tickers without a price are left out of the value, as if they were worth nothing
+        return days.values, np.nan_to_num(prices) @ quantities
+
+    @VALUATION_SECONDS.time("portfolio_value")
+    def get_portfolio_value(self, snapshot: Snapshot or None = None) -> float:
+        """Gets the value of the portfolio, repricing the held tickers only if the clock moved"""
+        if snapshot is None:
+            snapshot = self.snapshot
+        if snapshot.value is not None:
+            return snapshot.value
+        held = [position for position in snapshot.positions if position[1]]
+        if not held:
+            return 0
+        tickers = [position[0] for position in held]
+        quantities = np.array([position[1] for position in held], dtype=float)
+        prices = self.get_prices(tickers, snapshot.date)
+        with self._lock:
+            # The prices were fetched without the lock, so they only mark the state they were fetched for
+            if self.version == snapshot.version:
+                self._mark(prices, snapshot.date)
+                # Marking changes no state, so the snapshot keeps its version
+                self.snapshot = self.snapshot._replace(value=self.value)
+                return self.value
+        # Tickers without a price are left out of the value, as if they were worth nothing
+        price_column = np.array([prices[ticker] for ticker in tickers], dtype=float)
+        return np.dot(quantities, np.nan_to_num(price_column))
+
+    def get_analytics(
+        self, window: int = 21, snapshot: Snapshot or None = None
+    ) -> (pd.DataFrame, dict):
+        """Gets the daily series and the summary of the performance of the history
+
+        The series are the equity, daily returns, drawdowns and rolling volatility
+        over window days, see HistoryAnalytics. Only the history rows appended
+        since the last call are computed.
+
+        """
+        if snapshot is None:
+            snapshot = self.snapshot
+        self.analytics.update(snapshot.history_rows, snapshot.history_size)
+        return (
+            self.analytics.get_series(snapshot.history_size, window),
+            self.analytics.get_summary(snapshot.history_size),
+        )
+
+    def get_position_pnl(self) -> pd.DataFrame:
+        """Gets the cost, value and realized and unrealized profit of every position at the current prices"""
+        with self._lock:
+            date = self.date
+            rows = [
+                (position.ticker, position.quantity, position.cost, position.realized)
+                for position in self.positions
+            ]
+        data = pd.DataFrame(rows, columns=["ticker", "quantity", "cost", "realized"])
+        held = data["ticker"][data["quantity"] > 0].tolist()
+        prices = self.get_prices(held, date) if held else {}
+        data["price"] = data["ticker"].map(prices).astype(float)
+        # Closed positions have nothing left to value
+        data["value"] = np.where(data["quantity"] > 0, data["quantity"] * data["price"], 0.0)
+        data["unrealized"] = data["value"] - data["cost"]
+        data["pnl"] = data["realized"] + data["unrealized"]
+        return data[
+            ["ticker", "quantity", "cost", "price", "value", "unrealized", "realized", "pnl"]
+        ]
 
     def reset(self) -> None:
         """Resets the handler"""
-        self.__init__("2021-03-01 10:00:00", self.initial_cash)
+        with self._lock:
+            while True:
+                self._reset(pd.Timestamp("2021-03-01 10:00:00"))
+                if self._commit():
+                    break
+            self._record("reset", date=self.date)
+            self._publish()
+        self.prefetch()
+
+    def _reset(self, date: pd.Timestamp) -> None:
+        self.date = date
+        self.cash = self.initial_cash
+        self.positions = PositionBook()
+        self.history_rows = History()
+        self.price_cache.clear()
+        self._clear_marks()
+
+    def get_state(self) -> dict:
+        """Gets a copy of the simulation state, leaving out shared resources such as the price store"""
+        with self._lock:
+            return {
+                "date": self.date,
+                "initial_cash": self.initial_cash,
+                "cash": self.cash,
+                "positions": copy.deepcopy(self.positions),
+                "history_rows": copy.deepcopy(self.history_rows),
+            }
+
+    def set_state(self, state: dict) -> None:
+        """Restores a simulation state from get_state"""
+        with self._lock:
+            self.date = state["date"]
+            self.initial_cash = state["initial_cash"]
+            self.cash = state["cash"]
+            self.positions = state["positions"]
+            self.history_rows = state["history_rows"]
+            self.price_cache.clear()
+            self._clear_marks()
+            self._publish()
+
+    def apply_event(self, kind: str, event: dict) -> None:
+        """Applies a mutation recorded to the journal, without fetching any prices"""
+        with self._lock:
+            # Events carry no prices, so the portfolio is repriced on the next valuation
+            self._clear_marks()
+            # Trades recorded before costs were tracked have no prices, and leave them unknown
+            if kind == "trade":
+                # Sells are recorded with a negative quantity
+                self.positions.add(
+                    event["ticker"],
+                    event["quantity"],
+                    event["date"],
+                    event.get("price", np.nan),
+                )
+                self.cash = event["cash"]
+            elif kind == "orders":
+                prices = event.get("prices", [np.nan] * len(event["trades"]))
+                for (ticker, quantity), price in zip(event["trades"], prices):
+                    self.positions.add(ticker, quantity, event["date"], price)
+                self.cash = event["cash"]
+            elif kind == "history":
+                self.history_rows.extend(event["dates"], event["cash"], event["values"])
+            elif kind == "date":
+                self._move_clock(event["date"])
+            elif kind == "reset":
+                self._reset(event["date"])
+            else:
+                raise ValueError(f"Unknown event {kind!r}")
+            self._publish()
+
+    def checkpoint(self) -> None:
+        """Snapshots the state to the journal, so restoring it replays no events"""
+        with self._lock:
+            if self.journal is not None:
+                self.journal.snapshot(self)
 
     def __str__(self) -> str:
         return f"Handler:\ndate={self.date}\ninitial_cash={self.initial_cash}\nportfolio=\n{self.portfolio.to_string()}\ncash={self.cash}\nhistory=\n{self.history.to_string()}"
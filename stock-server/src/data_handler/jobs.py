@@ -0,0 +1,174 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from data_handler.metrics import Counter
+
+JOBS = Counter("jobs_total", "Background jobs, by kind and how they ended", ("kind", "status"))
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue holds as many jobs as it may"""
+
+
+class Job:
+    """A long operation that runs in the background and is polled for its result"""
+
+    id: str
+    key: tuple
+    kind: str
+    status: str
+    result: object
+    error: str or None
+
+    def __init__(self, key: tuple, kind: str):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.kind = kind
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.future = None
+        self._cancelled = threading.Event()
+
+    def is_cancelled(self) -> bool:
+        """Gets if the job was asked to stop, which long jobs check between their steps"""
+        return self._cancelled.is_set()
+
+    def is_finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def to_dict(self) -> dict:
+        """Gets the status of the job as a JSON serializable dict"""
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+class JobQueue:
+    """Runs long operations on a bounded thread pool and keeps their results for a while
+
+    Jobs are keyed by what they compute. Submitting a job whose key is already
+    queued, running or done returns that job instead of running it again, so
+    identical requests share a single run and its cached result. Failed and
+    cancelled jobs are not reused. At most max_queued jobs wait for a worker,
+    beyond that submitting raises QueueFull. Finished jobs are forgotten after
+    ttl seconds, or when more than max_jobs are kept.
+    """
+
+    max_workers: int
+    max_queued: int
+    ttl: float
+    max_jobs: int
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_queued: int = 32,
+        ttl: float = 600.0,
+        max_jobs: int = 1000,
+    ):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._by_key = {}
+        self._queued = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    @property
+    def queued(self) -> int:
+        """The number of jobs waiting for a worker"""
+        return self._queued
+
+    def submit(self, key: tuple, kind: str, run) -> Job:
+        """Queues run(job) as a job of the given kind, or gets the job that already computes key
+
+        The job's result is what run returns. A run that sees job.is_cancelled()
+        should stop and return None.
+
+        """
+        with self._lock:
+            self._expire()
+            job = self._by_key.get(key)
+            if job is not None and job.status not in ("failed", "cancelled"):
+                self._jobs.move_to_end(job.id)
+                return job
+            if self._queued >= self.max_queued:
+                raise QueueFull(f"{self._queued} jobs are queued")
+            # The pool is created lazily so its threads live in the process that serves requests
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="jobs")
+            job = Job(key, kind)
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+            self._queued += 1
+            job.future = self._executor.submit(self._run, job, run)
+        return job
+
+    def get(self, job_id: str) -> Job or None:
+        """Gets a job by its id"""
+        with self._lock:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Job or None:
+        """Cancels a job, right away if it is still queued and at its next step if it is running"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.is_finished():
+                return job
+            job._cancelled.set()
+            if job.future.cancel():
+                self._queued -= 1
+                self._finish(job, "cancelled")
+        return job
+
+    def _run(self, job: Job, run) -> None:
+        with self._lock:
+            self._queued -= 1
+            if job.is_cancelled():
+                self._finish(job, "cancelled")
+                return
+            job.status = "running"
+        try:
+            result = run(job)
+        except Exception as e:
+            with self._lock:
+                job.error = str(e) or type(e).__name__
+                self._finish(job, "failed")
+            return
+        with self._lock:
+            job.result = result
+            # A run that stopped early returns nothing, one that was cancelled too late finished anyway
+            self._finish(job, "cancelled" if result is None and job.is_cancelled() else "done")
+
+    def _finish(self, job: Job, status: str) -> None:
+        """Ends a job, must be called while holding the lock"""
+        job.status = status
+        job.finished = time.time()
+        JOBS.inc(job.kind, status)
+
+    def _expire(self) -> None:
+        """Forgets old finished jobs, must be called while holding the lock"""
+        now = time.time()
+        for job in list(self._jobs.values()):
+            expired = job.is_finished() and now - job.finished > self.ttl
+            if expired or (len(self._jobs) > self.max_jobs and job.is_finished()):
+                del self._jobs[job.id]
+                if self._by_key.get(job.key) is job:
+                    del self._by_key[job.key]
@@ -0,0 +1,258 @@
+import os
+import pickle
+import sqlite3
+import threading
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    session TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_session ON events (session, seq);
+CREATE TABLE IF NOT EXISTS snapshots (
+    session TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    state BLOB NOT NULL
+);
+"""
+
+# Journals created before SQLite assigned the sequence numbers are moved to a table that it does
+_MIGRATE_EVENTS = """
+ALTER TABLE events RENAME TO events_old;
+DROP INDEX IF EXISTS events_session;
+CREATE TABLE events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    session TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    payload BLOB NOT NULL
+);
+CREATE INDEX events_session ON events (session, seq);
+INSERT INTO events SELECT * FROM events_old;
+DROP TABLE events_old;
+-- New events are numbered after every snapshot, even ones whose events were all compacted away
+INSERT INTO sqlite_sequence (name, seq)
+    SELECT 'events', 0 WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'events');
+UPDATE sqlite_sequence SET seq = MAX(seq, IFNULL((SELECT MAX(seq) FROM snapshots), 0))
+    WHERE name = 'events';
+"""
+
+
+class Journal:
+    """Persists the state of every session in a SQLite database in WAL mode
+
+    Handlers record each change of their state as an event. Events are queued
+    and written by a background thread in batches, one transaction every
+    flush_interval seconds, so trades never wait for the disk. After
+    snapshot_every events a session's full state is written as a snapshot and
+    the events it covers are deleted, which bounds how many events have to
+    be replayed to restore a session. A crash loses at most the events of the
+    last flush_interval.
+
+    SQLite numbers the events as they are written, so processes sharing the
+    database never number two events alike. A batch that fails to be written
+    because the database is busy is retried on the next flush, and one that
+    fails in any other way is dropped, so it cannot hold up the events after it.
+    """
+
+    path: str
+    snapshot_every: int
+    flush_interval: float
+
+    def __init__(
+        self, path: str, snapshot_every: int = 1000, flush_interval: float = 0.05
+    ):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.flush_interval = flush_interval
+        self._connection = None
+        self._pending = []
+        self._lock = threading.Lock()
+        self._db_lock = threading.RLock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._closed = False
+
+    def _open(self) -> sqlite3.Connection:
+        """Opens the database on first use, so forked workers do not share a connection"""
+        with self._db_lock:
+            if self._connection is not None:
+                return self._connection
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # The connection is shared by the writer thread and restores, behind the lock
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # With WAL, NORMAL only syncs on checkpoints and cannot corrupt the database
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            (sql,) = connection.execute(
+                "SELECT sql FROM sqlite_master WHERE name = 'events'"
+            ).fetchone()
+            if "AUTOINCREMENT" not in sql:
+                connection.executescript(f"BEGIN; {_MIGRATE_EVENTS} COMMIT;")
+            self._connection = connection
+            return connection
+
+    def for_session(self, session_id: str) -> "SessionJournal":
+        """Gets the journal a handler records the changes of the given session to"""
+        return SessionJournal(self, session_id)
+
+    def append(self, session_id: str, kind: str, payload: dict) -> None:
+        """Queues an event of the given session"""
+        data = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+        self._open()
+        with self._lock:
+            self._pending.append(("event", session_id, kind, data))
+            self._start()
+
+    def snapshot(self, session_id: str, state: dict) -> None:
+        """Queues a snapshot of the state of the given session after its last event
+
+        Must be called while holding the lock of the session's handler, so no
+        event can be recorded between copying the state and queueing it.
+
+        """
+        data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        self._open()
+        with self._lock:
+            self._pending.append(("snapshot", session_id, None, data))
+            self._start()
+
+    def restore(self, session_id: str, handler) -> bool:
+        """Restores the state of the given session into the handler and returns if there was one
+
+        The latest snapshot is loaded and the events after it are replayed.
+
+        """
+        self.flush()
+        connection = self._open()
+        with self._db_lock:
+            row = connection.execute(
+                "SELECT seq, state FROM snapshots WHERE session = ?", (session_id,)
+            ).fetchone()
+            seq = 0 if row is None else row[0]
+            events = connection.execute(
+                "SELECT kind, payload FROM events"
+                " WHERE session = ? AND seq > ? ORDER BY seq",
+                (session_id, seq),
+            ).fetchall()
+        if row is None and not events:
+            return False
+        if row is not None:
+            handler.set_state(pickle.loads(row[1]))
+        for kind, payload in events:
+            handler.apply_event(kind, pickle.loads(payload))
+        return True
+
+    def remove(self, session_id: str) -> None:
+        """Removes every event and snapshot of the given session"""
+        self.flush()
+        connection = self._open()
+        with self._db_lock, connection:
+            connection.execute("DELETE FROM events WHERE session = ?", (session_id,))
+            connection.execute("DELETE FROM snapshots WHERE session = ?", (session_id,))
+
+    def flush(self) -> None:
+        """Writes every queued event and snapshot
+
+        A batch the database was too busy for is queued again and the error
+        raised, any other batch that fails is dropped.
+
+        """
+        # Taking the batch while holding the database lock keeps batches in order
+        with self._db_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+            try:
+                self._write(self._open(), pending)
+            except sqlite3.OperationalError:
+                # The transaction was rolled back, so the batch is retried on the next flush
+                with self._lock:
+                    self._pending = pending + self._pending
+                raise
+            except sqlite3.Error as e:
+                print(f"Dropped a journal batch of {len(pending)} entries: {e}")
+
+    def _write(self, connection: sqlite3.Connection, pending: list) -> None:
+        with connection:
+            for entry, session_id, kind, data in pending:
+                if entry == "event":
+                    connection.execute(
+                        "INSERT INTO events (session, kind, payload) VALUES (?, ?, ?)",
+                        (session_id, kind, data),
+                    )
+                    continue
+                # The snapshot covers every event numbered so far, the session's later ones are numbered after it
+                row = connection.execute(
+                    "SELECT seq FROM sqlite_sequence WHERE name = 'events'"
+                ).fetchone()
+                seq = 0 if row is None else row[0]
+                # Compaction: the snapshot replaces every event it covers
+                connection.execute(
+                    "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)",
+                    (session_id, seq, data),
+                )
+                connection.execute(
+                    "DELETE FROM events WHERE session = ? AND seq <= ?",
+                    (session_id, seq),
+                )
+
+    def close(self) -> None:
+        """Writes every queued event and stops the writer thread"""
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        with self._db_lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _start(self) -> None:
+        # The thread is started lazily so it lives in the process that serves requests
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="journal", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Writing the journal failed: {e}")
+
+
+class SessionJournal:
+    """The part of a journal that records the changes of a single session"""
+
+    session_id: str
+
+    def __init__(self, journal: Journal, session_id: str):
+        self.session_id = session_id
+        self._journal = journal
+        self._events = 0
+
+    def record(self, handler, kind: str, **payload) -> None:
+        """Records an event, must be called while holding the handler's lock
+
+        Every snapshot_every events the handler's state is snapshotted too.
+
+        """
+        self._journal.append(self.session_id, kind, payload)
+        self._events += 1
+        if self._events >= self._journal.snapshot_every:
+            self.snapshot(handler)
+
+    def snapshot(self, handler) -> None:
+        """Snapshots the handler's state, must be called while holding the handler's lock"""
+        self._events = 0
+        self._journal.snapshot(self.session_id, handler.get_state())
@@ -0,0 +1,184 @@
+import bisect
+import threading
+import time
+from contextlib import ContextDecorator
+
+# Seconds, from a cached lookup up to a slow upstream download
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Registry:
+    """Collects metrics and renders them in the Prometheus text format
+
+    Registering a metric under a name that is already taken replaces the old
+    one, so an app that is created again does not report stale gauges.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric) -> None:
+        """Adds the metric, replacing any metric with the same name"""
+        with self._lock:
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """Renders every metric in the Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(metric.render() for metric in metrics)
+
+
+REGISTRY = Registry()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: tuple = ()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    """Base class of metrics with a fixed set of label names"""
+
+    kind = "untyped"
+    name: str
+    help: str
+    labels: tuple
+
+    def __init__(
+        self, name: str, help: str, labels: tuple = (), registry: Registry = REGISTRY
+    ):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _check_labels(self, values: tuple) -> tuple:
+        if len(values) != len(self.labels):
+            raise ValueError(f"{self.name} expects the labels {self.labels}")
+        return tuple(str(value) for value in values)
+
+    def render(self) -> str:
+        """Renders the metric in the Prometheus text format"""
+        return f"# HELP {self.name} {self.help}\n# TYPE {self.name} {self.kind}\n"
+
+
+class Counter(Metric):
+    """A count that only goes up, per combination of label values"""
+
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        """Adds amount to the count of the given label values"""
+        labels = self._check_labels(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels) -> float:
+        """Gets the count of the given label values"""
+        return self._values.get(self._check_labels(labels), 0)
+
+    def render(self) -> str:
+        with self._lock:
+            values = list(self._values.items())
+        lines = [
+            f"{self.name}{_format_labels(self.labels, labels)} {value}\n"
+            for labels, value in values
+        ]
+        return super().render() + "".join(lines)
+
+
+class Gauge(Metric):
+    """A value that is read from a function whenever the metrics are rendered"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, read, registry: Registry = REGISTRY):
+        self.read = read
+        super().__init__(name, help, registry=registry)
+
+    def render(self) -> str:
+        return super().render() + f"{self.name} {self.read()}\n"
+
+
+class _Timer(ContextDecorator):
+    def __init__(self, histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def _recreate_cm(self):
+        # Decorated functions may run in several threads at once, so each call gets its own timer
+        return _Timer(self.histogram, self.labels)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class Histogram(Metric):
+    """Counts observations in buckets, per combination of label values"""
+
+    kind = "histogram"
+    buckets: tuple
+
+    def __init__(self, *args, buckets: tuple = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values, the counts of the buckets and the +Inf bucket, and the sum
+        self._values = {}
+
+    def observe(self, value: float, *labels) -> None:
+        """Records an observation for the given label values"""
+        labels = self._check_labels(labels)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(labels, ([0] * (len(self.buckets) + 1), 0))
+            counts[bucket] += 1
+            self._values[labels] = (counts, total + value)
+
+    def time(self, *labels) -> _Timer:
+        """Times a block or function and records its duration in seconds"""
+        return _Timer(self, self._check_labels(labels))
+
+    def get_count(self, *labels) -> int:
+        """Gets the number of observations for the given label values"""
+        counts, _ = self._values.get(self._check_labels(labels), ((), 0))
+        return sum(counts)
+
+    def get_sum(self, *labels) -> float:
+        """Gets the sum of the observations for the given label values"""
+        return self._values.get(self._check_labels(labels), ((), 0))[1]
+
+    def render(self) -> str:
+        with self._lock:
+            values = [
+                (labels, list(counts), total)
+                for labels, (counts, total) in self._values.items()
+            ]
+        lines = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                label_text = _format_labels(self.labels, labels, (("le", bound),))
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}\n")
+            label_text = _format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{label_text} {total}\n")
+            lines.append(f"{self.name}_count{label_text} {cumulative}\n")
+        return super().render() + "".join(lines)
@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+
+
+def positions_to_frame(rows: tuple) -> pd.DataFrame:
+    """Builds a DataFrame with a row per (ticker, quantity, date) position"""
+    return pd.DataFrame(list(rows), columns=["ticker", "quantity", "date"])
+
+
+class Position:
+    """A holding of a single ticker
+
+    The cost is what the held shares were bought for, at their average cost once
+    some have been sold, and the realized profit is what sales made above it.
+    """
+
+    __slots__ = ("ticker", "quantity", "date", "cost", "realized")
+
+    ticker: str
+    quantity: float
+    date: pd.Timestamp
+    cost: float
+    realized: float
+
+    def __init__(
+        self, ticker: str, quantity: float, date: pd.Timestamp, cost: float = 0.0
+    ):
+        self.ticker = ticker
+        self.quantity = quantity
+        self.date = date
+        self.cost = cost
+        self.realized = 0.0
+
+    def __setstate__(self, state: tuple) -> None:
+        # Positions pickled before costs were tracked have unknown costs
+        self.cost = np.nan
+        self.realized = np.nan
+        for name, value in state[1].items():
+            setattr(self, name, value)
+
+    def fill(self, quantity: float, price: float) -> None:
+        """Adds a trade of the given quantity at the given price, with a negative quantity for sells"""
+        if quantity >= 0:
+            self.cost += quantity * price
+        else:
+            average = self.cost / self.quantity if self.quantity else 0.0
+            self.realized -= quantity * (price - average)
+            self.cost += quantity * average
+        self.quantity += quantity
+
+
+class PositionBook:
+    """Holds the positions of a portfolio keyed by ticker, in the order they were opened"""
+
+    def __init__(self):
+        self._positions = {}
+
+    def get(self, ticker: str) -> Position or None:
+        """Gets the position for the given ticker"""
+        return self._positions.get(ticker)
+
+    def add(
+        self, ticker: str, quantity: float, date: pd.Timestamp, price: float = np.nan
+    ) -> Position:
+        """Adds a trade of the given quantity at the given price to the position of the given ticker
+
+        The position is opened on the given date if needed. Without a price the
+        cost of the position becomes unknown.
+
+        """
+        position = self._positions.get(ticker)
+        if position is None:
+            position = Position(ticker, 0.0, date)
+            self._positions[ticker] = position
+        position.fill(quantity, price)
+        return position
+
+    def freeze(self) -> tuple:
+        """Gets an immutable copy of the positions as (ticker, quantity, date) tuples"""
+        return tuple(
+            (position.ticker, position.quantity, position.date)
+            for position in self._positions.values()
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """Builds a DataFrame with a row per position"""
+        return positions_to_frame(self.freeze())
+
+    def __contains__(self, ticker: str) -> bool:
+        return ticker in self._positions
+
+    def __iter__(self):
+        return iter(self._positions.values())
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+
+class History:
+    """Daily cash and portfolio value history stored in preallocated columns that double in size when full"""
+
+    def __init__(self, capacity: int = 64):
+        self._size = 0
+        self._date = np.empty(capacity, dtype=np.int64)
+        self._cash = np.empty(capacity, dtype=np.float64)
+        self._portfolio_value = np.empty(capacity, dtype=np.float64)
+
+    def append(self, date: pd.Timestamp, cash: float, portfolio_value: float) -> None:
+        """Appends a row to the history"""
+        if self._size == len(self._date):
+            capacity = 2 * len(self._date)
+            self._date = np.resize(self._date, capacity)
+            self._cash = np.resize(self._cash, capacity)
+            self._portfolio_value = np.resize(self._portfolio_value, capacity)
+        self._date[self._size] = pd.Timestamp(date).value
+        self._cash[self._size] = cash
+        self._portfolio_value[self._size] = portfolio_value
+        self._size += 1
+
+    def extend(
+        self, dates: np.ndarray, cash: float, portfolio_values: np.ndarray
+    ) -> None:
+        """Appends a row per date to the history, all with the same cash"""
+        size = self._size + len(dates)
+        if size > len(self._date):
+            capacity = max(size, 2 * len(self._date))
+            self._date = np.resize(self._date, capacity)
+            self._cash = np.resize(self._cash, capacity)
+            self._portfolio_value = np.resize(self._portfolio_value, capacity)
+        dates = np.asarray(dates, dtype="datetime64[ns]")
+        self._date[self._size : size] = dates.view(np.int64)
+        self._cash[self._size : size] = cash
+        self._portfolio_value[self._size : size] = portfolio_values
+        self._size = size
+
+    def get_columns(self, start: int, end: int) -> (np.ndarray, np.ndarray, np.ndarray):
+        """Gets read-only views of the dates in nanoseconds, cash and portfolio values of rows start up to end"""
+        columns = (self._date[start:end], self._cash[start:end], self._portfolio_value[start:end])
+        for column in columns:
+            column.flags.writeable = False
+        return columns
+
+    def to_frame(self, size: int or None = None) -> pd.DataFrame:
+        """Builds a DataFrame with a row per day, optionally only for the first size rows
+
+        Rows are never changed once appended, so the first rows can be read while
+        another thread appends.
+
+        """
+        if size is None:
+            size = self._size
+        if size == 0:
+            return pd.DataFrame(columns=["date", "cash", "portfolio_value"])
+        return pd.DataFrame(
+            {
+                "date": self._date[:size].astype("datetime64[ns]"),
+                "cash": self._cash[:size].copy(),
+                "portfolio_value": self._portfolio_value[:size].copy(),
+            }
+        )
+
+    def __len__(self) -> int:
+        return self._size
@@ -0,0 +1,73 @@
+import queue
+import threading
+
+import pandas as pd
+
+
+class Prefetcher:
+    """Loads upcoming bars into the price store ahead of the simulated clock
+
+    Handlers notify the prefetcher whenever their clock moves, and a background
+    thread then fetches the bars for the next days of the tickers the handler
+    holds or has recently priced, so the following price lookups are served
+    from the store. Notifications are dropped rather than queued without bound
+    when the thread falls behind.
+    """
+
+    days: int
+
+    def __init__(self, days: int = 5, max_queued: int = 256):
+        self.days = days
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def notify(self, handler, tickers: list, date: pd.Timestamp) -> None:
+        """Queues prefetching the given tickers from the given date for the given handler"""
+        if not tickers or handler.store is None:
+            return
+        # The thread is started lazily so it lives in the process that serves requests
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="prefetcher", daemon=True
+                )
+                self._thread.start()
+        try:
+            self._queue.put_nowait((handler, tickers, date))
+        except queue.Full:
+            pass
+
+    def join(self) -> None:
+        """Waits until every queued prefetch is done"""
+        self._queue.join()
+
+    def _prefetch(self, handler, tickers: list, date: pd.Timestamp) -> None:
+        # Prices are looked up a bar at a time, so these are the windows the next lookups will ask for
+        dates = [date] + [date + pd.offsets.BDay(i) for i in range(1, self.days + 1)]
+        windows = []
+        for start in dates:
+            interval, bar = handler.get_bar(start)
+            if bar is not None:
+                windows.append((interval, *handler.get_window(interval, bar)))
+        if not windows:
+            return
+        intervals = {interval for interval, _, _ in windows}
+        start = min(window[1] for window in windows)
+        end = max(window[2] for window in windows)
+        # One download covers every window when it fetches the same bar interval as they would
+        if intervals == {handler.get_interval(start, end)}:
+            handler.get_data_many(tickers, start, end, intervals.pop())
+            return
+        for interval, start, end in windows:
+            handler.get_data_many(tickers, start, end, interval)
+
+    def _run(self) -> None:
+        while True:
+            handler, tickers, date = self._queue.get()
+            try:
+                self._prefetch(handler, tickers, date)
+            except Exception as e:
+                print(f"Prefetch of {tickers} failed: {e}")
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,74 @@
+import threading
+from collections import OrderedDict
+
+from data_handler.metrics import Counter
+from data_handler.shared_state import StateBackend
+
+LOOKUPS = Counter("price_cache_lookups_total", "Price cache lookups", ("result",))
+
+
+def _to_shared_key(key: tuple) -> str:
+    return "|".join(str(part) for part in key)
+
+
+class PriceCache:
+    """Bounded LRU cache of prices keyed by ticker and simulated bar time
+
+    With a shared state backend, local misses are looked up in the prices
+    every replica has shared, and stored prices are shared with them.
+    """
+
+    max_size: int
+    hits: int
+    misses: int
+    backend: StateBackend or None
+
+    def __init__(self, max_size: int = 1024, backend: StateBackend or None = None):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key: tuple) -> (bool, float or None):
+        """Looks up the price for the given key and returns if it was found as well as the price"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                LOOKUPS.inc("hit")
+                return (True, self._entries[key])
+        if self.backend is not None:
+            found, price = self.backend.get_price(_to_shared_key(key))
+            if found:
+                with self._lock:
+                    self.hits += 1
+                    self._put(key, price)
+                LOOKUPS.inc("shared_hit")
+                return (True, price)
+        with self._lock:
+            self.misses += 1
+        LOOKUPS.inc("miss")
+        return (False, None)
+
+    def put(self, key: tuple, price: float or None) -> None:
+        """Stores the price for the given key, evicting the least recently used entry if full"""
+        with self._lock:
+            self._put(key, price)
+        if self.backend is not None:
+            self.backend.put_price(_to_shared_key(key), price)
+
+    def _put(self, key: tuple, price: float or None) -> None:
+        self._entries[key] = price
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Removes all entries, keeping the hit and miss counters"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
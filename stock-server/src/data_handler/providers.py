@@ -0,0 +1,247 @@
+import json
+import os
+import threading
+import zlib
+
+import numpy as np
+import pandas as pd
+from data_handler.ranges import get_missing, merge_ranges, to_wall_ns
+from data_handler.trading_calendar import NYSE, TradingCalendar
+
+# yfinance's column order since it auto adjusts prices by default
+COLUMNS = ["Close", "High", "Low", "Open", "Volume"]
+
+
+def _empty(tickers: list) -> pd.DataFrame:
+    return pd.DataFrame(
+        columns=pd.MultiIndex.from_product([COLUMNS, tickers], names=["Price", "Ticker"])
+    )
+
+
+class Provider:
+    """A source of historical bars
+
+    Providers return what yf.download returns for a list of tickers: a frame
+    with (Price, Ticker) columns, a naive "Date" index for daily bars and a
+    New York "Datetime" index for minute bars.
+    """
+
+    def download(
+        self, tickers: list, interval: str, start: pd.Timestamp, end: pd.Timestamp
+    ) -> pd.DataFrame:
+        """Downloads the bars of the given tickers from start up to end"""
+        raise NotImplementedError
+
+    def warm_up(self) -> None:
+        """Loads what the provider needs ahead of its first download"""
+
+
+class YahooProvider(Provider):
+    """Downloads bars from Yahoo Finance with yfinance
+
+    yfinance is imported on first use rather than with the server, as importing
+    it takes about as long as starting everything else.
+    """
+
+    def warm_up(self) -> None:
+        import yfinance  # noqa: F401
+
+    def download(
+        self, tickers: list, interval: str, start: pd.Timestamp, end: pd.Timestamp
+    ) -> pd.DataFrame:
+        import yfinance as yf
+
+        data = yf.download(
+            list(tickers),
+            interval=interval,
+            start=start,
+            end=end,
+            progress=False,
+        )
+        return _empty(tickers) if data is None else data
+
+
+def _hash(values: np.ndarray, seed: int) -> np.ndarray:
+    """Hashes int64 values to uniform floats in [0, 1) with splitmix64"""
+    with np.errstate(over="ignore"):
+        x = values.astype(np.uint64) + np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        x = x ^ (x >> np.uint64(31))
+    return (x >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
+class SyntheticProvider(Provider):
+    """Generates deterministic bars without any network access
+
+    Every bar is a function of the seed, the ticker and its own timestamp only,
+    so overlapping downloads always agree and a range can be fetched in any
+    number of pieces. Bars are generated for the sessions of the trading
+    calendar: daily bars for every session and minute bars for its hours.
+    """
+
+    seed: int
+    calendar: TradingCalendar
+
+    def __init__(self, seed: int = 0, calendar: TradingCalendar = NYSE):
+        self.seed = seed
+        self.calendar = calendar
+
+    def get_bar_times(
+        self, interval: str, start: pd.Timestamp, end: pd.Timestamp
+    ) -> pd.DatetimeIndex:
+        """Gets the times of the bars from start up to end"""
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        if interval == "1d":
+            days = self.calendar.get_sessions(
+                start.normalize(), end.normalize() + pd.Timedelta(days=1)
+            )
+            return days[(days >= start) & (days < end)].rename("Date")
+        if interval == "1m":
+            tz = self.calendar.tz
+            if start.tz is not None:
+                start = start.tz_convert(tz).tz_localize(None)
+                end = end.tz_convert(tz).tz_localize(None)
+            times = self.calendar.get_minutes(start, end)
+            return times.tz_localize(tz).rename("Datetime")
+        raise ValueError(f"Unsupported interval: {interval}")
+
+    def get_bars(self, ticker: str, times: pd.DatetimeIndex) -> pd.DataFrame:
+        """Gets the bars of the given ticker at the given times"""
+        key = zlib.crc32(ticker.encode()) ^ self.seed
+        # The wall clock time, so daily and minute bars of a day are priced alike
+        ns = times.tz_localize(None).values.astype("datetime64[ns]").view(np.int64)
+        days = ns / pd.Timedelta(days=1).value
+        base = 20 + key % 480
+        phase = (key % 1000) / 1000 * 2 * np.pi
+        trend = 1 + 0.25 * np.sin(2 * np.pi * days / 365 + phase)
+        noise = _hash(ns, key) - 0.5
+        opens = base * trend * (1 + 0.02 * noise)
+        closes = opens * (1 + 0.01 * (_hash(ns, key + 1) - 0.5))
+        return pd.DataFrame(
+            {
+                "Close": closes,
+                "High": np.maximum(opens, closes) * (1 + 0.005 * _hash(ns, key + 2)),
+                "Low": np.minimum(opens, closes) * (1 - 0.005 * _hash(ns, key + 3)),
+                "Open": opens,
+                "Volume": (1000 + 100000 * _hash(ns, key + 4)).astype(np.int64),
+            },
+            index=times,
+        )
+
+    def download(
+        self, tickers: list, interval: str, start: pd.Timestamp, end: pd.Timestamp
+    ) -> pd.DataFrame:
+        times = self.get_bar_times(interval, start, end)
+        if len(times) == 0:
+            return _empty(tickers)
+        frames = {ticker: self.get_bars(ticker, times) for ticker in tickers}
+        data = pd.concat(frames, axis=1, names=["Ticker", "Price"])
+        return data.swaplevel(axis=1)[COLUMNS]
+
+
+class FixtureProvider(Provider):
+    """Serves bars recorded to files, recording them from another provider if given
+
+    The bars of each ticker are kept in root/<interval>/<TICKER>.pickle, and
+    the [start, end) ranges they were recorded for in <TICKER>.ranges.json.
+    When a provider to record from is given, the parts of a requested range
+    that were not recorded yet are downloaded from it and saved, otherwise
+    they have no bars. Fixtures without recorded ranges cover their first to
+    their last bar.
+    """
+
+    root: str
+    record_from: Provider or None
+
+    def __init__(self, root: str, record_from: Provider or None = None):
+        self.root = root
+        self.record_from = record_from
+        self._lock = threading.Lock()
+
+    def _get_path(self, ticker: str, interval: str) -> str:
+        return os.path.join(self.root, interval, f"{ticker.upper()}.pickle")
+
+    def _get_ranges_path(self, ticker: str, interval: str) -> str:
+        return os.path.join(self.root, interval, f"{ticker.upper()}.ranges.json")
+
+    def save(
+        self,
+        ticker: str,
+        interval: str,
+        data: pd.DataFrame,
+        start: pd.Timestamp or None = None,
+        end: pd.Timestamp or None = None,
+    ) -> None:
+        """Saves the bars of the ticker, merged with its recorded bars, and records [start, end) as covered if given"""
+        path = self._get_path(ticker, interval)
+        with self._lock:
+            ranges = self.get_ranges(ticker, interval)
+            if os.path.exists(path):
+                data = pd.concat([pd.read_pickle(path), data])
+                data = data[~data.index.duplicated(keep="last")].sort_index()
+            if start is not None and end is not None:
+                ranges.append([to_wall_ns(start), to_wall_ns(end)])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            data.to_pickle(path)
+            with open(self._get_ranges_path(ticker, interval), "w") as file:
+                json.dump(merge_ranges(ranges), file)
+
+    def load(self, ticker: str, interval: str) -> pd.DataFrame or None:
+        """Loads the recorded bars of the ticker, if there are any"""
+        path = self._get_path(ticker, interval)
+        if not os.path.exists(path):
+            return None
+        return pd.read_pickle(path)
+
+    def get_ranges(self, ticker: str, interval: str) -> list:
+        """Gets the sorted [start, end) ranges the bars of the ticker were recorded for, in wall-clock nanoseconds"""
+        path = self._get_ranges_path(ticker, interval)
+        if os.path.exists(path):
+            with open(path) as file:
+                return json.load(file)
+        data = self.load(ticker, interval)
+        if data is None or data.empty:
+            return []
+        return [[to_wall_ns(data.index[0]), to_wall_ns(data.index[-1]) + 1]]
+
+    def get_missing(
+        self, ticker: str, interval: str, start: pd.Timestamp, end: pd.Timestamp
+    ) -> list:
+        """Gets the sub-ranges of [start, end) the bars of the ticker were not recorded for"""
+        return get_missing(self.get_ranges(ticker, interval), start, end)
+
+    def download(
+        self, tickers: list, interval: str, start: pd.Timestamp, end: pd.Timestamp
+    ) -> pd.DataFrame:
+        frames = {}
+        for ticker in tickers:
+            if self.record_from is not None:
+                for missing_start, missing_end in self.get_missing(ticker, interval, start, end):
+                    recorded = self.record_from.download(
+                        [ticker], interval, missing_start, missing_end
+                    )
+                    # An empty frame may just be a failed download, so it is not recorded as covered
+                    if not recorded.empty:
+                        self.save(
+                            ticker,
+                            interval,
+                            recorded.xs(ticker, axis=1, level=-1),
+                            missing_start,
+                            missing_end,
+                        )
+            data = self.load(ticker, interval)
+            if data is None or data.empty:
+                continue
+            bounds = [start, end]
+            if data.index.tz is not None:
+                bounds = [
+                    bound.tz_localize(data.index.tz) if bound.tz is None else bound
+                    for bound in bounds
+                ]
+            frames[ticker] = data[(data.index >= bounds[0]) & (data.index < bounds[1])]
+        frames = {ticker: data for ticker, data in frames.items() if not data.empty}
+        if not frames:
+            return _empty(tickers)
+        data = pd.concat(frames, axis=1, names=["Ticker", "Price"])
+        return data.swaplevel(axis=1).sort_index(axis=1, level=0, sort_remaining=False)
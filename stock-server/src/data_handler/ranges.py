@@ -0,0 +1,37 @@
+import pandas as pd
+
+
+def to_wall_ns(date: pd.Timestamp) -> int:
+    """Converts a timestamp to nanoseconds of exchange wall-clock time"""
+    date = pd.Timestamp(date)
+    if date.tzinfo is not None:
+        date = date.tz_localize(None)
+    return int(date.value)
+
+
+def merge_ranges(ranges: list) -> list:
+    """Merges overlapping or touching [start, end) ranges"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def get_missing(ranges: list, start: pd.Timestamp, end: pd.Timestamp) -> list:
+    """Gets the sub-ranges of [start, end) that the sorted, merged ranges do not cover"""
+    cursor, end_ns = to_wall_ns(start), to_wall_ns(end)
+    missing = []
+    for covered_start, covered_end in ranges:
+        if covered_end <= cursor:
+            continue
+        if covered_start >= end_ns:
+            break
+        if covered_start > cursor:
+            missing.append((cursor, covered_start))
+        cursor = max(cursor, covered_end)
+    if cursor < end_ns:
+        missing.append((cursor, end_ns))
+    return [(pd.Timestamp(start), pd.Timestamp(end)) for start, end in missing]
@@ -0,0 +1,108 @@
+import socket
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+
+class RedisError(Exception):
+    """An error reply from a Redis server"""
+
+
+def _encode(args: tuple) -> bytes:
+    parts = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(f"${len(arg)}\r\n".encode() + arg + b"\r\n")
+    return b"".join(parts)
+
+
+def _read_reply(file):
+    """Reads a RESP reply, raising RedisError for error replies"""
+    line = file.readline()
+    if not line:
+        raise ConnectionError("Connection closed by the server")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        raise RedisError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length == -1:
+            return None
+        data = file.read(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        length = int(rest)
+        if length == -1:
+            return None
+        return [_read_reply(file) for _ in range(length)]
+    raise RedisError(f"Unknown reply type {kind!r}")
+
+
+class RedisClient:
+    """A minimal client for servers that speak the Redis protocol
+
+    Each thread gets its own connection, so commands that belong together,
+    such as WATCH, MULTI and EXEC, are sent over the same connection, within
+    transaction() so a failure halfway does not leave the connection in the
+    middle of a transaction for the next command.
+    """
+
+    host: str
+    port: int
+    timeout: float
+
+    def __init__(self, host: str = "localhost", port: int = 6379, timeout: float = 5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisClient":
+        """Creates a client for a redis://host:port URL"""
+        parsed = urlparse(url)
+        return cls(parsed.hostname or "localhost", parsed.port or 6379, **kwargs)
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            sock = socket.create_connection((self.host, self.port), self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = (sock, sock.makefile("rb"))
+            self._local.connection = connection
+        return connection
+
+    def close(self) -> None:
+        """Closes the connection of the calling thread"""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            self._local.connection = None
+            connection[1].close()
+            connection[0].close()
+
+    def execute(self, *args):
+        """Sends a command and returns its reply"""
+        sock, file = self._connect()
+        try:
+            sock.sendall(_encode(args))
+            return _read_reply(file)
+        except (OSError, ConnectionError):
+            # The connection is in an unknown state, the next command reconnects
+            self.close()
+            raise
+
+    @contextmanager
+    def transaction(self):
+        """Sends the commands of a WATCH or MULTI block, closing the connection if any of them fails"""
+        try:
+            yield self
+        except BaseException:
+            # The server may still hold the watched keys or queued commands of this
+            # connection, the next command reconnects without them
+            self.close()
+            raise
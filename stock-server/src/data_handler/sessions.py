@@ -0,0 +1,219 @@
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from data_handler.handler import Handler
+from data_handler.journal import Journal
+from data_handler.shared_state import SharedSession, StateBackend
+
+DEFAULT_SESSION = "default"
+
+_session_id_pattern = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class SessionManager:
+    """Keeps an independent Handler per session
+
+    Handlers are kept in least recently used order. When there are more than
+    max_sessions in memory, or a session has been idle for longer than
+    idle_timeout seconds, its state is spilled to spill_dir and loaded again
+    on its next request. Without a spill_dir evicted sessions are dropped.
+
+    With a journal, every change of a session is persisted as it happens, so
+    sessions survive restarts. Evicted sessions are then snapshotted to the
+    journal instead of spilled, and restored from it.
+
+    With a shared state backend, the state of every session and the prices
+    are shared by all replicas of the server. Handlers are then only local
+    copies, brought up to date on every request and simply dropped on
+    eviction.
+    """
+
+    max_sessions: int
+    idle_timeout: float or None
+    spill_dir: str or None
+    journal: Journal or None
+    shared: StateBackend or None
+
+    def __init__(
+        self,
+        create_handler,
+        max_sessions: int = 1000,
+        idle_timeout: float or None = None,
+        spill_dir: str or None = None,
+        journal: Journal or None = None,
+        shared: StateBackend or None = None,
+    ):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.spill_dir = spill_dir
+        self.journal = journal
+        self.shared = shared
+        self._create_handler = create_handler
+        self._handlers = OrderedDict()
+        self._last_used = {}
+        # Sessions being loaded, spilled or removed, with the event set once that is done
+        self._busy = {}
+        self._lock = threading.Lock()
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def get(self, session_id: str) -> Handler:
+        """Gets the handler for the given session, creating it if it does not exist
+
+        The lock only guards the handlers and their order. Sessions are loaded
+        and spilled outside of it, so a slow disk or journal only holds up the
+        requests of the sessions it is loading or spilling.
+
+        """
+        if not _session_id_pattern.match(session_id):
+            raise ValueError(f"Invalid session id {session_id!r}")
+        evicted = []
+        while True:
+            with self._lock:
+                handler = self._handlers.get(session_id)
+                busy = self._busy.get(session_id)
+                if handler is not None:
+                    now = time.monotonic()
+                    self._handlers.move_to_end(session_id)
+                    self._last_used[session_id] = now
+                    evicted = self._evict(now)
+                    break
+                if busy is None:
+                    # This request loads the session, others for it wait until it is done
+                    busy = self._busy[session_id] = threading.Event()
+                    break
+            busy.wait()
+        if handler is None:
+            try:
+                handler = self._open(session_id)
+            finally:
+                with self._lock:
+                    del self._busy[session_id]
+                    if handler is not None:
+                        now = time.monotonic()
+                        self._handlers[session_id] = handler
+                        self._last_used[session_id] = now
+                        evicted = self._evict(now)
+                busy.set()
+        self._spill_evicted(evicted)
+        # Outside of the lock, so a slow backend only holds up requests of this session
+        handler.sync()
+        return handler
+
+    def _open(self, session_id: str) -> Handler:
+        """Creates the handler of a session that is not in memory, loading its state if it has one"""
+        handler = self._create_handler()
+        if self.shared is not None:
+            handler.shared = SharedSession(self.shared, session_id)
+            handler.price_cache.backend = self.shared
+            return handler
+        state = self._load(session_id)
+        if state is not None:
+            handler.set_state(state)
+        elif self.journal is not None:
+            self.journal.restore(session_id, handler)
+        if self.journal is not None:
+            handler.journal = self.journal.for_session(session_id)
+            if state is not None:
+                # A spilled state is not in the journal yet, so it becomes its snapshot
+                handler.checkpoint()
+        return handler
+
+    def remove(self, session_id: str) -> None:
+        """Removes the given session from memory and disk"""
+        while True:
+            with self._lock:
+                busy = self._busy.get(session_id)
+                if busy is None:
+                    busy = self._busy[session_id] = threading.Event()
+                    handler = self._handlers.pop(session_id, None)
+                    self._last_used.pop(session_id, None)
+                    break
+            busy.wait()
+        try:
+            if handler is not None:
+                handler.journal = None
+                handler.shared = None
+            if self.journal is not None:
+                self.journal.remove(session_id)
+            if self.shared is not None:
+                self.shared.delete_state(session_id)
+            if self.spill_dir is not None:
+                try:
+                    os.remove(self._get_path(session_id))
+                except FileNotFoundError:
+                    pass
+        finally:
+            with self._lock:
+                del self._busy[session_id]
+            busy.set()
+
+    def _evict(self, now: float) -> list:
+        """Takes the sessions beyond the limits out of memory, must be called while holding the lock
+
+        Returns the (session id, handler, event) of every evicted session, which
+        are marked as busy until _spill_evicted spilled them.
+
+        """
+        evicted = []
+        while self._handlers:
+            session_id = next(iter(self._handlers))
+            idle = (
+                self.idle_timeout is not None
+                and now - self._last_used[session_id] > self.idle_timeout
+            )
+            if len(self._handlers) <= self.max_sessions and not idle:
+                break
+            handler = self._handlers.pop(session_id)
+            del self._last_used[session_id]
+            busy = self._busy[session_id] = threading.Event()
+            evicted.append((session_id, handler, busy))
+        return evicted
+
+    def _spill_evicted(self, evicted: list) -> None:
+        """Spills the evicted sessions, without holding the lock"""
+        for session_id, handler, busy in evicted:
+            try:
+                self._spill(session_id, handler)
+            finally:
+                with self._lock:
+                    del self._busy[session_id]
+                busy.set()
+
+    def _get_path(self, session_id: str) -> str:
+        return os.path.join(self.spill_dir, f"{session_id}.pickle")
+
+    def _spill(self, session_id: str, handler: Handler) -> None:
+        if self.shared is not None:
+            return
+        if self.journal is not None:
+            handler.checkpoint()
+            return
+        if self.spill_dir is None:
+            return
+        path = self._get_path(session_id)
+        with open(path + ".tmp", "wb") as file:
+            pickle.dump(handler.get_state(), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    def _load(self, session_id: str) -> dict or None:
+        if self.spill_dir is None:
+            return None
+        path = self._get_path(session_id)
+        try:
+            with open(path, "rb") as file:
+                state = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        os.remove(path)
+        return state
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._handlers
+
+    def __len__(self) -> int:
+        return len(self._handlers)
@@ -0,0 +1,235 @@
+import pickle
+import sqlite3
+import threading
+
+from data_handler.resp import RedisClient
+
+
+def _encode_price(price: float or None) -> bytes:
+    return b"none" if price is None else repr(float(price)).encode()
+
+
+def _decode_price(data: bytes) -> float or None:
+    return None if data == b"none" else float(data)
+
+
+class StateBackend:
+    """Stores session states and prices where every replica of the server can read them
+
+    Session states are versioned. A state is only saved if the stored version
+    is still the one it was based on, which makes concurrent trades on several
+    replicas optimistic: the loser reloads the winner's state and retries.
+    """
+
+    def get_version(self, session_id: str) -> int:
+        """Gets the version of the stored state of a session, 0 if it has none"""
+        raise NotImplementedError
+
+    def load_state(self, session_id: str) -> (int, bytes or None):
+        """Loads the version and the stored state of a session"""
+        raise NotImplementedError
+
+    def save_state(self, session_id: str, version: int, state: bytes) -> bool:
+        """Saves the state of a session as version + 1 if the stored version is still version"""
+        raise NotImplementedError
+
+    def delete_state(self, session_id: str) -> None:
+        """Deletes the stored state of a session"""
+        raise NotImplementedError
+
+    def get_price(self, key: str) -> (bool, float or None):
+        """Looks up a shared price and returns if it was found as well as the price"""
+        raise NotImplementedError
+
+    def put_price(self, key: str, price: float or None) -> None:
+        """Shares a price"""
+        raise NotImplementedError
+
+
+class SQLiteStateBackend(StateBackend):
+    """Keeps the shared state in a SQLite database, for replicas on one host or volume"""
+
+    path: str
+
+    def __init__(self, path: str, timeout: float = 5.0):
+        self.path = path
+        self.timeout = timeout
+        # Connections are per thread and opened on first use, so forked workers do not share them
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    state BLOB NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS prices (
+                    key TEXT PRIMARY KEY,
+                    price BLOB NOT NULL
+                );
+                """
+            )
+            self._local.connection = connection
+        return connection
+
+    def get_version(self, session_id: str) -> int:
+        row = (
+            self._connect()
+            .execute("SELECT version FROM sessions WHERE id = ?", (session_id,))
+            .fetchone()
+        )
+        return 0 if row is None else row[0]
+
+    def load_state(self, session_id: str) -> (int, bytes or None):
+        row = (
+            self._connect()
+            .execute("SELECT version, state FROM sessions WHERE id = ?", (session_id,))
+            .fetchone()
+        )
+        return (0, None) if row is None else (row[0], row[1])
+
+    def save_state(self, session_id: str, version: int, state: bytes) -> bool:
+        connection = self._connect()
+        with connection:
+            if version == 0:
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO sessions VALUES (?, 1, ?)", (session_id, state)
+                )
+            else:
+                cursor = connection.execute(
+                    "UPDATE sessions SET version = version + 1, state = ?"
+                    " WHERE id = ? AND version = ?",
+                    (state, session_id, version),
+                )
+        return cursor.rowcount == 1
+
+    def delete_state(self, session_id: str) -> None:
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def get_price(self, key: str) -> (bool, float or None):
+        row = (
+            self._connect()
+            .execute("SELECT price FROM prices WHERE key = ?", (key,))
+            .fetchone()
+        )
+        return (False, None) if row is None else (True, _decode_price(row[0]))
+
+    def put_price(self, key: str, price: float or None) -> None:
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO prices VALUES (?, ?)", (key, _encode_price(price))
+            )
+
+
+class RedisStateBackend(StateBackend):
+    """Keeps the shared state in Redis, or any server that speaks its protocol
+
+    Versions are checked with WATCH, MULTI and EXEC. Prices expire after
+    price_ttl seconds, so the shared cache does not grow without bound.
+    """
+
+    client: RedisClient
+    prefix: str
+    price_ttl: int
+
+    def __init__(self, client: RedisClient, prefix: str = "stocks:", price_ttl: int = 86400):
+        self.client = client
+        self.prefix = prefix
+        self.price_ttl = price_ttl
+
+    def _get_keys(self, session_id: str) -> (str, str):
+        key = f"{self.prefix}session:{session_id}"
+        return f"{key}:version", f"{key}:state"
+
+    def get_version(self, session_id: str) -> int:
+        version = self.client.execute("GET", self._get_keys(session_id)[0])
+        return 0 if version is None else int(version)
+
+    def load_state(self, session_id: str) -> (int, bytes or None):
+        version_key, state_key = self._get_keys(session_id)
+        # The version and state are read in a transaction, so they belong together
+        with self.client.transaction():
+            self.client.execute("MULTI")
+            self.client.execute("GET", version_key)
+            self.client.execute("GET", state_key)
+            version, state = self.client.execute("EXEC")
+        return (0, None) if version is None else (int(version), state)
+
+    def save_state(self, session_id: str, version: int, state: bytes) -> bool:
+        version_key, state_key = self._get_keys(session_id)
+        with self.client.transaction():
+            self.client.execute("WATCH", version_key)
+            stored = self.client.execute("GET", version_key)
+            if (0 if stored is None else int(stored)) != version:
+                self.client.execute("UNWATCH")
+                return False
+            self.client.execute("MULTI")
+            self.client.execute("SET", version_key, version + 1)
+            self.client.execute("SET", state_key, state)
+            # EXEC replies with nothing if the version changed after WATCH
+            return self.client.execute("EXEC") is not None
+
+    def delete_state(self, session_id: str) -> None:
+        self.client.execute("DEL", *self._get_keys(session_id))
+
+    def get_price(self, key: str) -> (bool, float or None):
+        data = self.client.execute("GET", f"{self.prefix}price:{key}")
+        return (False, None) if data is None else (True, _decode_price(data))
+
+    def put_price(self, key: str, price: float or None) -> None:
+        self.client.execute(
+            "SET", f"{self.prefix}price:{key}", _encode_price(price), "EX", self.price_ttl
+        )
+
+
+class SharedSession:
+    """Keeps a handler in sync with the shared state of its session"""
+
+    session_id: str
+    version: int
+
+    def __init__(self, backend: StateBackend, session_id: str):
+        self.session_id = session_id
+        self.version = 0
+        self._backend = backend
+
+    def sync(self, handler) -> None:
+        """Loads the shared state into the handler if another replica changed it
+
+        Must be called while holding the handler's lock.
+
+        """
+        if self._backend.get_version(self.session_id) != self.version:
+            self._load(handler)
+
+    def _load(self, handler) -> bool:
+        version, state = self._backend.load_state(self.session_id)
+        self.version = version
+        # Without a stored state, the session was deleted and the handler keeps its own
+        if state is None:
+            return False
+        handler.set_state(pickle.loads(state))
+        return True
+
+    def commit(self, handler) -> bool:
+        """Saves the handler's state, must be called while holding the handler's lock
+
+        Returns False if another replica changed the state first, in which case
+        the handler has been loaded with that state and the change must be retried.
+
+        """
+        state = pickle.dumps(handler.get_state(), protocol=pickle.HIGHEST_PROTOCOL)
+        while not self._backend.save_state(self.session_id, self.version, state):
+            if self._load(handler):
+                return False
+        self.version += 1
+        return True
@@ -0,0 +1,208 @@
+import fcntl
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from data_handler.bars import BAR_CACHE, BarCache, Bars, merge_bars, to_bar_columns
+from data_handler.ranges import get_missing, merge_ranges, to_wall_ns
+
+# Reads of a partition whose files keep disappearing, after which it counts as missing
+_LOAD_ATTEMPTS = 3
+
+
+class PriceStore:
+    """Stores historical OHLCV bars on disk, partitioned by interval and ticker
+
+    Every partition is a directory holding one .npy file per column, the bar
+    timestamps as int64 nanoseconds of exchange wall-clock time, and a
+    meta.json file that records the column names, the timezone and which
+    [start, end) ranges have already been fetched. Bars are only recorded as
+    covered once they are final, so historical ranges are never fetched twice.
+
+    Only the columns of BAR_DTYPES are kept, in their compact dtypes. Partitions
+    are read whole into a BarCache, which holds them within the memory budget
+    of the process. A partition is read from disk again when its meta.json
+    changed, so writes of other processes are seen. Writes hold a lock file in
+    the partition, so processes sharing the store write it one at a time.
+    """
+
+    root: str
+    cache: BarCache
+
+    def __init__(self, root: str, cache: BarCache or None = None):
+        self.root = root
+        self.cache = cache if cache is not None else BAR_CACHE
+        self._lock = threading.Lock()
+
+    def _get_path(self, ticker: str, interval: str) -> str:
+        return os.path.join(self.root, interval, ticker.upper())
+
+    @contextmanager
+    def _lock_partition(self, path: str):
+        """Holds the partition for writing against other threads and processes"""
+        with self._lock:
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, ".lock"), "a") as file:
+                fcntl.flock(file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+
+    def _get_token(self, path: str) -> tuple or None:
+        """Identifies the generation of a partition without reading it, None if it has none"""
+        try:
+            stat = os.stat(os.path.join(path, "meta.json"))
+        except FileNotFoundError:
+            return None
+        # meta.json is replaced rather than written to, so a new generation is a new file
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _load_meta(self, path: str) -> dict or None:
+        try:
+            with open(os.path.join(path, "meta.json")) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def _load_columns(self, path: str, meta: dict) -> (np.ndarray, dict):
+        index = np.load(os.path.join(path, meta["index"]), mmap_mode="r")
+        columns = {
+            name: np.load(os.path.join(path, file), mmap_mode="r")
+            for name, file in zip(meta["columns"], meta["files"])
+        }
+        return index, columns
+
+    def _load(self, path: str) -> Bars or None:
+        # A concurrent write may remove the generation we just read the meta for, so retry.
+        # Files that stay missing are lost, and the partition is fetched again
+        for _ in range(_LOAD_ATTEMPTS):
+            token = self._get_token(path)
+            meta = self._load_meta(path)
+            if meta is None:
+                return None
+            try:
+                index, columns = self._load_columns(path, meta)
+            except FileNotFoundError:
+                continue
+            # Partitions written before bars were compacted are compacted as they are read
+            data = pd.DataFrame({name: np.array(values) for name, values in columns.items()})
+            return Bars(
+                np.array(index, dtype=np.int64),
+                to_bar_columns(data),
+                meta["tz"],
+                meta["index_name"],
+                meta["coverage"],
+                token,
+            )
+        print(f"Partition {path} is missing files, fetching it again")
+        return None
+
+    def _get_bars(self, ticker: str, interval: str) -> Bars or None:
+        """Gets the bars of a partition from memory, reading them from disk if they changed"""
+        path = self._get_path(ticker, interval)
+        key = (self.root, interval, ticker.upper())
+        token = self._get_token(path)
+        if token is None:
+            self.cache.discard(key)
+            return None
+        bars = self.cache.get(key)
+        if bars is not None and bars.token == token:
+            return bars
+        bars = self._load(path)
+        if bars is not None:
+            self.cache.put(key, bars)
+        return bars
+
+    def get_missing(
+        self, ticker: str, interval: str, start: pd.Timestamp, end: pd.Timestamp
+    ) -> list:
+        """Gets the sub-ranges of [start, end) that are not held locally"""
+        bars = self._get_bars(ticker, interval)
+        return get_missing(bars.coverage if bars is not None else [], start, end)
+
+    def read(
+        self, ticker: str, interval: str, start: pd.Timestamp, end: pd.Timestamp
+    ) -> pd.DataFrame:
+        """Reads the bars in [start, end) that are held locally"""
+        bars = self._get_bars(ticker, interval)
+        if bars is None:
+            return pd.DataFrame()
+        return bars.to_frame(to_wall_ns(start), to_wall_ns(end))
+
+    def write(
+        self,
+        ticker: str,
+        interval: str,
+        start: pd.Timestamp,
+        end: pd.Timestamp,
+        data: pd.DataFrame,
+    ) -> None:
+        """Merges freshly downloaded bars for [start, end) into the store"""
+        path = self._get_path(ticker, interval)
+        # Bars from today onwards may still change, so they are kept but not marked as covered
+        final_ns = to_wall_ns(pd.Timestamp.today().normalize() - pd.Timedelta(days=1))
+        with self._lock_partition(path):
+            # Read under the lock, so the bars of a write that just finished elsewhere are merged
+            stored = self._get_bars(ticker, interval)
+            tz = None if data.index.tz is None else str(data.index.tz)
+            index_name = data.index.name or "Datetime"
+            if data.index.tz is not None:
+                data = data.tz_localize(None)
+            new_index = data.index.values.astype("datetime64[ns]").view(np.int64)
+            new_columns = to_bar_columns(data)
+            if stored is not None:
+                index, columns = merge_bars(
+                    stored.index, stored.columns, new_index, new_columns
+                )
+                tz = tz or stored.tz
+                index_name = stored.index_name
+                coverage = stored.coverage
+                meta = self._load_meta(path)
+                generation = meta["generation"] + 1
+            else:
+                index, columns = merge_bars(
+                    np.empty(0, dtype=np.int64), {}, new_index, new_columns
+                )
+                meta = None
+                coverage = []
+                generation = 0
+            start_ns, end_ns = to_wall_ns(start), min(to_wall_ns(end), final_ns)
+            if start_ns < end_ns:
+                coverage = merge_ranges(coverage + [[start_ns, end_ns]])
+
+            # Unique names, so no writer ever replaces or removes the files of another
+            suffix = f"{generation}.{uuid.uuid4().hex}"
+            files = [f"c{i}.{suffix}.npy" for i in range(len(columns))]
+            index_file = f"index.{suffix}.npy"
+            np.save(os.path.join(path, index_file), index)
+            for values, file in zip(columns.values(), files):
+                np.save(os.path.join(path, file), values)
+            new_meta = {
+                "generation": generation,
+                "index": index_file,
+                "index_name": index_name,
+                "tz": tz,
+                "columns": list(columns),
+                "files": files,
+                "coverage": coverage,
+            }
+            # Readers only ever see a complete generation because meta.json is swapped in atomically
+            tmp_path = os.path.join(path, f"meta.json.{os.getpid()}.{suffix}.tmp")
+            with open(tmp_path, "w") as file:
+                json.dump(new_meta, file)
+            os.replace(tmp_path, os.path.join(path, "meta.json"))
+            self.cache.put(
+                (self.root, interval, ticker.upper()),
+                Bars(index, columns, tz, index_name, coverage, self._get_token(path)),
+            )
+            if meta is not None:
+                for file in [meta["index"]] + meta["files"]:
+                    try:
+                        os.remove(os.path.join(path, file))
+                    except OSError:
+                        pass
@@ -0,0 +1,255 @@
+import threading
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.holiday import (
+    AbstractHolidayCalendar,
+    GoodFriday,
+    Holiday,
+    USLaborDay,
+    USMemorialDay,
+    USPresidentsDay,
+    USThanksgivingDay,
+    nearest_workday,
+    sunday_to_monday,
+)
+from pandas.tseries.offsets import DateOffset, Day
+from dateutil.relativedelta import MO, TH
+
+_MINUTE = pd.Timedelta(minutes=1).value
+_DAY = pd.Timedelta(days=1).value
+
+
+class NYSEHolidayCalendar(AbstractHolidayCalendar):
+    """The regular full day holidays of the New York Stock Exchange"""
+
+    rules = [
+        # A New Year's Day on a Saturday is not made up for on the Friday before
+        Holiday("New Year's Day", month=1, day=1, observance=sunday_to_monday),
+        Holiday(
+            "Martin Luther King Jr. Day",
+            start_date="1998-01-01",
+            month=1,
+            day=1,
+            offset=DateOffset(weekday=MO(3)),
+        ),
+        USPresidentsDay,
+        GoodFriday,
+        USMemorialDay,
+        Holiday(
+            "Juneteenth", start_date="2022-01-01", month=6, day=19, observance=nearest_workday
+        ),
+        Holiday("Independence Day", month=7, day=4, observance=nearest_workday),
+        USLaborDay,
+        USThanksgivingDay,
+        Holiday("Christmas Day", month=12, day=25, observance=nearest_workday),
+    ]
+
+
+class NYSEEarlyCloseCalendar(AbstractHolidayCalendar):
+    """The regular days the New York Stock Exchange closes early on, if it has a session"""
+
+    rules = [
+        # Before a July 4th on a weekend or a Monday, the day before is a holiday or a weekend
+        Holiday(
+            "Day before Independence Day",
+            start_date="1995-01-01",
+            month=7,
+            day=3,
+            days_of_week=(0, 1, 3),
+        ),
+        # Until 2013, a July 4th on a Thursday was followed by an early close instead
+        Holiday(
+            "Wednesday before Independence Day",
+            start_date="2013-01-01",
+            month=7,
+            day=3,
+            days_of_week=(2,),
+        ),
+        Holiday(
+            "Friday after Independence Day",
+            start_date="1995-01-01",
+            end_date="2012-12-31",
+            month=7,
+            day=5,
+            days_of_week=(4,),
+        ),
+        Holiday(
+            "Day after Thanksgiving",
+            start_date="1993-01-01",
+            month=11,
+            day=1,
+            offset=[DateOffset(weekday=TH(4)), Day(1)],
+        ),
+        # A Christmas Eve on a Friday is the observed Christmas Day
+        Holiday(
+            "Christmas Eve",
+            start_date="1993-01-01",
+            month=12,
+            day=24,
+            days_of_week=(0, 1, 2, 3),
+        ),
+    ]
+
+
+# Days the exchange closed for events rather than holidays
+SPECIAL_CLOSURES = [
+    "2001-09-11",
+    "2001-09-12",
+    "2001-09-13",
+    "2001-09-14",
+    "2004-06-11",
+    "2007-01-02",
+    "2012-10-29",
+    "2012-10-30",
+    "2018-12-05",
+    "2025-01-09",
+]
+
+
+class TradingCalendar:
+    """The trading sessions of an exchange, precomputed for a range of years
+
+    Sessions are kept as sorted arrays of their days, opening and closing times
+    in nanoseconds of exchange wall-clock time, so finding the session of any
+    instant is a binary search. The sessions are computed on first use and
+    then shared by every thread. Times outside the range of years are treated
+    as if the market had been closed.
+    """
+
+    tz: str
+    start_year: int
+    end_year: int
+
+    def __init__(
+        self,
+        tz: str = "America/New_York",
+        open_time: str = "9:30",
+        close_time: str = "16:00",
+        early_close_time: str = "13:00",
+        start_year: int = 1980,
+        end_year: int = 2050,
+    ):
+        self.tz = tz
+        self.start_year = start_year
+        self.end_year = end_year
+        self._open = pd.Timedelta(f"{open_time}:00").value
+        self._close = pd.Timedelta(f"{close_time}:00").value
+        self._early_close = pd.Timedelta(f"{early_close_time}:00").value
+        self._sessions = None
+        self._lock = threading.Lock()
+
+    def get_holidays(self) -> pd.DatetimeIndex:
+        """Gets the days in the range of years the market is closed on although they are weekdays"""
+        start, end = f"{self.start_year}-01-01", f"{self.end_year}-12-31"
+        holidays = NYSEHolidayCalendar().holidays(start, end)
+        return holidays.union(pd.DatetimeIndex(SPECIAL_CLOSURES))
+
+    def _get_early_closes(self, days: pd.DatetimeIndex) -> np.ndarray:
+        """Gets which of the session days close early, around Independence Day, Thanksgiving and Christmas"""
+        early_closes = NYSEEarlyCloseCalendar().holidays(days[0], days[-1])
+        return np.isin(days.values, early_closes.values.astype(days.values.dtype))
+
+    def _load(self) -> (np.ndarray, np.ndarray, np.ndarray):
+        with self._lock:
+            if self._sessions is None:
+                days = np.arange(
+                    f"{self.start_year}-01-01", f"{self.end_year + 1}-01-01", dtype="datetime64[D]"
+                )
+                # The epoch was a Thursday, so this is the weekday with Monday as 0
+                weekdays = (days.view(np.int64) + 3) % 7
+                day_ns = days.astype("datetime64[ns]").view(np.int64)
+                holiday_ns = self.get_holidays().values.astype("datetime64[ns]").view(np.int64)
+                sessions = (weekdays < 5) & ~np.isin(day_ns, holiday_ns)
+                days, day_ns = pd.DatetimeIndex(days[sessions]), day_ns[sessions]
+                closes = np.where(self._get_early_closes(days), self._early_close, self._close)
+                self._sessions = (day_ns, day_ns + self._open, day_ns + closes)
+            return self._sessions
+
+    def _to_ns(self, date: pd.Timestamp) -> int:
+        """Converts a timestamp to nanoseconds of exchange wall-clock time"""
+        date = pd.Timestamp(date)
+        if date.tzinfo is not None:
+            date = date.tz_convert(self.tz).tz_localize(None)
+        return int(date.value)
+
+    def _find(self, date: pd.Timestamp) -> int:
+        """Finds the index of the last session that opens on the day of the given date or before"""
+        days = self._load()[0]
+        return int(np.searchsorted(days, self._to_ns(date), side="right")) - 1
+
+    def is_session(self, day: pd.Timestamp) -> bool:
+        """Gets if the market has a session on the given day"""
+        days = self._load()[0]
+        i = self._find(day)
+        return i >= 0 and days[i] == self._to_ns(pd.Timestamp(day).normalize())
+
+    def is_open(self, date: pd.Timestamp) -> bool:
+        """Gets if the market is open at the given time"""
+        _, opens, closes = self._load()
+        i = self._find(date)
+        date_ns = self._to_ns(date)
+        return i >= 0 and opens[i] <= date_ns < closes[i]
+
+    def get_sessions(self, start: pd.Timestamp, end: pd.Timestamp) -> pd.DatetimeIndex:
+        """Gets the days of the sessions from start up to end"""
+        days = self._load()[0]
+        low, high = np.searchsorted(days, [self._to_ns(start), self._to_ns(end)])
+        return pd.DatetimeIndex(days[low:high].view("datetime64[ns]"))
+
+    def get_minutes(self, start: pd.Timestamp, end: pd.Timestamp) -> pd.DatetimeIndex:
+        """Gets the starts of the minute bars from start up to end in exchange wall-clock time"""
+        days, opens, closes = self._load()
+        start_ns, end_ns = self._to_ns(start), self._to_ns(end)
+        low, high = np.searchsorted(days, [start_ns - _DAY, end_ns])
+        counts = (closes[low:high] - opens[low:high]) // _MINUTE
+        # Every session's minutes count up from its open
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        minutes = np.repeat(opens[low:high], counts) + offsets * _MINUTE
+        minutes = minutes[(minutes >= start_ns) & (minutes < end_ns)]
+        return pd.DatetimeIndex(minutes.view("datetime64[ns]"))
+
+    def get_daily_bars(self, dates: pd.DatetimeIndex) -> np.ndarray:
+        """Gets the starts of the last daily bars that closed at or before each of the given dates
+
+        The starts are in nanoseconds of exchange wall-clock time, and the
+        smallest int64 for dates before the first session closed.
+
+        """
+        days, _, closes = self._load()
+        if dates.tz is not None:
+            dates = dates.tz_convert(self.tz).tz_localize(None)
+        # Until a session closes, the last known daily bar is the previous session's
+        dates_ns = dates.values.astype("datetime64[ns]").view(np.int64)
+        i = np.searchsorted(closes, dates_ns, side="right") - 1
+        return np.where(i >= 0, days[np.maximum(i, 0)], np.iinfo(np.int64).min)
+
+    def get_bar(self, date: pd.Timestamp, interval: str) -> pd.Timestamp or None:
+        """Gets the start of the last bar of the interval that is known at the given date
+
+        Daily bars start at midnight of their session's day and are known once
+        the session closed. When the market is closed, the last minute bar is
+        the one before the last session closed. Returns None before the first
+        session.
+
+        """
+        days, opens, closes = self._load()
+        if interval == "1d":
+            i = int(np.searchsorted(closes, self._to_ns(date), side="right")) - 1
+            return None if i < 0 else pd.Timestamp(days[i])
+        i = self._find(date)
+        if i < 0:
+            return None
+        if interval == "1m":
+            date_ns = self._to_ns(date)
+            if date_ns < opens[i]:
+                # Before the open the last bar is the previous session's
+                i -= 1
+                if i < 0:
+                    return None
+            last_ns = min(date_ns, closes[i] - 1)
+            return pd.Timestamp(last_ns - (last_ns - opens[i]) % _MINUTE)
+        raise ValueError(f"Unsupported interval: {interval}")
+
+
+NYSE = TradingCalendar()
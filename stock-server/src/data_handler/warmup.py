@@ -0,0 +1,61 @@
+import threading
+import time
+
+from data_handler.sessions import DEFAULT_SESSION, SessionManager
+
+
+class WarmUp:
+    """Warms a server process up before it reports that it is ready
+
+    The warm-up runs once, in a background thread of the process that serves
+    requests. It loads the data provider and the trading calendar, then prices
+    a watchlist of tickers in the default session from the local price store,
+    so the first requests do not pay for a cold start. Tickers without bars in
+    the store are skipped rather than downloaded.
+    """
+
+    tickers: list
+    warmed: list
+    duration: float or None
+
+    def __init__(self, sessions: SessionManager, tickers: list = ()):
+        self.tickers = list(tickers)
+        self.warmed = []
+        self.duration = None
+        self._sessions = sessions
+        self._ready = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Starts the warm-up unless it has been started already"""
+        if self._thread is not None:
+            return
+        # The thread is started lazily so it lives in the process that serves requests
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name="warm-up", daemon=True)
+                self._thread.start()
+
+    def is_ready(self) -> bool:
+        """Gets if the warm-up is done"""
+        return self._ready.is_set()
+
+    def wait(self, timeout: float or None = None) -> bool:
+        """Waits until the warm-up is done and returns if it is"""
+        return self._ready.wait(timeout)
+
+    def run(self) -> None:
+        """Warms up in the calling thread"""
+        start = time.perf_counter()
+        try:
+            stock_handler = self._sessions.get(DEFAULT_SESSION)
+            stock_handler.provider.warm_up()
+            stock_handler.calendar.get_sessions(stock_handler.date, stock_handler.date)
+            self.warmed = stock_handler.warm_up(self.tickers)
+        except Exception as e:
+            # A failed warm-up only makes the first requests slower, so the process is still ready
+            print(f"Warm-up failed: {e}")
+        finally:
+            self.duration = time.perf_counter() - start
+            self._ready.set()
@@ -0,0 +1,65 @@
+import gzip
+import zlib
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Encodings in order of preference, brotli is only offered when it is installed
+ENCODINGS = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def get_encoding() -> str or None:
+    """This function gets the best encoding the client accepts, if any."""
+    return request.accept_encodings.best_match(ENCODINGS)
+
+
+def compress_body(data: bytes, encoding: str) -> bytes:
+    """This function compresses a whole response body with the given encoding."""
+    if encoding == "br":
+        # Higher qualities cost far more CPU for little gain on JSON
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def _gzip_stream(chunks):
+    """This function gzips a streamed body, flushing after every chunk so clients can parse as it arrives."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def compress(response: Response, min_size: int) -> Response:
+    """This function compresses a response if the client accepts it.
+
+    Bodies smaller than min_size bytes are not worth compressing and are left as they are.
+    Compressed responses get a weak ETag, since their bytes differ from the uncompressed ones.
+
+    """
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    if response.is_streamed:
+        # Streamed bodies are gzipped as they go, since their size is not known up front
+        if request.accept_encodings["gzip"]:
+            response.response = _gzip_stream(response.iter_encoded())
+            response.headers["Content-Encoding"] = "gzip"
+        return response
+    data = response.get_data()
+    encoding = get_encoding()
+    if len(data) < min_size or encoding is None:
+        return response
+    response.set_data(compress_body(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    etag, _ = response.get_etag()
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+    return response
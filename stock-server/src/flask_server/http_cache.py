@@ -0,0 +1,67 @@
+import hashlib
+import uuid
+
+import pandas as pd
+from flask import Response, request
+
+# Responses over ranges that have fully passed never change
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Responses that depend on the simulation state must be revalidated on every use
+REVALIDATE = "private, no-cache"
+
+# Handler versions restart with the process, so state ETags also name the process
+_process_id = uuid.uuid4().hex
+
+
+def get_state_etag(session_id: str, version: int) -> str:
+    """This function gets the ETag of a response that only depends on the state of a session."""
+    key = f"{_process_id}-{session_id}-{version}".encode()
+    return hashlib.blake2b(key, digest_size=16).hexdigest()
+
+
+def get_content_etag(data: bytes) -> str:
+    """This function gets the ETag of a response from a hash of its body."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def is_final(end: pd.Timestamp or None) -> bool:
+    """This function checks if every bar before the given end is final."""
+    if end is None:
+        return False
+    # Like the price store, bars from yesterday onwards are not considered final yet
+    return end <= pd.Timestamp.today().normalize() - pd.Timedelta(days=1)
+
+
+def is_not_modified(etag: str) -> bool:
+    """This function checks if the client already has the response with the given ETag.
+
+    The comparison is weak, since compressed responses are sent with weak ETags.
+
+    """
+    return request.method in ("GET", "HEAD") and request.if_none_match.contains_weak(etag)
+
+
+def not_modified(etag: str, cache_control: str) -> Response:
+    """This function creates a 304 response for the given ETag."""
+    res = Response(status=304)
+    res.set_etag(etag)
+    res.headers["Cache-Control"] = cache_control
+    return res
+
+
+def add_caching_headers(response: Response) -> Response:
+    """This function adds an ETag and Cache-Control to a GET response that has none.
+
+    Responses without an ETag get one from a hash of their body, and are turned
+    into a 304 response if the client already has that body.
+
+    """
+    if request.method not in ("GET", "HEAD") or response.status_code != 200:
+        return response
+    response.vary.update(["X-Session-ID", "Cookie"])
+    if "Cache-Control" not in response.headers:
+        response.headers["Cache-Control"] = REVALIDATE
+    if response.is_streamed or "ETag" in response.headers:
+        return response
+    response.set_etag(get_content_etag(response.get_data()))
+    return response.make_conditional(request)
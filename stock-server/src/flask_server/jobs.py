@@ -0,0 +1,28 @@
+from flask import jsonify, request, url_for
+from data_handler.jobs import JobQueue, QueueFull
+
+
+def wants_job() -> bool:
+    """This function gets if the client asked for the request to run as a background job.
+
+    Clients ask with ?async=1 or a Prefer: respond-async header.
+
+    """
+    return request.args.get("async") == "1" or "respond-async" in request.headers.get(
+        "Prefer", ""
+    )
+
+
+def respond_with_job(jobs: JobQueue, key: tuple, kind: str, run):
+    """This function submits a job and responds with its status right away.
+
+    The response is 202 Accepted with the job's URL in the Location header, or
+    503 with a Retry-After header if the queue is full.
+
+    """
+    try:
+        job = jobs.submit(key, kind, run)
+    except QueueFull:
+        return jsonify({"reason": "Too many jobs are queued"}), 503, {"Retry-After": "5"}
+    location = url_for("api.on_get_job", job_id=job.id)
+    return jsonify(job.to_dict()), 202, {"Location": location}
@@ -0,0 +1,43 @@
+import random
+import time
+
+from flask import Response, g, request
+from flask_server.serialization import dumps
+
+
+class RequestLog:
+    """Logs a structured JSON line per response
+
+    Successful responses are only logged for a sample_rate share of requests,
+    while errors are always logged. At most max_body bytes of a body are
+    logged, and none of bodies that are streamed or compressed. The duration
+    is measured from the request_start time the server records in g.
+    """
+
+    sample_rate: float
+    max_body: int
+
+    def __init__(self, sample_rate: float = 1.0, max_body: int = 256):
+        self.sample_rate = sample_rate
+        self.max_body = max_body
+
+    def log(self, response: Response) -> None:
+        """Logs the response to the current request, if it is sampled"""
+        if response.status_code < 400 and random.random() >= self.sample_rate:
+            return
+        entry = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "bytes": response.content_length,
+        }
+        start = g.get("request_start")
+        if start is not None:
+            entry["ms"] = round((time.perf_counter() - start) * 1000, 2)
+        if (
+            self.max_body > 0
+            and not response.is_streamed
+            and "Content-Encoding" not in response.headers
+        ):
+            entry["body"] = response.get_data()[: self.max_body].decode(errors="replace")
+        print(dumps(entry).decode())
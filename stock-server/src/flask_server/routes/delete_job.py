@@ -0,0 +1,15 @@
+from flask import jsonify
+from data_handler.jobs import JobQueue
+
+
+def on_delete_job(jobs: JobQueue, job_id: str):
+    """This describes the DELETE /api/jobs/<job_id> route.
+
+    This function is called when the user wants to cancel a background job.
+    Queued jobs are cancelled right away, and running ones at their next step.
+
+    """
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"reason": "Job not found"}), 404
+    return jsonify(job.to_dict()), 200
@@ -0,0 +1,29 @@
+from flask import abort, request
+from data_handler import handler
+from flask_server import serialization
+
+
+def on_get_analytics(stock_handler: handler.Handler):
+    """This describes the GET /api/analytics route.
+
+    This function is called when the user wants to get the performance of the portfolio.
+
+    The response holds:
+    - summary, the total return, max drawdown, annualized volatility and Sharpe ratio.
+    - series, the equity, daily returns, drawdowns and rolling volatility of every
+      history row in the columnar format of GET /api/stocks.
+    - positions, the cost, value and realized and unrealized profit of every position.
+
+    The optional window query parameter sets the days of the rolling volatility, 21 by default.
+
+    """
+    window = request.args.get("window", "21")
+    if not window.isdigit() or int(window) < 2:
+        abort(400)
+    series, summary = stock_handler.get_analytics(int(window))
+    positions = stock_handler.get_position_pnl()
+    return {
+        "summary": summary,
+        "series": serialization.frame_to_columnar(series),
+        "positions": positions.astype(object).where(positions.notna(), None).to_dict("records"),
+    }, 200
@@ -8,4 +8,4 @@ def on_get_cash(stock_handler: handler.Handler):
     This function is called when the user wants to get the cash of the user.
 
     """
-    return jsonify({"cash": stock_handler.cash}), 200
+    return jsonify({"cash": stock_handler.snapshot.cash}), 200
@@ -0,0 +1,53 @@
+import time
+
+from flask import Response
+from flask_server.serialization import dumps
+
+
+def _format_event(kind: str, update: dict) -> bytes:
+    return b"event: " + kind.encode() + b"\ndata: " + dumps(update) + b"\n\n"
+
+
+def _stream(get_handler, tickers: list, heartbeat: float, max_seconds: float):
+    stock_handler = get_handler()
+    subscription = stock_handler.broadcaster.subscribe(tickers)
+    deadline = time.monotonic() + max_seconds
+    try:
+        # Clients that lose the connection reconnect after a second
+        yield b"retry: 1000\n\n"
+        while time.monotonic() < deadline:
+            updates = subscription.pop(heartbeat)
+            if not updates:
+                # Heartbeats keep proxies from closing the connection and notice clients that left
+                yield b": keep-alive\n\n"
+                # The session may have been evicted and recreated in the meantime
+                current = get_handler()
+                if current is not stock_handler:
+                    stock_handler.broadcaster.unsubscribe(subscription)
+                    stock_handler = current
+                    subscription = stock_handler.broadcaster.subscribe(tickers)
+                continue
+            yield b"".join(_format_event(kind, update) for kind, update in updates)
+    finally:
+        stock_handler.broadcaster.unsubscribe(subscription)
+
+
+def on_get_events(get_handler, tickers: str or None, heartbeat: float, max_seconds: float):
+    """This describes the GET /api/events route.
+
+    This function is called when the user wants to be told about changes instead of polling.
+    The response is a stream of server-sent events: "state" events carry the fields of the
+    session's state that changed, and "prices" events the prices of the tickers given as
+    ?tickers=AAPL,MSFT that changed. The first events carry the whole state and every price.
+    The stream ends after max_seconds, and EventSource clients reconnect to a new one.
+
+    """
+    tickers = [ticker for ticker in (tickers or "").split(",") if ticker]
+    res = Response(
+        _stream(get_handler, tickers, heartbeat, max_seconds),
+        mimetype="text/event-stream",
+    )
+    res.headers["Cache-Control"] = "no-cache"
+    # Stops nginx from buffering the stream
+    res.headers["X-Accel-Buffering"] = "no"
+    return res, 200
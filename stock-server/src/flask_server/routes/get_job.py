@@ -0,0 +1,14 @@
+from flask import jsonify
+from data_handler.jobs import JobQueue
+
+
+def on_get_job(jobs: JobQueue, job_id: str):
+    """This describes the GET /api/jobs/<job_id> route.
+
+    This function is called when the user wants to know if a background job is done.
+
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"reason": "Job not found"}), 404
+    return jsonify(job.to_dict()), 200
@@ -0,0 +1,22 @@
+from flask import jsonify
+from data_handler.jobs import JobQueue
+
+
+def on_get_job_result(jobs: JobQueue, job_id: str):
+    """This describes the GET /api/jobs/<job_id>/result route.
+
+    This function is called when the user wants to get the result of a background job.
+    Jobs that are not done yet are answered with 202 and their status, failed jobs
+    with 500 and cancelled jobs with 410.
+
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"reason": "Job not found"}), 404
+    if job.status == "done":
+        return jsonify(job.result), 200
+    if job.status == "failed":
+        return jsonify(job.to_dict()), 500
+    if job.status == "cancelled":
+        return jsonify(job.to_dict()), 410
+    return jsonify(job.to_dict()), 202
@@ -1,4 +1,5 @@
 from data_handler import handler
+from flask import jsonify
 
 
 def on_get_price(stock_handler: handler.Handler, stock: str):
@@ -7,4 +8,5 @@ def on_get_price(stock_handler: handler.Handler, stock: str):
     This function is called when the user wants to get the price of a stock.
 
     """
-    return stock_handler.get_price(stock), 200
+    price = stock_handler.get_price(stock)
+    return jsonify(None if price is None else float(price)), 200
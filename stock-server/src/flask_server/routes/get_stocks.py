@@ -1,16 +1,102 @@
-from flask import jsonify
+from flask import Response, abort, request
 from data_handler import handler
+from data_handler.frames import downsample_ohlc, paginate
+from data_handler.jobs import JobQueue
+from flask_server import http_cache, serialization
+from flask_server.jobs import respond_with_job
 from pandas import Timestamp
 
 
-def on_get_stocks(stock_handler: handler.Handler, ticker: str, start: str or None, end: str or None):
-    """This describes the GET /api/stocks route.
+def _get_positive_int(name: str) -> int or None:
+    """This function reads an optional positive integer query parameter."""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    if not value.isdigit() or int(value) == 0:
+        abort(400)
+    return int(value)
 
-    This function is called when the user wants to get the current state of the stocks.
 
-    """
+def _parse_range(start: str or None, end: str or None) -> (Timestamp or None, Timestamp or None):
+    """This function parses the optional start and end of the range of bars."""
     if start is not None:
         start = Timestamp(start.replace("%20", " "))
     if end is not None:
         end = Timestamp(end.replace("%20", " "))
-    return stock_handler.get_data(ticker, start, end).to_json(), 200
+    return start, end
+
+
+def on_get_stocks(stock_handler: handler.Handler, ticker: str, start: str or None, end: str or None):
+    """This describes the GET /api/stocks route.
+
+    This function is called when the user wants to get the current state of the stocks.
+
+    The optional query parameters are:
+    - cursor and limit, to page through the bars. The cursor of the next page is
+      returned in the X-Next-Cursor header, or in the body for columnar responses.
+    - max_points, to aggregate the bars into at most that many OHLC buckets.
+    - format=columnar, for a compact {"index", "columns", "next_cursor"} body
+      instead of the pandas JSON.
+    - stream=1, with format=columnar, to stream the bars as newline delimited
+      JSON chunks.
+
+    Responses over ranges that ended before yesterday may be cached for good,
+    and every response has an ETag so unchanged bars are answered with 304.
+
+    """
+    start, end = _parse_range(start, end)
+    cursor = request.args.get("cursor")
+    if cursor is not None:
+        if not cursor.lstrip("-").isdigit():
+            abort(400)
+        cursor = int(cursor)
+    limit = _get_positive_int("limit")
+    max_points = _get_positive_int("max_points")
+
+    data = stock_handler.get_data(ticker, start, end)
+    data, next_cursor = paginate(data, cursor, limit)
+    if max_points is not None:
+        data = downsample_ohlc(data, max_points)
+    headers = {} if next_cursor is None else {"X-Next-Cursor": str(next_cursor)}
+    # Bars of days that have passed never change, so clients may keep them for good,
+    # unless a download failed and some of them are still missing
+    if (
+        http_cache.is_final(end)
+        and not data.empty
+        and stock_handler.is_complete(ticker, start, end)
+    ):
+        headers["Cache-Control"] = http_cache.IMMUTABLE
+    if request.args.get("format") == "columnar":
+        if request.args.get("stream") == "1":
+            return Response(
+                serialization.stream_columnar(data, next_cursor, chunk_size=1000),
+                mimetype="application/x-ndjson",
+                headers=headers,
+            )
+        return serialization.frame_to_columnar(data, next_cursor), 200, headers
+    return data.to_json(), 200, headers
+
+
+def on_get_stocks_job(stock_handler: handler.Handler, jobs: JobQueue, ticker: str, start: str or None, end: str or None):
+    """This function is called when the user wants to load the bars of a long range in a background job.
+
+    The result is the bars in the columnar format, aggregated into at most
+    max_points buckets if it is given. Identical requests share a job.
+
+    """
+    start, end = _parse_range(start, end)
+    max_points = _get_positive_int("max_points")
+    key = ("stocks", ticker, start, end, max_points)
+    if start is None or end is None:
+        # Open ranges end at the simulated clock
+        key += (stock_handler.snapshot.date,)
+
+    def run(job):
+        data = stock_handler.get_data(ticker, start, end)
+        if job.is_cancelled():
+            return None
+        if max_points is not None:
+            data = downsample_ohlc(data, max_points)
+        return serialization.frame_to_columnar(data)
+
+    return respond_with_job(jobs, key, "stocks", run)
@@ -0,0 +1,29 @@
+from flask import jsonify, request
+from data_handler import handler
+
+def on_post_orders(stock_handler: handler.Handler):
+    """This function is called when the user wants to buy and sell several stocks at once.
+
+    The body is a JSON object with a list of orders, such as
+    {"orders": [{"side": "sell", "ticker": "MSFT", "amount": 5}, {"side": "buy", "ticker": "AAPL", "amount": 10}]}.
+    Either every order is executed or none of them is.
+    """
+    body = request.get_json(silent=True)
+    orders = body.get("orders") if isinstance(body, dict) else None
+    if not isinstance(orders, list) or not all(
+        isinstance(order, dict) and {"side", "ticker", "amount"} <= order.keys()
+        for order in orders
+    ):
+        return jsonify({"success": False, "reason": "Expected a list of orders with a side, ticker and amount"}), 400
+    try:
+        legs = [
+            handler.Order(str(order["side"]).lower(), str(order["ticker"]), float(order["amount"]))
+            for order in orders
+        ]
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "reason": "Amounts must be numbers"}), 400
+    res = stock_handler.execute_orders(legs)
+    if res[0]:
+        return jsonify({"success": True }), 200
+    else:
+        return jsonify({"success": False, "reason": res[1]}), 400
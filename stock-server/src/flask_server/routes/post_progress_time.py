@@ -1,9 +1,10 @@
 from flask import jsonify
 from data_handler import handler
+from data_handler.jobs import JobQueue
+from flask_server.jobs import respond_with_job
 
 def on_post_progress_time(stock_handler: handler.Handler, days: int = 0, hours: int = 0, minutes: int = 0, seconds: int = 0):
     """This function is called when the user wants to progress the time."""
-    print("on_post_progress_time")
     stock_handler.progress_time(
         days=int(days),
         hours=int(hours),
@@ -11,3 +12,21 @@ def on_post_progress_time(stock_handler: handler.Handler, days: int = 0, hours:
         seconds=int(seconds)
     )
     return stock_handler.date.strftime("%Y-%m-%d %H:%M:%S"), 200
+
+
+def on_post_progress_time_job(stock_handler: handler.Handler, jobs: JobQueue, session_id: str, days: int = 0, hours: int = 0, minutes: int = 0, seconds: int = 0):
+    """This function is called when the user wants to progress the time in a background job.
+
+    Identical requests on the same state share a job. The result is the new date,
+    and a job cancelled before it is done leaves the time as it was.
+
+    """
+    delta = (int(days), int(hours), int(minutes), int(seconds))
+
+    def run(job):
+        if not stock_handler.progress_time(*delta, is_cancelled=job.is_cancelled):
+            return None
+        return {"date": stock_handler.date.strftime("%Y-%m-%d %H:%M:%S")}
+
+    key = ("progress_time", session_id, stock_handler.snapshot.version) + delta
+    return respond_with_job(jobs, key, "progress_time", run)
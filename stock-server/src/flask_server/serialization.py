@@ -0,0 +1,81 @@
+import json
+
+import numpy as np
+import pandas as pd
+from data_handler.frames import to_epoch_ms
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson writes numpy arrays natively, and NaN as null
+_ORJSON_OPTIONS = (
+    0 if orjson is None else orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+)
+
+
+def dumps(obj) -> bytes:
+    """Serializes obj to JSON, with orjson if it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=_ORJSON_OPTIONS)
+    return json.dumps(obj).encode()
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Serializes the JSON bodies of Flask responses with orjson if it is installed"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        # Options such as indent are only supported by the standard encoder
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=_ORJSON_OPTIONS).decode()
+
+    def loads(self, s: str or bytes, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        data = orjson.dumps(obj, default=self.default, option=_ORJSON_OPTIONS)
+        return self._app.response_class(data, mimetype=self.mimetype)
+
+
+def _to_column(values: pd.Series):
+    """Converts a column to a JSON serializable sequence, with None for missing values"""
+    array = values.to_numpy()
+    if orjson is not None and array.dtype.kind in "fiub":
+        return np.ascontiguousarray(array)
+    return values.astype(object).where(values.notna(), None).tolist()
+
+
+def frame_to_columnar(data: pd.DataFrame, next_cursor: int or None = None) -> dict:
+    """Converts the bars to a compact columnar dict with epoch millisecond timestamps
+
+    The columns may be numpy arrays, which are only serializable by dumps and the
+    FastJSONProvider.
+
+    """
+    index = to_epoch_ms(data.index)
+    return {
+        "index": index if orjson is not None else index.tolist(),
+        "columns": {str(column): _to_column(data[column]) for column in data.columns},
+        "next_cursor": next_cursor,
+    }
+
+
+def stream_columnar(data: pd.DataFrame, next_cursor: int or None, chunk_size: int):
+    """Yields the bars as newline delimited columnar JSON chunks of at most chunk_size bars
+
+    The last line holds no bars, only the cursor of the next page.
+
+    """
+    for start in range(0, len(data), chunk_size):
+        chunk = frame_to_columnar(data.iloc[start : start + chunk_size])
+        del chunk["next_cursor"]
+        yield dumps(chunk) + b"\n"
+    yield dumps({"next_cursor": next_cursor}) + b"\n"
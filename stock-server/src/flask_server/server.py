@@ -1,5 +1,9 @@
-from flask import Flask, request, Blueprint, Response
+from flask import Flask, request, Blueprint, Response, abort, g, make_response
 from flask_cors import CORS
+from flask_server import compression, http_cache
+from flask_server.jobs import wants_job
+from flask_server.request_log import RequestLog
+from flask_server.serialization import FastJSONProvider
 from flask_server.routes import (
     get_stocks,
     post_buy,
@@ -8,12 +12,32 @@ from flask_server.routes import (
     get_portfolio,
     get_portfolio_value,
     get_cash,
+    get_events,
+    get_analytics,
     get_history,
     get_price,
     post_sell,
+    post_orders,
     delete_reset,
+    get_job,
+    get_job_result,
+    delete_job,
 )
 from data_handler import handler
+from data_handler.jobs import JobQueue
+from data_handler.metrics import REGISTRY, Gauge, Histogram
+from data_handler.sessions import SessionManager
+from data_handler.warmup import WarmUp
+import os
+import time
+import uuid
+
+
+REQUEST_SECONDS = Histogram(
+    "http_request_seconds",
+    "Duration of HTTP requests",
+    ("route", "method", "status"),
+)
 
 
 def _init_cors(_app: Flask):
@@ -38,14 +62,52 @@ def _init_cors(_app: Flask):
             return res
 
 
-def _init_api_routes(_app: Flask, stock_handler: handler.Handler):
+def _init_api_routes(_app: Flask, sessions: SessionManager, jobs: JobQueue):
     """This function initializes the routes for a blueprint and registers poit with the Flask server."""
 
     bp = Blueprint("api", __name__, url_prefix="/api")
 
+    def get_session_id() -> str:
+        """This function gets the session id of the current request.
+
+        The session is read from the X-Session-ID header or the session_id cookie.
+        Requests without either start a new session, whose id is sent back in
+        the session_id cookie.
+
+        """
+        session_id = request.headers.get("X-Session-ID") or request.cookies.get("session_id")
+        if session_id:
+            return session_id
+        if "new_session_id" not in g:
+            g.new_session_id = uuid.uuid4().hex
+        return g.new_session_id
+
+    def get_handler() -> handler.Handler:
+        """This function gets the handler for the session of the current request."""
+        try:
+            return sessions.get(get_session_id())
+        except ValueError:
+            abort(400)
+
+    def respond_with_state(route, stock_handler: handler.Handler):
+        """This function calls a route that only depends on the state of the session.
+
+        The response is tagged with the version of the state, so a client that
+        already has it gets a 304 response without the route being called.
+
+        """
+        # The version is read first, so a body built from a newer state is only revalidated sooner
+        version = stock_handler.snapshot.version
+        etag = http_cache.get_state_etag(get_session_id(), version)
+        if http_cache.is_not_modified(etag):
+            return http_cache.not_modified(etag, http_cache.REVALIDATE)
+        res = make_response(route(stock_handler))
+        res.set_etag(etag)
+        return res
+
     @bp.get("/date")
     def on_get_date():
-        return get_current_date.on_get_date(stock_handler)
+        return respond_with_state(get_current_date.on_get_date, get_handler())
 
     @bp.post(
         "/date/progress_time",
@@ -60,59 +122,167 @@ def _init_api_routes(_app: Flask, stock_handler: handler.Handler):
     @bp.post("/date/progress_time/<days>/<hours>/<minutes>", defaults={"seconds": 0})
     @bp.post("/date/progress_time/<days>/<hours>/<minutes>/<seconds>")
     def on_post_progress_time(days: int, hours: int, minutes: int, seconds: int):
+        if wants_job():
+            return post_progress_time.on_post_progress_time_job(
+                get_handler(), jobs, get_session_id(), days, hours, minutes, seconds
+            )
         return post_progress_time.on_post_progress_time(
-            stock_handler, days, hours, minutes, seconds
+            get_handler(), days, hours, minutes, seconds
         )
 
     @bp.post("/buy/<ticker>/<amount>")
     def on_post_buy(ticker: str, amount: int):
-        return post_buy.on_post_buy(stock_handler, ticker, amount)
+        return post_buy.on_post_buy(get_handler(), ticker, amount)
 
     @bp.post("/sell/<ticker>/<amount>")
     def on_post_sell(ticker: str, amount: int):
-        return post_sell.on_post_sell(stock_handler, ticker, amount)
+        return post_sell.on_post_sell(get_handler(), ticker, amount)
+
+    @bp.post("/orders")
+    def on_post_orders():
+        return post_orders.on_post_orders(get_handler())
 
     @bp.get("/stocks/<ticker>", defaults={"start": None, "end": None})
     @bp.get("/stocks/<ticker>/<start>/", defaults={"end": None})
     @bp.get("/stocks/<ticker>/<start>/<end>")
     def on_get_stocks(ticker: str, start: str or None, end: str or None):
-        return get_stocks.on_get_stocks(stock_handler, ticker, start, end)
+        if wants_job():
+            return get_stocks.on_get_stocks_job(get_handler(), jobs, ticker, start, end)
+        return get_stocks.on_get_stocks(get_handler(), ticker, start, end)
+
+    @bp.get("/jobs/<job_id>")
+    def on_get_job(job_id: str):
+        return get_job.on_get_job(jobs, job_id)
+
+    @bp.get("/jobs/<job_id>/result")
+    def on_get_job_result(job_id: str):
+        return get_job_result.on_get_job_result(jobs, job_id)
+
+    @bp.delete("/jobs/<job_id>")
+    def on_delete_job(job_id: str):
+        return delete_job.on_delete_job(jobs, job_id)
 
     @bp.get("/price/<ticker>")
     def on_get_price(ticker: str):
-        return get_price.on_get_price(stock_handler, ticker)
+        return get_price.on_get_price(get_handler(), ticker)
 
     @bp.get("/portfolio")
     def on_get_portfolio():
-        return get_portfolio.on_get_portfolio(stock_handler)
+        return respond_with_state(get_portfolio.on_get_portfolio, get_handler())
 
     @bp.get("/history")
     def on_get_history():
-        return get_history.on_get_history(stock_handler)
+        return respond_with_state(get_history.on_get_history, get_handler())
+
+    @bp.get("/analytics")
+    def on_get_analytics():
+        return get_analytics.on_get_analytics(get_handler())
 
     @bp.get("/portfolio/value")
     def on_get_portfolio_value():
-        return get_portfolio_value.on_get_portfolio_value(stock_handler)
+        return get_portfolio_value.on_get_portfolio_value(get_handler())
 
     @bp.get("/cash")
     def on_get_cash():
-        return get_cash.on_get_cash(stock_handler)
+        return respond_with_state(get_cash.on_get_cash, get_handler())
+
+    events_heartbeat = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+    events_max_seconds = float(os.getenv("EVENTS_MAX_SECONDS", "300"))
+
+    @bp.get("/events")
+    def on_get_events():
+        # The session is checked up front, so an invalid one fails before the stream starts
+        get_handler()
+        session_id = get_session_id()
+        return get_events.on_get_events(
+            lambda: sessions.get(session_id),
+            request.args.get("tickers"),
+            events_heartbeat,
+            events_max_seconds,
+        )
 
     @bp.delete("/reset")
     def reset():
-        return delete_reset.on_delete_reset(stock_handler)
+        return delete_reset.on_delete_reset(get_handler())
+
+    compress_min_size = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+    request_log = RequestLog(
+        sample_rate=float(os.getenv("LOG_SAMPLE_RATE", "1.0")),
+        max_body=int(os.getenv("LOG_MAX_BODY", "256")),
+    )
 
     @bp.after_request
     def after_request(response):
-        print(f"Sent response: {response.status_code}, {response.data}")
+        if "new_session_id" in g:
+            response.set_cookie(
+                "session_id", g.new_session_id, httponly=True, samesite="Lax"
+            )
+        response = http_cache.add_caching_headers(response)
+        response = compression.compress(response, compress_min_size)
+        request_log.log(response)
         return response
 
     _app.register_blueprint(bp)
 
 
+def _init_metrics(_app: Flask, sessions: SessionManager, jobs: JobQueue):
+    """This function times every request and serves the metrics on GET /metrics."""
+    Gauge("sessions", "Sessions held in memory", lambda: len(sessions))
+    Gauge("jobs_queued", "Background jobs waiting for a worker", lambda: jobs.queued)
+
+    @_app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @_app.after_request
+    def observe_request(response):
+        start = g.get("request_start")
+        if start is not None:
+            # The rule rather than the path, so every ticker and date share a series
+            route = request.url_rule.rule if request.url_rule else "<unmatched>"
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - start, route, request.method, response.status_code
+            )
+        return response
+
+    @_app.get("/metrics")
+    def on_get_metrics():
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+def _init_health(_app: Flask, warm_up: WarmUp or None):
+    """This function serves the liveness and readiness probes and starts the warm-up.
+
+    GET /healthz answers as soon as the process serves requests, while GET
+    /readyz answers with 503 until the warm-up is done, so no traffic is sent
+    to a cold process.
+
+    """
+    if warm_up is not None:
+        Gauge("warmup_seconds", "Duration of the warm-up", lambda: warm_up.duration or 0)
+
+        @_app.before_request
+        def start_warm_up():
+            warm_up.start()
+
+    @_app.get("/healthz")
+    def on_get_healthz():
+        return "ok", 200
+
+    @_app.get("/readyz")
+    def on_get_readyz():
+        if warm_up is None or warm_up.is_ready():
+            return "ready", 200
+        return "warming up", 503
+
+
 def _init_error_handlers(_app: Flask):
     """This function initializes the error handlers for the Flask server."""
 
+    @_app.errorhandler(400)
+    def bad_request(e):
+        return "400: Bad request", 400
+
     @_app.errorhandler(404)
     def page_not_found(e):
         return "404: Page not found", 404
@@ -123,17 +293,49 @@ def _init_error_handlers(_app: Flask):
         return "500: Internal server error", 500
 
 
-def init(_app: Flask, stock_handler: handler.Handler):
+def init(
+    _app: Flask,
+    sessions: SessionManager,
+    warm_up: WarmUp or None = None,
+    jobs: JobQueue or None = None,
+):
     """This function initializes the Flask server"""
     # This function initializes the Flask server
+    if jobs is None:
+        jobs = JobQueue()
     _init_cors(_app)
-    _init_api_routes(_app, stock_handler)
+    _init_metrics(_app, sessions, jobs)
+    _init_health(_app, warm_up)
+    _init_api_routes(_app, sessions, jobs)
     _init_error_handlers(_app)
 
 
-def start(stock_handler: handler.Handler):
-    """This function initializes and starts the Flask server."""
+def create_app(
+    sessions: SessionManager,
+    warm_up: WarmUp or None = None,
+    jobs: JobQueue or None = None,
+) -> Flask:
+    """This function creates and initializes the Flask app, for use by production WSGI servers."""
     _app = Flask(__name__)
+    _app.json = FastJSONProvider(_app)
+    init(_app, sessions, warm_up, jobs)
+    return _app
+
+
+def start(
+    sessions: SessionManager,
+    warm_up: WarmUp or None = None,
+    jobs: JobQueue or None = None,
+):
+    """This function initializes and starts the Flask development server.
+
+    Debug mode is only enabled when the FLASK_DEBUG environment variable is set to 1.
+
+    """
+    _app = create_app(sessions, warm_up, jobs)
     _app.app_context().push()
-    init(_app, stock_handler)
-    _app.run(debug=True, host="0.0.0.0", port=5000)
+    _app.run(
+        debug=os.getenv("FLASK_DEBUG", "0") == "1",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "5000")),
+    )
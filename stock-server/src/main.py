@@ -1,19 +1,165 @@
+import time
+
+# Started before anything else is imported, so the startup time includes every import
+_import_start = time.perf_counter()
+
+from flask import Flask
 from flask_server import server
 from data_handler import handler
+from data_handler.bars import BAR_CACHE
+from data_handler.store import PriceStore
+from data_handler.fetcher import Fetcher
+from data_handler.jobs import JobQueue
+from data_handler.journal import Journal
+from data_handler.metrics import Gauge
+from data_handler.prefetch import Prefetcher
+from data_handler.providers import (
+    FixtureProvider,
+    Provider,
+    SyntheticProvider,
+    YahooProvider,
+)
+from data_handler.resp import RedisClient
+from data_handler.sessions import SessionManager
+from data_handler.shared_state import (
+    RedisStateBackend,
+    SQLiteStateBackend,
+    StateBackend,
+)
+from data_handler.warmup import WarmUp
 from dotenv import load_dotenv
 from pandas import Timestamp
+import atexit
 import os
 
 load_dotenv()
 
-handler = handler.Handler(
-    date=Timestamp("2021-03-01 10:00:00"),
-    initial_cash=100000,
-)
 
-# The main function for this project simply starts the Flask server
+def create_provider() -> Provider:
+    """This function creates the data provider named by the DATA_PROVIDER environment variable."""
+    name = os.getenv("DATA_PROVIDER", "yahoo")
+    if name == "yahoo":
+        return YahooProvider()
+    if name == "synthetic":
+        return SyntheticProvider(seed=int(os.getenv("SYNTHETIC_SEED", "0")))
+    if name == "fixtures":
+        record = os.getenv("FIXTURE_RECORD", "0") == "1"
+        return FixtureProvider(
+            os.getenv("FIXTURE_DIR", "./fixtures"),
+            record_from=YahooProvider() if record else None,
+        )
+    raise ValueError(f"Unknown data provider: {name}")
+
+
+def create_state_backend() -> StateBackend or None:
+    """This function creates the shared state backend named by the STATE_BACKEND environment variable."""
+    name = os.getenv("STATE_BACKEND", "")
+    if name == "":
+        return None
+    if name == "sqlite":
+        return SQLiteStateBackend(os.getenv("STATE_SQLITE_PATH", "./shared-state.sqlite3"))
+    if name == "redis":
+        client = RedisClient.from_url(os.getenv("REDIS_URL", "redis://localhost:6379"))
+        return RedisStateBackend(
+            client, price_ttl=int(os.getenv("REDIS_PRICE_TTL", "86400"))
+        )
+    raise ValueError(f"Unknown state backend: {name}")
+
+
+def create_sessions() -> SessionManager:
+    """This function creates the session manager, configured from the environment."""
+    # The provider, price store, fetcher and prefetcher are shared by every session
+    provider = create_provider()
+    store = PriceStore(os.getenv("PRICE_STORE_DIR", "./price-store"))
+    # The budget is per worker process, every store in it shares the same one
+    BAR_CACHE.resize(int(os.getenv("BAR_CACHE_BYTES", str(256 * 1024**2))))
+    fetcher = Fetcher(
+        max_workers=int(os.getenv("FETCH_CONCURRENCY", "4")),
+        timeout=float(os.getenv("FETCH_TIMEOUT", "30")),
+    )
+    prefetch_days = int(os.getenv("PREFETCH_DAYS", "5"))
+    prefetcher = Prefetcher(days=prefetch_days) if prefetch_days > 0 else None
+
+    def create_handler() -> handler.Handler:
+        return handler.Handler(
+            date=Timestamp("2021-03-01 10:00:00"),
+            initial_cash=100000,
+            store=store,
+            fetcher=fetcher,
+            prefetcher=prefetcher,
+            provider=provider,
+        )
+
+    # Shared sessions are persisted by their backend, otherwise they are journaled if it is enabled
+    shared = create_state_backend()
+    journal = None
+    journal_path = os.getenv("JOURNAL_PATH", "./journal.sqlite3")
+    if shared is None and journal_path:
+        journal = Journal(
+            journal_path,
+            snapshot_every=int(os.getenv("JOURNAL_SNAPSHOT_EVERY", "1000")),
+            flush_interval=float(os.getenv("JOURNAL_FLUSH_INTERVAL", "0.05")),
+        )
+        atexit.register(journal.close)
+
+    return SessionManager(
+        create_handler,
+        max_sessions=int(os.getenv("MAX_SESSIONS", "1000")),
+        idle_timeout=float(os.getenv("SESSION_IDLE_TIMEOUT", "900")),
+        spill_dir=os.getenv("SESSION_SPILL_DIR", "./sessions"),
+        journal=journal,
+        shared=shared,
+    )
+
+
+def create_warm_up(sessions: SessionManager) -> WarmUp:
+    """This function creates the warm-up of the tickers in the WARMUP_TICKERS environment variable."""
+    tickers = [
+        ticker.strip().upper()
+        for ticker in os.getenv("WARMUP_TICKERS", "").split(",")
+        if ticker.strip()
+    ]
+    return WarmUp(sessions, tickers)
+
+
+def create_jobs() -> JobQueue:
+    """This function creates the queue of background jobs, configured from the environment."""
+    return JobQueue(
+        max_workers=int(os.getenv("JOB_WORKERS", "2")),
+        max_queued=int(os.getenv("JOB_QUEUE_DEPTH", "32")),
+        ttl=float(os.getenv("JOB_TTL", "600")),
+    )
+
+
+def report_startup() -> float:
+    """This function reports how long the server took to start and warns if it took longer than STARTUP_BUDGET."""
+    startup_seconds = time.perf_counter() - _import_start
+    Gauge(
+        "startup_seconds",
+        "Seconds from importing the server to creating the app",
+        lambda: startup_seconds,
+    )
+    budget = float(os.getenv("STARTUP_BUDGET", "2"))
+    print(f"Started in {startup_seconds:.2f}s")
+    if startup_seconds > budget:
+        print(f"Starting took longer than the budget of {budget:.2f}s")
+    return startup_seconds
+
+
+# The entry point for production WSGI servers, e.g. gunicorn "main:create_app()"
+def create_app() -> Flask:
+    sessions = create_sessions()
+    _app = server.create_app(sessions, create_warm_up(sessions), create_jobs())
+    report_startup()
+    return _app
+
+
+# The main function for this project simply starts the Flask development server
 def main():
-    server.start(handler)
+    sessions = create_sessions()
+    warm_up = create_warm_up(sessions)
+    report_startup()
+    server.start(sessions, warm_up, create_jobs())
 
 
 if __name__ == "__main__":
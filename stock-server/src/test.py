@@ -1,5 +1,45 @@
 from data_handler import handler
+from data_handler.handler import VALUATION_SECONDS, Handler, Order
+from data_handler.analytics import HistoryAnalytics
+from data_handler.broadcast import Subscription
+from data_handler.bars import BarCache, decode_prices, get_decimals
+from data_handler.store import PriceStore
+from data_handler.price_cache import LOOKUPS, PriceCache
+from data_handler.positions import History
+from data_handler.sessions import DEFAULT_SESSION, SessionManager
+from data_handler.fetcher import Fetcher
+from data_handler.prefetch import Prefetcher
+from data_handler.metrics import REGISTRY, Histogram, Registry
+from data_handler.jobs import JobQueue, QueueFull
+from data_handler.journal import Journal
+from data_handler.trading_calendar import NYSE
+from data_handler.warmup import WarmUp
+from data_handler.resp import RedisClient, RedisError, _read_reply
+from data_handler.shared_state import (
+    RedisStateBackend,
+    SQLiteStateBackend,
+    StateBackend,
+)
+from data_handler.providers import FixtureProvider, SyntheticProvider
+from flask_server import serialization, server
+from flask_server.request_log import RequestLog
+from flask_server.server import REQUEST_SECONDS
+import contextlib
+import gzip
+import io
+import json
+import numpy as np
+import os
 import pandas as pd
+import pickle
+import random
+import socketserver
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 
 test_handler: handler.Handler = None
 
@@ -13,8 +53,10 @@ def setup_test():
     global test_handler
     test_handler = handler.Handler(
         # A random monday
-        pd.Timestamp("2020-03-02 10:00:00"),
+        pd.Timestamp("2020-03-02 16:00:00"),
         init_cash,
+        # Deterministic bars, so the tests do not depend on the network
+        provider=SyntheticProvider(),
     )
 
 
@@ -121,31 +163,31 @@ sell_tests = [
 def test_date_progress_time_day(handler: handler.Handler):
     """Tests if the day is updated correctly."""
     handler.progress_time(days=1)
-    assert handler.date == pd.Timestamp("2020-03-03 10:00:00")
+    assert handler.date == pd.Timestamp("2020-03-03 16:00:00")
 
 
 def test_date_progress_time_hour(handler: handler.Handler):
     """Tests if the hour is updated correctly."""
     handler.progress_time(hours=1)
-    assert handler.date == pd.Timestamp("2020-03-02 11:00:00")
+    assert handler.date == pd.Timestamp("2020-03-02 17:00:00")
 
 
 def test_date_progress_time_minute(handler: handler.Handler):
     """Tests if the minute is updated correctly."""
     handler.progress_time(minutes=1)
-    assert handler.date == pd.Timestamp("2020-03-02 10:01:00")
+    assert handler.date == pd.Timestamp("2020-03-02 16:01:00")
 
 
 def test_date_progress_time_second(handler: handler.Handler):
     """Tests if the second is updated correctly."""
     handler.progress_time(seconds=1)
-    assert handler.date == pd.Timestamp("2020-03-02 10:00:01")
+    assert handler.date == pd.Timestamp("2020-03-02 16:00:01")
 
 
 def test_date_progress_time_all(handler: handler.Handler):
     """Tests if the time is updated correctly."""
     handler.progress_time(days=1, hours=1, minutes=1, seconds=1)
-    assert handler.date == pd.Timestamp("2020-03-03 11:01:01")
+    assert handler.date == pd.Timestamp("2020-03-03 17:01:01")
 
 
 date_tests = [
@@ -183,11 +225,2206 @@ reset_tests = [
 ]
 
 
+# store tests
+def seed_store(start: str, end: str, tickers: list = ["AAPL"]) -> PriceStore:
+    """This function creates a store holding daily bars for the given range.
+
+    The first ticker closes at 100 on the first day, the next at 200 and so on,
+    and every ticker gains 1 per business day.
+
+    """
+    store = PriceStore(tempfile.mkdtemp())
+    index = pd.bdate_range(start, end, inclusive="left", name="Date")
+    for i, ticker in enumerate(tickers):
+        close = np.arange(len(index), dtype=float) + 100 * (i + 1)
+        data = pd.DataFrame(
+            {
+                "Open": close,
+                "High": close + 1,
+                "Low": close - 1,
+                "Close": close,
+                "Volume": np.full(len(index), 1000, dtype=np.int64),
+            },
+            index=index,
+        )
+        store.write(ticker, "1d", pd.Timestamp(start), pd.Timestamp(end), data)
+    return store
+
+
+def fail_download(*args):
+    """This function replaces downloads in tests that must stay offline."""
+    raise RuntimeError("Unexpected download")
+
+
+def test_store_offline(handler: handler.Handler):
+    """Tests if prices are served from a pre-seeded store without downloading."""
+    handler.store = seed_store("2020-02-03", "2020-04-01")
+    handler.download = fail_download
+    # 2020-03-02 is the 21st business day of the range, and its bar is known once it closed
+    assert handler.get_price("AAPL") == 120
+    # Before the close, the last known bar is the one of the session before
+    assert handler.get_price("AAPL", pd.Timestamp("2020-03-02 10:00:00")) == 119
+    week = handler.get_data(
+        "AAPL", pd.Timestamp("2020-02-03"), pd.Timestamp("2020-02-10")
+    )
+    assert len(week) == 5
+
+
+def test_store_missing(handler: handler.Handler):
+    """Tests if only the ranges missing from the store are downloaded."""
+    handler.store = seed_store("2020-02-03", "2020-04-01")
+    downloads = []
+
+    def download(ticker, interval, start, end):
+        downloads.append((start, end))
+        return pd.DataFrame()
+
+    handler.download = download
+    handler.get_data("AAPL", pd.Timestamp("2020-01-20"), pd.Timestamp("2020-04-15"))
+    assert downloads == [
+        (pd.Timestamp("2020-01-20"), pd.Timestamp("2020-02-03")),
+        (pd.Timestamp("2020-04-01"), pd.Timestamp("2020-04-15")),
+    ]
+
+
+def create_bars(start: str, periods: int, close: float = 100.0) -> pd.DataFrame:
+    """This function creates daily bars the way yfinance returns them, with an Adj Close column."""
+    index = pd.bdate_range(start, periods=periods, name="Date")
+    closes = np.arange(periods, dtype=float) + close
+    return pd.DataFrame(
+        {
+            "Open": closes,
+            "High": closes + 1,
+            "Low": closes - 1,
+            "Close": closes,
+            "Adj Close": closes,
+            "Volume": np.full(periods, 1000.0),
+        },
+        index=index,
+    )
+
+
+def test_store_compact(handler: handler.Handler):
+    """Tests if the store keeps only the bar columns in compact dtypes and merges new bars."""
+    store = PriceStore(tempfile.mkdtemp(), BarCache())
+    start, middle, end = pd.Timestamp("2020-01-01"), pd.Timestamp("2020-01-10"), pd.Timestamp("2020-01-25")
+    store.write("AAPL", "1d", start, middle, create_bars("2020-01-01", 10))
+    # Overlapping bars replace the stored ones
+    store.write("AAPL", "1d", middle, end, create_bars("2020-01-10", 10, 500))
+    data = store.read("AAPL", "1d", start, end + pd.Timedelta(days=7))
+    assert list(data.columns) == ["Open", "High", "Low", "Close", "Volume"]
+    # Prices are held as float32 and decoded to float64 as they are read
+    bars = store.cache.get((store.root, "1d", "AAPL"))
+    assert [values.dtype for values in bars.columns.values()] == [np.float32] * 4 + [np.int64]
+    assert list(data.dtypes) == [np.float64] * 4 + [np.int64]
+    assert len(data) == 17
+    assert data["Close"].tolist() == list(range(100, 107)) + list(range(500, 510))
+    assert data.index.is_monotonic_increasing and data.index.name == "Date"
+    assert store.cache.resident_bytes == 17 * 36
+    assert store.get_missing("AAPL", "1d", start, end) == []
+
+
+def test_store_decimal_prices(handler: handler.Handler):
+    """Tests if prices with cents are traded and served as they were stored."""
+    store = PriceStore(tempfile.mkdtemp(), BarCache())
+    data = create_bars("2020-02-03", 30)
+    data["Close"] = 123.45
+    store.write("AAPL", "1d", pd.Timestamp("2020-02-03"), pd.Timestamp("2020-04-01"), data)
+    assert store.read("AAPL", "1d", pd.Timestamp("2020-02-03"), pd.Timestamp("2020-04-01"))[
+        "Close"
+    ].tolist() == [123.45] * 30
+    handler.store = store
+    handler.download = fail_download
+    assert handler.get_price("AAPL") == 123.45
+    handler.buy("AAPL", 10)
+    assert handler.cash == init_cash - 1234.5
+    columnar = serialization.frame_to_columnar(
+        handler.get_data("AAPL", pd.Timestamp("2020-02-03"), pd.Timestamp("2020-02-10"))
+    )
+    assert json.loads(serialization.dumps(columnar))["columns"]["Close"] == [123.45] * 5
+    prices = np.array([123.45, 0.000986, 99999.99, 1e9, 0.0, np.nan], dtype=np.float32)
+    decimals = get_decimals(prices)
+    assert decimals.tolist() == [2, 6, 2, 0, -1, -1]
+    decoded = decode_prices(prices, decimals)
+    assert decoded[:5].tolist() == [123.45, 0.000986, 99999.99, 1e9, 0.0]
+    assert np.isnan(decoded[5])
+
+
+def test_store_budget(handler: handler.Handler):
+    """Tests if the least recently used partitions are evicted beyond the memory budget."""
+    cache = BarCache(max_bytes=2 * 20 * 36)
+    store = PriceStore(tempfile.mkdtemp(), cache)
+    start, end = pd.Timestamp("2020-01-01"), pd.Timestamp("2020-02-01")
+    for ticker in ["AAPL", "MSFT", "GOOG"]:
+        store.write(ticker, "1d", start, end, create_bars("2020-01-01", 20))
+    assert len(cache) == 2 and cache.resident_bytes == 2 * 20 * 36
+    assert cache.get((store.root, "1d", "AAPL")) is None
+    # Evicted partitions are read from disk again, evicting the least recently used one
+    assert len(store.read("AAPL", "1d", start, end)) == 20
+    assert cache.get((store.root, "1d", "AAPL")) is not None
+    assert cache.get((store.root, "1d", "MSFT")) is None
+    cache.resize(20 * 36)
+    assert len(cache) == 1 and cache.resident_bytes == 20 * 36
+    assert "bar_cache_resident_bytes" in REGISTRY.render()
+
+
+def test_store_shared(handler: handler.Handler):
+    """Tests if partitions written by another process are read again, and old ones are compacted."""
+    root = tempfile.mkdtemp()
+    store = PriceStore(root, BarCache())
+    other = PriceStore(root, BarCache())
+    start, end = pd.Timestamp("2020-01-01"), pd.Timestamp("2020-03-01")
+    store.write("AAPL", "1d", start, pd.Timestamp("2020-01-15"), create_bars("2020-01-01", 10))
+    assert len(other.read("AAPL", "1d", start, end)) == 10
+    store.write("AAPL", "1d", pd.Timestamp("2020-01-15"), end, create_bars("2020-01-15", 20))
+    assert len(other.read("AAPL", "1d", start, end)) == 30
+    # A partition of float64 columns with an Adj Close column, as it was stored before
+    path = os.path.join(root, "1d", "MSFT")
+    os.makedirs(path)
+    data = create_bars("2020-01-01", 5)
+    index = data.index.values.astype("datetime64[ns]").view(np.int64)
+    np.save(os.path.join(path, "index.0.npy"), index)
+    for i, column in enumerate(data.columns):
+        np.save(os.path.join(path, f"c{i}.0.npy"), data[column].to_numpy())
+    with open(os.path.join(path, "meta.json"), "w") as file:
+        json.dump(
+            {
+                "generation": 0,
+                "index": "index.0.npy",
+                "index_name": "Date",
+                "tz": None,
+                "columns": list(data.columns),
+                "files": [f"c{i}.0.npy" for i in range(len(data.columns))],
+                "coverage": [],
+            },
+            file,
+        )
+    data = store.read("MSFT", "1d", start, end)
+    assert "Adj Close" not in data.columns
+    assert store.cache.get((store.root, "1d", "MSFT")).columns["Close"].dtype == np.float32
+    assert data["Volume"].tolist() == [1000] * 5
+
+
+def test_store_lost_files(handler: handler.Handler):
+    """Tests if a partition whose files are lost counts as missing and is written again."""
+    store = PriceStore(tempfile.mkdtemp(), BarCache())
+    start, end = pd.Timestamp("2020-01-01"), pd.Timestamp("2020-01-15")
+    store.write("AAPL", "1d", start, end, create_bars("2020-01-01", 10))
+    path = os.path.join(store.root, "1d", "AAPL")
+    with open(os.path.join(path, "meta.json")) as file:
+        os.remove(os.path.join(path, json.load(file)["index"]))
+    store.cache.discard((store.root, "1d", "AAPL"))
+    assert store.read("AAPL", "1d", start, end).empty
+    assert store.get_missing("AAPL", "1d", start, end) == [(start, end)]
+    store.write("AAPL", "1d", start, end, create_bars("2020-01-01", 10))
+    assert len(store.read("AAPL", "1d", start, end)) == 10
+
+
+def test_store_processes(handler: handler.Handler):
+    """Tests if processes writing one partition at the same time keep every bar."""
+    root = tempfile.mkdtemp()
+    code = (
+        "import sys, pandas as pd, test\n"
+        "from data_handler.store import PriceStore\n"
+        "from data_handler.bars import BarCache\n"
+        "for i in range(20):\n"
+        "    start = pd.Timestamp('2020-01-01') + pd.Timedelta(days=7 * (2 * i + int(sys.argv[2])))\n"
+        "    end = start + pd.Timedelta(days=7)\n"
+        "    PriceStore(sys.argv[1], BarCache()).write("
+        "'AAPL', '1d', start, end, test.create_bars(str(start.date()), 5))\n"
+    )
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    processes = [
+        subprocess.Popen([sys.executable, "-c", code, root, str(i)], env=env, stderr=subprocess.PIPE)
+        for i in range(2)
+    ]
+    for process in processes:
+        _, error = process.communicate(timeout=60)
+        assert process.returncode == 0, error.decode()
+    store = PriceStore(root, BarCache())
+    start, end = pd.Timestamp("2020-01-01"), pd.Timestamp("2020-12-31")
+    assert len(store.read("AAPL", "1d", start, end)) == 200
+    assert store.get_missing("AAPL", "1d", start, pd.Timestamp("2020-10-07")) == []
+    # Only the files of the last generation are left
+    files = os.listdir(os.path.join(root, "1d", "AAPL"))
+    assert len([file for file in files if file.startswith("index.")]) == 1
+    assert not [file for file in files if file.endswith(".tmp")]
+
+
+store_tests = [
+    (test_store_offline, "Are prices served offline from a seeded store?"),
+    (test_store_missing, "Are only missing ranges downloaded?"),
+    (test_store_compact, "Does the store keep compact bars?"),
+    (test_store_decimal_prices, "Are prices with cents kept exact?"),
+    (test_store_budget, "Are partitions evicted beyond the memory budget?"),
+    (test_store_processes, "Do processes writing one partition keep every bar?"),
+    (test_store_lost_files, "Are partitions with lost files fetched again?"),
+    (test_store_shared, "Are partitions written elsewhere read again?"),
+]
+
+
+# price cache tests
+def test_price_cache_hit(handler: handler.Handler):
+    """Tests if repeated price reads at one simulated instant hit the cache."""
+    handler.store = seed_store("2020-02-03", "2020-04-01")
+    handler.download = fail_download
+    price = handler.get_price("AAPL")
+    handler.store = None
+    assert handler.get_price("AAPL") == price
+    assert handler.price_cache.hits == 1
+    assert handler.price_cache.misses == 1
+
+
+def test_price_cache_invalidation(handler: handler.Handler):
+    """Tests if moving the clock to another bar invalidates the price cache."""
+    handler.store = seed_store("2020-02-03", "2020-04-01")
+    handler.download = fail_download
+    handler.get_price("AAPL")
+    # The daily bar is the same all day, so its price stays cached
+    handler.progress_time(minutes=1)
+    assert len(handler.price_cache) == 1
+    handler.progress_time(days=1)
+    assert len(handler.price_cache) == 0
+    handler.get_price("AAPL")
+    handler.set_date(pd.Timestamp("2020-03-05 16:00:00"))
+    assert len(handler.price_cache) == 0
+
+
+def test_price_cache_eviction(handler: handler.Handler):
+    """Tests if the least recently used price is evicted when the cache is full."""
+    cache = PriceCache(max_size=2)
+    cache.put("a", 1.0)
+    cache.put("b", 2.0)
+    cache.lookup("a")
+    cache.put("c", 3.0)
+    assert cache.lookup("b") == (False, None)
+    assert cache.lookup("a") == (True, 1.0)
+    assert len(cache) == 2
+
+
+price_cache_tests = [
+    (test_price_cache_hit, "Do repeated price reads hit the cache?"),
+    (test_price_cache_invalidation, "Does moving to another bar invalidate the cache?"),
+    (test_price_cache_eviction, "Is the least recently used price evicted?"),
+]
+
+
+# batched price tests
+def test_prices_single_download(handler: handler.Handler):
+    """Tests if uncached prices for many tickers are fetched in one download."""
+    handler.store = PriceStore(tempfile.mkdtemp())
+    downloads = []
+
+    def download_many(tickers, interval, start, end):
+        downloads.append(tickers)
+        return {ticker: pd.DataFrame() for ticker in tickers}
+
+    handler.download_many = download_many
+    prices = handler.get_prices(["AAPL", "MSFT", "GOOG"])
+    assert downloads == [["AAPL", "MSFT", "GOOG"]]
+    assert prices == {"AAPL": None, "MSFT": None, "GOOG": None}
+
+
+def test_portfolio_value_batched(handler: handler.Handler):
+    """Tests if the portfolio value is the dot product of quantities and prices."""
+    handler.store = seed_store("2020-02-03", "2020-04-01", ["AAPL", "MSFT", "GOOG"])
+    handler.download = fail_download
+    handler.download_many = fail_download
+    for ticker in ["AAPL", "MSFT", "GOOG"]:
+        res = handler.buy(ticker, 2)
+        if not res[0]:
+            raise RuntimeError(f"Failed to buy {ticker}")
+    handler.price_cache.clear()
+    assert handler.get_portfolio_value() == 2 * (120 + 220 + 320)
+
+
+batched_price_tests = [
+    (test_prices_single_download, "Are many prices fetched in one download?"),
+    (test_portfolio_value_batched, "Is the batched portfolio value correct?"),
+]
+
+
+# bulk order tests
+def test_orders_single_download(handler: handler.Handler):
+    """Tests if every leg of a batch is priced in one download."""
+    handler.store = PriceStore(tempfile.mkdtemp())
+    downloads = []
+    download_many = handler.download_many
+
+    def download(tickers, interval, start, end):
+        downloads.append(tickers)
+        return download_many(tickers, interval, start, end)
+
+    handler.download_many = download
+    orders = [Order("buy", ticker, 1) for ticker in ["AAPL", "MSFT", "GOOG"]]
+    assert handler.execute_orders(orders) == (True, None)
+    assert downloads == [["AAPL", "MSFT", "GOOG"]]
+
+
+def test_orders_rebalance(handler: handler.Handler):
+    """Tests if sells pay for buys in the same batch."""
+    handler.store = seed_store("2020-02-03", "2020-04-01", ["AAPL", "MSFT"])
+    handler.download = fail_download
+    handler.download_many = fail_download
+    # Only enough cash for the buy once the sell is paid out
+    handler.cash = 220 * 10.0 + 200
+    handler.buy("MSFT", 10)
+    orders = [Order("buy", "AAPL", 10), Order("sell", "MSFT", 5)]
+    assert handler.execute_orders(orders) == (True, None)
+    portfolio = handler.portfolio.set_index("ticker")["quantity"]
+    assert portfolio.to_dict() == {"MSFT": 5, "AAPL": 10}
+    assert handler.cash == 200 + 220 * 5 - 120 * 10
+
+
+def test_orders_atomic(handler: handler.Handler):
+    """Tests if a batch with an invalid leg changes nothing."""
+    handler.store = seed_store("2020-02-03", "2020-04-01", ["AAPL", "MSFT", "GOOG"])
+    handler.download = fail_download
+    handler.download_many = fail_download
+    handler.buy("AAPL", 10)
+    version = handler.version
+    failures = [
+        ([Order("buy", "MSFT", 1), Order("sell", "AAPL", 11)], "Not enough shares: AAPL"),
+        ([Order("buy", "MSFT", 1), Order("sell", "GOOG", 1)], "Ticker not found in portfolio: GOOG"),
+        ([Order("buy", "MSFT", 1), Order("buy", "AAPL", 1000)], "Not enough cash"),
+        ([Order("buy", "MSFT", -1)], "Quantity must be positive: MSFT"),
+        ([], "No orders given"),
+    ]
+    for orders, reason in failures:
+        assert handler.execute_orders(orders) == (False, reason)
+    assert handler.version == version
+    assert handler.cash == init_cash - 120 * 10
+    assert len(handler.portfolio) == 1
+
+
+def test_orders_route(handler: handler.Handler):
+    """Tests if batches of orders can be posted."""
+    client = create_client(["AAPL", "MSFT"])
+    orders = [
+        {"side": "buy", "ticker": "AAPL", "amount": 10},
+        {"side": "buy", "ticker": "MSFT", "amount": "2"},
+    ]
+    res = client.post("/api/orders", json={"orders": orders})
+    assert res.status_code == 200 and res.get_json() == {"success": True}
+    assert client.get("/api/cash").get_json()["cash"] == init_cash - 120 * 10 - 220 * 2
+    res = client.post("/api/orders", json={"orders": [{"side": "sell", "ticker": "AAPL", "amount": 11}]})
+    assert res.status_code == 400 and res.get_json()["reason"] == "Not enough shares: AAPL"
+    assert client.post("/api/orders", json={"orders": [{"ticker": "AAPL"}]}).status_code == 400
+    assert client.post("/api/orders", data="not json").status_code == 400
+
+
+bulk_order_tests = [
+    (test_orders_single_download, "Is every leg of a batch priced in one download?"),
+    (test_orders_rebalance, "Do sells pay for buys in the same batch?"),
+    (test_orders_atomic, "Does a batch with an invalid leg change nothing?"),
+    (test_orders_route, "Can batches of orders be posted?"),
+]
+
+
+# incremental valuation tests
+def count_lookups(handler: handler.Handler) -> int:
+    """This function counts the price lookups of the handler so far."""
+    return handler.price_cache.hits + handler.price_cache.misses
+
+
+def test_valuation_on_trade(handler: handler.Handler):
+    """Tests if trades keep the portfolio value without repricing it."""
+    handler.store = seed_store("2020-02-03", "2020-04-01", ["AAPL", "MSFT"])
+    handler.download = fail_download
+    handler.download_many = fail_download
+    handler.buy("AAPL", 10)
+    handler.buy("MSFT", 5)
+    handler.sell("AAPL", 4)
+    lookups = count_lookups(handler)
+    assert handler.snapshot.value == 6 * 120 + 5 * 220
+    assert handler.get_portfolio_value() == 6 * 120 + 5 * 220
+    assert count_lookups(handler) == lookups
+
+
+def test_valuation_on_tick(handler: handler.Handler):
+    """Tests if moving the clock reprices the held tickers once."""
+    handler.store = seed_store("2020-02-03", "2020-04-01", ["AAPL", "MSFT"])
+    handler.download = fail_download
+    handler.download_many = fail_download
+    handler.buy("AAPL", 10)
+    handler.buy("MSFT", 5)
+    handler.sell("MSFT", 5)
+    handler.progress_time(days=1)
+    assert handler.snapshot.value is None
+    lookups = count_lookups(handler)
+    # A day later every close is one higher, and the sold out MSFT is not repriced
+    assert handler.get_portfolio_value() == 10 * 121
+    assert count_lookups(handler) == lookups + 1
+    assert handler.get_portfolio_value() == 10 * 121
+    assert count_lookups(handler) == lookups + 1
+    # Within the day the daily bar stays the same, so the value is kept without repricing
+    handler.progress_time(hours=1)
+    assert handler.snapshot.value == 10 * 121
+
+
+def test_valuation_matches_full(handler: handler.Handler):
+    """Tests if the incremental value matches a valuation from scratch."""
+    tickers = ["AAPL", "MSFT", "GOOG"]
+    for i in range(30):
+        ticker = tickers[i % 3]
+        if i % 4 == 3:
+            handler.sell(ticker, 1)
+        else:
+            handler.buy(ticker, i % 5 + 1)
+        if i % 7 == 0:
+            handler.progress_time(days=1)
+        handler.get_portfolio_value()
+    fresh = Handler(handler.date, init_cash, provider=SyntheticProvider())
+    fresh.set_state(handler.get_state())
+    assert abs(handler.get_portfolio_value() - fresh.get_portfolio_value()) < 1e-6
+
+
+valuation_tests = [
+    (test_valuation_on_trade, "Do trades keep the value without repricing?"),
+    (test_valuation_on_tick, "Does moving the clock reprice held tickers once?"),
+    (test_valuation_matches_full, "Does the incremental value match a full one?"),
+]
+
+
+# trading calendar tests
+def test_calendar_sessions(handler: handler.Handler):
+    """Tests if the calendar knows the sessions, holidays and early closes."""
+    assert NYSE.is_session(pd.Timestamp("2020-03-02"))
+    assert not NYSE.is_session(pd.Timestamp("2020-03-07"))
+    # Good Friday, Independence Day observed on a Friday and Juneteenth from 2022
+    assert not NYSE.is_session(pd.Timestamp("2020-04-10"))
+    assert not NYSE.is_session(pd.Timestamp("2020-07-03"))
+    assert NYSE.is_session(pd.Timestamp("2020-06-19"))
+    assert not NYSE.is_session(pd.Timestamp("2023-06-19"))
+    assert NYSE.is_open(pd.Timestamp("2020-11-27 12:59"))
+    assert not NYSE.is_open(pd.Timestamp("2020-11-27 13:00"))
+    assert not NYSE.is_open(pd.Timestamp("2020-03-02 09:29"))
+    assert len(NYSE.get_sessions(pd.Timestamp("2020-01-01"), pd.Timestamp("2021-01-01"))) == 253
+
+
+def test_calendar_early_closes(handler: handler.Handler):
+    """Tests if sessions only close early on the days the exchange does."""
+    early = ["2019-07-03", "2002-07-05", "2025-07-03", "2020-11-27", "2020-12-24", "2018-12-24"]
+    for day in early:
+        assert NYSE.is_open(pd.Timestamp(f"{day} 12:59")), day
+        assert not NYSE.is_open(pd.Timestamp(f"{day} 13:00")), day
+    # July 3rd is the observed holiday when July 4th is a Saturday, and the day before it closes as
+    # usual. So do days before holidays observed on a Friday or Monday, and a Wednesday July 3rd
+    # before 2013
+    full = ["2020-07-02", "2026-07-02", "2015-07-02", "2002-07-03", "2022-07-01", "2021-12-23"]
+    for day in full:
+        assert NYSE.is_open(pd.Timestamp(f"{day} 15:59")), day
+    for day in ["2020-07-03", "2026-07-03", "2021-12-24"]:
+        assert not NYSE.is_session(pd.Timestamp(day)), day
+
+
+def test_calendar_bars(handler: handler.Handler):
+    """Tests if the last bar known at a time skips the hours the market is closed."""
+    cases = [
+        # A daily bar is only known once its session closed
+        ("2020-03-02 10:00:30", "2020-02-28", "2020-03-02 10:00"),
+        ("2020-03-02 16:00", "2020-03-02", "2020-03-02 15:59"),
+        # Before the open, on a weekend and on a holiday the bar is the last session's
+        ("2020-03-02 08:00", "2020-02-28", "2020-02-28 15:59"),
+        ("2020-03-08 12:00", "2020-03-06", "2020-03-06 15:59"),
+        ("2020-04-10 12:00", "2020-04-09", "2020-04-09 15:59"),
+        ("2020-11-27 15:00", "2020-11-27", "2020-11-27 12:59"),
+    ]
+    for date, day, minute in cases:
+        assert NYSE.get_bar(pd.Timestamp(date), "1d") == pd.Timestamp(day)
+        assert NYSE.get_bar(pd.Timestamp(date), "1m") == pd.Timestamp(minute)
+    assert NYSE.get_bar(pd.Timestamp("1970-01-01"), "1d") is None
+
+
+def test_price_when_closed(handler: handler.Handler):
+    """Tests if prices while the market is closed are the last session's without downloading."""
+    handler.store = PriceStore(tempfile.mkdtemp())
+    seeded = seed_store("2020-02-03", "2020-04-01")
+    downloads = []
+
+    def download(ticker, interval, start, end):
+        downloads.append((start, end))
+        return seeded.read(ticker, interval, start, end)
+
+    handler.download = download
+    handler.set_date(pd.Timestamp("2020-03-06 16:00:00"))
+    price = handler.get_price("AAPL")
+    assert handler.buy("AAPL", 2)[0]
+    for date in ["2020-03-06 18:00:00", "2020-03-07 10:00:00", "2020-03-08 23:59:00"]:
+        handler.set_date(pd.Timestamp(date))
+        assert handler.get_price("AAPL") == price
+    assert handler.sell("AAPL", 1)[0]
+    assert len(downloads) == 1
+
+
+trading_calendar_tests = [
+    (test_calendar_sessions, "Does the calendar know sessions and holidays?"),
+    (test_calendar_early_closes, "Do sessions close early on the exchange's days?"),
+    (test_calendar_bars, "Do bar lookups skip the hours the market is closed?"),
+    (test_price_when_closed, "Are closed market prices served without downloads?"),
+]
+
+
+# position book and history tests
+def test_positions_sell_keeps_row(handler: handler.Handler):
+    """Tests if selling a whole position keeps it in the portfolio with no shares."""
+    handler.store = seed_store("2020-02-03", "2020-04-01", ["AAPL", "MSFT"])
+    handler.download = fail_download
+    handler.buy("AAPL", 5)
+    handler.buy("MSFT", 5)
+    handler.buy("AAPL", 5)
+    handler.sell("AAPL", 10)
+    portfolio = handler.portfolio
+    assert list(portfolio["ticker"]) == ["AAPL", "MSFT"]
+    assert list(portfolio["quantity"]) == [0, 5]
+    assert handler.get_portfolio_value() == 5 * 220
+
+
+def test_history_growth(handler: handler.Handler):
+    """Tests if the history keeps every row when it outgrows its capacity."""
+    history = History(capacity=2)
+    dates = pd.date_range("2020-01-01", periods=100)
+    for i, date in enumerate(dates):
+        history.append(date, float(i), float(2 * i))
+    frame = history.to_frame()
+    assert len(history) == 100
+    assert list(frame["date"]) == list(dates)
+    assert frame["portfolio_value"].iloc[-1] == 198
+
+
+position_tests = [
+    (test_positions_sell_keeps_row, "Is a sold out position kept in the portfolio?"),
+    (test_history_growth, "Does the history keep every row as it grows?"),
+]
+
+
+# session tests
+def create_sessions(**kwargs) -> SessionManager:
+    """This function creates a session manager whose handlers share one seeded store."""
+    store = seed_store("2020-02-03", "2020-04-01", ["AAPL", "MSFT"])
+
+    def create_handler() -> handler.Handler:
+        stock_handler = handler.Handler(
+            pd.Timestamp("2020-03-02 16:00:00"), init_cash, store
+        )
+        stock_handler.download = fail_download
+        return stock_handler
+
+    return SessionManager(create_handler, **kwargs)
+
+
+def test_sessions_independent(handler: handler.Handler):
+    """Tests if sessions have independent cash and portfolios."""
+    sessions = create_sessions()
+    sessions.get("alice").buy("AAPL", 10)
+    assert sessions.get("alice").cash == init_cash - 1200
+    assert sessions.get("bob").cash == init_cash
+    assert sessions.get("bob").portfolio.empty
+
+
+def test_sessions_spill(handler: handler.Handler):
+    """Tests if evicted sessions are spilled to disk and restored."""
+    sessions = create_sessions(max_sessions=1, spill_dir=tempfile.mkdtemp())
+    sessions.get("alice").buy("AAPL", 10)
+    sessions.get("alice").progress_time(days=1)
+    sessions.get("bob")
+    assert "alice" not in sessions
+    alice = sessions.get("alice")
+    assert alice.cash == init_cash - 1200
+    assert alice.portfolio.iloc[0]["quantity"] == 10
+    assert len(alice.history) == 1
+    assert alice.date == pd.Timestamp("2020-03-03 16:00:00")
+    assert len(sessions) == 1
+
+
+def test_sessions_idle(handler: handler.Handler):
+    """Tests if idle sessions are evicted."""
+    sessions = create_sessions(idle_timeout=0, spill_dir=tempfile.mkdtemp())
+    sessions.get("alice").buy("AAPL", 10)
+    sessions.get("bob")
+    assert "alice" not in sessions
+    assert sessions.get("alice").cash == init_cash - 1200
+
+
+def test_sessions_routes(handler: handler.Handler):
+    """Tests if the routes resolve the handler of the requesting session."""
+    client = server.create_app(create_sessions()).test_client()
+    alice_headers = {"X-Session-ID": "alice"}
+    assert client.post("/api/buy/AAPL/10", headers=alice_headers).status_code == 200
+    alice = client.get("/api/cash", headers=alice_headers).get_json()
+    assert alice["cash"] == init_cash - 1200
+    assert client.get("/api/cash").get_json()["cash"] == init_cash
+    assert client.get("/api/cash", headers={"X-Session-ID": "../x"}).status_code == 400
+
+
+def test_sessions_cookie(handler: handler.Handler):
+    """Tests if clients without a session are given their own in a cookie."""
+    app = server.create_app(create_sessions())
+    alice, bob = app.test_client(), app.test_client()
+    res = alice.post("/api/buy/AAPL/10")
+    assert res.status_code == 200
+    cookie = res.headers["Set-Cookie"]
+    assert cookie.startswith("session_id=") and "HttpOnly" in cookie
+    assert alice.get("/api/cash").get_json()["cash"] == init_cash - 1200
+    # The cookie is only set once, the session is then read from it
+    assert "Set-Cookie" not in alice.get("/api/cash").headers
+    assert bob.get("/api/cash").get_json()["cash"] == init_cash
+    assert alice.get_cookie("session_id").value != bob.get_cookie("session_id").value
+
+
+def test_sessions_slow_load(handler: handler.Handler):
+    """Tests if a session that loads slowly neither holds up others nor is loaded twice."""
+    sessions = create_sessions(spill_dir=tempfile.mkdtemp())
+    load, release, loads = sessions._load, threading.Event(), []
+
+    def slow_load(session_id: str) -> dict or None:
+        loads.append(session_id)
+        if session_id == "slow":
+            assert release.wait(10)
+        return load(session_id)
+
+    sessions._load = slow_load
+    handlers = []
+    threads = [
+        threading.Thread(target=lambda: handlers.append(sessions.get("slow")))
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    while "slow" not in loads:
+        time.sleep(0.01)
+    assert sessions.get("fast").cash == init_cash
+    assert not handlers
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(handlers) == 2 and handlers[0] is handlers[1]
+    assert loads == ["slow", "fast"]
+
+
+session_tests = [
+    (test_sessions_independent, "Are sessions independent?"),
+    (test_sessions_spill, "Are evicted sessions spilled and restored?"),
+    (test_sessions_idle, "Are idle sessions evicted?"),
+    (test_sessions_routes, "Do routes resolve the session's handler?"),
+    (test_sessions_cookie, "Are clients without a session given their own?"),
+    (test_sessions_slow_load, "Are sessions loaded outside the lock?"),
+]
+
+
+# concurrency tests
+def test_concurrent_trades(handler: handler.Handler):
+    """Tests if concurrent buys, sells and clock moves keep cash and shares consistent."""
+    stock_handler = Handler(
+        pd.Timestamp("2020-03-02 16:00:00"),
+        1000,
+        seed_store("2020-02-03", "2020-04-01"),
+    )
+    stock_handler.download = fail_download
+    price = stock_handler.get_price("AAPL")
+    errors = []
+    done = threading.Event()
+
+    def check(snapshot):
+        quantity = sum(position[1] for position in snapshot.positions)
+        if quantity < 0 or abs(snapshot.cash + quantity * price - 1000) > 1e-6:
+            errors.append(f"Inconsistent snapshot {snapshot}")
+
+    def trade(seed: int):
+        rng = random.Random(seed)
+        for _ in range(300):
+            if rng.random() < 0.5:
+                stock_handler.buy("AAPL", rng.randint(1, 3))
+            else:
+                stock_handler.sell("AAPL", rng.randint(1, 3))
+            if rng.random() < 0.1:
+                stock_handler.progress_time(seconds=1)
+
+    def read():
+        while not done.is_set():
+            check(stock_handler.snapshot)
+            stock_handler.portfolio
+            stock_handler.history
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        readers = [threading.Thread(target=read) for _ in range(2)]
+        traders = [threading.Thread(target=trade, args=(i,)) for i in range(8)]
+        for thread in readers + traders:
+            thread.start()
+        for thread in traders:
+            thread.join()
+        done.set()
+        for thread in readers:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    check(stock_handler.snapshot)
+    assert not errors, errors[0]
+    assert stock_handler.date == stock_handler.snapshot.date
+
+
+concurrency_tests = [
+    (test_concurrent_trades, "Do concurrent trades keep the state consistent?"),
+]
+
+
+# fetcher tests
+def run_concurrently(target, count: int = 10) -> None:
+    """This function runs the target on the given number of threads and waits for them."""
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_fetcher_single_flight(handler: handler.Handler):
+    """Tests if concurrent fetches of the same key share one call."""
+    fetcher = Fetcher()
+    calls = []
+    results = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.2)
+        return "data"
+
+    run_concurrently(lambda: results.append(fetcher.fetch(("AAPL",), fetch)))
+    assert len(calls) == 1
+    assert results == ["data"] * 10
+    assert len(fetcher) == 0
+
+
+def test_fetcher_handler(handler: handler.Handler):
+    """Tests if concurrent identical price requests download once."""
+    handler.store = PriceStore(tempfile.mkdtemp())
+    handler.fetcher = Fetcher()
+    seeded = seed_store("2020-02-03", "2020-04-01")
+    downloads = []
+
+    def download(ticker, interval, start, end):
+        downloads.append(ticker)
+        time.sleep(0.2)
+        return seeded.read(ticker, interval, start, end)
+
+    handler.download = download
+    prices = []
+    run_concurrently(lambda: prices.append(handler.get_data("AAPL", None, None)))
+    assert len(downloads) == 1
+    assert all(len(data) == 1 for data in prices)
+
+
+def test_fetcher_timeout(handler: handler.Handler):
+    """Tests if slow fetches time out without failing the request."""
+    handler.store = None
+    handler.fetcher = Fetcher(timeout=0.05)
+
+    def download(ticker, interval, start, end):
+        time.sleep(0.5)
+        return pd.DataFrame({"Close": [1.0]})
+
+    handler.download = download
+    assert handler.get_data("AAPL", None, None).empty
+
+
+fetcher_tests = [
+    (test_fetcher_single_flight, "Do concurrent fetches share one call?"),
+    (test_fetcher_handler, "Do identical price requests download once?"),
+    (test_fetcher_timeout, "Do slow fetches time out?"),
+]
+
+
+# prefetch tests
+def test_prefetch_ahead(handler: handler.Handler):
+    """Tests if moving the clock prefetches the next days of recently priced tickers."""
+    handler.store = PriceStore(tempfile.mkdtemp())
+    handler.prefetcher = Prefetcher(days=5)
+    seeded = seed_store("2020-02-03", "2020-04-01")
+    handler.download = lambda ticker, interval, start, end: seeded.read(
+        ticker, interval, start, end
+    )
+    handler.get_price("AAPL")
+    handler.progress_time(days=1)
+    handler.prefetcher.join()
+    handler.download = fail_download
+    prices = []
+    for _ in range(5):
+        prices.append(handler.get_price("AAPL"))
+        handler.progress_time(days=1)
+    handler.prefetcher.join()
+    # Over the weekend the price is friday 2020-03-06's close
+    assert prices == [121, 122, 123, 124, 124]
+
+
+prefetch_tests = [
+    (test_prefetch_ahead, "Are upcoming bars prefetched when the clock moves?"),
+]
+
+
+# fast-forward tests
+def test_fast_forward_rows(handler: handler.Handler):
+    """Tests if a long jump adds a history row per trading day with the right values."""
+    store = seed_store("2020-02-03", "2020-05-01", ["AAPL", "MSFT"])
+    # Before the close, days are valued at the session before, like prices
+    for start in ["2020-03-02 16:00:00", "2020-03-02 10:00:00"]:
+        jumped = Handler(pd.Timestamp(start), init_cash, store)
+        jumped.download = fail_download
+        jumped.download_many = fail_download
+        jumped.buy("AAPL", 2)
+        jumped.buy("MSFT", 1)
+        stepped = Handler(jumped.date, init_cash, store)
+        stepped.set_state(jumped.get_state())
+        jumped.progress_time(days=30)
+        for _ in range(30):
+            stepped.progress_time(days=1)
+        history = jumped.history
+        stepped_history = stepped.history
+        # Stepping a day at a time also records weekends, which fast-forwarding skips
+        stepped_history = stepped_history[
+            (stepped_history["date"].dt.weekday < 5)
+            | (stepped_history["date"] == pd.Timestamp(start))
+        ].reset_index(drop=True)
+        assert jumped.date == pd.Timestamp(start) + pd.Timedelta(days=30)
+        assert len(history) == 22
+        assert history.equals(stepped_history)
+
+
+def test_fast_forward_empty(handler: handler.Handler):
+    """Tests if a long jump without positions records the cash on every trading day."""
+    handler.download = fail_download
+    handler.progress_time(days=365)
+    history = handler.history
+    assert handler.date == pd.Timestamp("2021-03-02 16:00:00")
+    # The 261 weekdays of the year but the 9 holidays the exchange was closed on
+    assert len(history) == 252
+    assert (history["cash"] == init_cash).all()
+    assert (history["portfolio_value"] == 0).all()
+
+
+fast_forward_tests = [
+    (test_fast_forward_rows, "Does fast-forwarding record every trading day?"),
+    (test_fast_forward_empty, "Does fast-forwarding work without positions?"),
+]
+
+
+# stocks route tests
+def create_client(tickers: list = ["AAPL"]):
+    """This function creates a test client for an app whose handlers use a seeded store."""
+    store = seed_store("2020-02-03", "2020-04-01", tickers)
+
+    def create_handler() -> handler.Handler:
+        stock_handler = Handler(pd.Timestamp("2020-03-02 16:00:00"), init_cash, store)
+        stock_handler.download = fail_download
+        stock_handler.download_many = fail_download
+        return stock_handler
+
+    return server.create_app(SessionManager(create_handler)).test_client()
+
+
+def test_stocks_columnar(handler: handler.Handler):
+    """Tests if stocks can be fetched in the columnar format."""
+    client = create_client()
+    default = json.loads(client.get("/api/stocks/AAPL/2020-02-03/2020-02-10").data)
+    res = client.get("/api/stocks/AAPL/2020-02-03/2020-02-10?format=columnar")
+    columnar = res.get_json()
+    assert columnar["index"] == [int(key) for key in default["Close"]]
+    assert columnar["columns"]["Close"] == list(default["Close"].values())
+    assert columnar["next_cursor"] is None
+
+
+def test_stocks_pagination(handler: handler.Handler):
+    """Tests if stocks can be paged through with a cursor."""
+    client = create_client()
+    url = "/api/stocks/AAPL/2020-02-03/2020-03-02?format=columnar&limit=8"
+    closes = []
+    res = client.get(url)
+    while True:
+        page = res.get_json()
+        closes += page["columns"]["Close"]
+        if page["next_cursor"] is None:
+            break
+        assert res.headers["X-Next-Cursor"] == str(page["next_cursor"])
+        res = client.get(f"{url}&cursor={page['next_cursor']}")
+    assert closes == [float(close) for close in range(100, 120)]
+    assert client.get("/api/stocks/AAPL?limit=0").status_code == 400
+
+
+def test_stocks_downsampling(handler: handler.Handler):
+    """Tests if stocks are aggregated into at most max_points OHLC buckets."""
+    client = create_client()
+    url = "/api/stocks/AAPL/2020-02-03/2020-03-02?format=columnar&max_points=3"
+    res = client.get(url)
+    columns = res.get_json()["columns"]
+    # The 20 bars are split into buckets of 6, 7 and 7 bars
+    assert columns["Open"] == [100, 106, 113]
+    assert columns["High"] == [106, 113, 120]
+    assert columns["Low"] == [99, 105, 112]
+    assert columns["Close"] == [105, 112, 119]
+    assert columns["Volume"] == [6000, 7000, 7000]
+
+
+def test_stocks_streaming(handler: handler.Handler):
+    """Tests if stocks can be streamed as newline delimited JSON."""
+    client = create_client()
+    url = "/api/stocks/AAPL/2020-02-03/2020-04-01?format=columnar&stream=1"
+    res = client.get(url)
+    lines = [json.loads(line) for line in res.get_data(as_text=True).splitlines()]
+    assert res.mimetype == "application/x-ndjson"
+    assert sum(len(line.get("index", [])) for line in lines) == 42
+    assert lines[-1] == {"next_cursor": None}
+
+
+def test_price_route(handler: handler.Handler):
+    """Tests if the price of a stock is served as JSON."""
+    client = create_client()
+    assert client.get("/api/price/AAPL").get_json() == 120
+
+
+stocks_route_tests = [
+    (test_stocks_columnar, "Can stocks be fetched in the columnar format?"),
+    (test_stocks_pagination, "Can stocks be paged through?"),
+    (test_stocks_downsampling, "Are stocks downsampled to max_points?"),
+    (test_stocks_streaming, "Can stocks be streamed?"),
+    (test_price_route, "Is the price of a stock served?"),
+]
+
+
+# http cache tests
+def test_state_etag(handler: handler.Handler):
+    """Tests if state routes are answered with 304 until the state changes."""
+    client = create_client()
+    res = client.get("/api/cash")
+    etag = res.headers["ETag"]
+    assert res.headers["Cache-Control"] == "private, no-cache"
+    res = client.get("/api/cash", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.data == b""
+    assert client.post("/api/buy/AAPL/1").status_code == 200
+    res = client.get("/api/cash", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.headers["ETag"] != etag
+    assert res.get_json()["cash"] == init_cash - 120
+
+
+def test_state_etag_sessions(handler: handler.Handler):
+    """Tests if sessions with the same state have different ETags."""
+    client = create_client()
+    etag = client.get("/api/portfolio").headers["ETag"]
+    res = client.get(
+        "/api/portfolio", headers={"If-None-Match": etag, "X-Session-ID": "other"}
+    )
+    assert res.status_code == 200
+    assert res.headers["ETag"] != etag
+    assert "X-Session-ID" in res.headers["Vary"]
+
+
+def test_stocks_etag(handler: handler.Handler):
+    """Tests if passed ranges of stocks are immutable and answered with 304."""
+    client = create_client()
+    url = "/api/stocks/AAPL/2020-02-03/2020-02-10?format=columnar"
+    res = client.get(url)
+    assert res.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    res = client.get(url, headers={"If-None-Match": res.headers["ETag"]})
+    assert res.status_code == 304
+    # Bars of ranges that have not ended yet may still change
+    res = client.get("/api/stocks/AAPL/2020-02-03/")
+    assert res.headers["Cache-Control"] == "private, no-cache"
+
+
+def test_stocks_partial(handler: handler.Handler):
+    """Tests if passed ranges a download failed for are not cached for good."""
+    store = seed_store("2020-02-03", "2020-04-01")
+
+    def create_handler() -> Handler:
+        stock_handler = Handler(pd.Timestamp("2020-03-02 16:00:00"), init_cash, store)
+        # yfinance reports failures as an empty frame
+        stock_handler.provider.download = lambda *args: pd.DataFrame()
+        return stock_handler
+
+    client = server.create_app(SessionManager(create_handler)).test_client()
+    res = client.get("/api/stocks/AAPL/2020-01-20/2020-02-10?format=columnar")
+    assert len(res.get_json()["index"]) == 5
+    assert res.headers["Cache-Control"] == "private, no-cache"
+
+
+http_cache_tests = [
+    (test_state_etag, "Are state routes answered with 304 until the state changes?"),
+    (test_state_etag_sessions, "Do sessions have different ETags?"),
+    (test_stocks_etag, "Are passed ranges of stocks immutable?"),
+    (test_stocks_partial, "Are ranges with missing bars not cached for good?"),
+]
+
+
+# compression tests
+def test_gzip(handler: handler.Handler):
+    """Tests if large responses are gzipped and small ones are not."""
+    client = create_client()
+    url = "/api/stocks/AAPL/2020-02-03/2020-04-01"
+    plain = client.get(url)
+    res = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert plain.headers.get("Content-Encoding") is None
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in res.headers["Vary"]
+    assert gzip.decompress(res.data) == plain.data
+    assert len(res.data) < len(plain.data)
+    res = client.get("/api/cash", headers={"Accept-Encoding": "gzip"})
+    assert res.headers.get("Content-Encoding") is None
+
+
+def test_gzip_etag(handler: handler.Handler):
+    """Tests if gzipped responses are revalidated with their weak ETag."""
+    client = create_client()
+    url = "/api/stocks/AAPL/2020-02-03/2020-04-01"
+    headers = {"Accept-Encoding": "gzip"}
+    etag = client.get(url, headers=headers).headers["ETag"]
+    assert etag.startswith("W/")
+    res = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert res.status_code == 304
+
+
+def test_gzip_stream(handler: handler.Handler):
+    """Tests if streamed responses are gzipped."""
+    client = create_client()
+    url = "/api/stocks/AAPL/2020-02-03/2020-04-01?format=columnar&stream=1"
+    plain = client.get(url)
+    res = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(res.data) == plain.data
+
+
+def test_columnar_missing(handler: handler.Handler):
+    """Tests if missing values are serialized as null."""
+    data = pd.DataFrame(
+        {"Close": [1.0, np.nan], "Volume": [1, 2]},
+        index=pd.DatetimeIndex(["2020-01-02", "2020-01-03"]),
+    )
+    columnar = json.loads(serialization.dumps(serialization.frame_to_columnar(data)))
+    assert columnar["columns"] == {"Close": [1.0, None], "Volume": [1, 2]}
+    assert columnar["index"] == [1577923200000, 1578009600000]
+
+
+def test_request_log(handler: handler.Handler):
+    """Tests if the request log is sampled and bounded."""
+    client = create_client()
+    app = client.application
+    log = RequestLog(sample_rate=0, max_body=8)
+    with app.test_request_context("/api/cash"), contextlib.redirect_stdout(io.StringIO()) as out:
+        log.log(app.response_class("a" * 100))
+        assert out.getvalue() == ""
+        log.log(app.response_class("b" * 100, status=500))
+    entry = json.loads(out.getvalue())
+    assert entry["status"] == 500
+    assert entry["path"] == "/api/cash"
+    assert entry["body"] == "b" * 8
+
+
+compression_tests = [
+    (test_gzip, "Are large responses gzipped?"),
+    (test_gzip_etag, "Are gzipped responses revalidated?"),
+    (test_gzip_stream, "Are streamed responses gzipped?"),
+    (test_columnar_missing, "Are missing values serialized as null?"),
+    (test_request_log, "Is the request log sampled and bounded?"),
+]
+
+
+# metrics tests
+def test_histogram(handler: handler.Handler):
+    """Tests if histograms are rendered with cumulative buckets."""
+    registry = Registry()
+    histogram = Histogram("test_seconds", "Test", ("kind",), buckets=(0.1, 1), registry=registry)
+    for value in [0.05, 0.5, 0.5, 5]:
+        histogram.observe(value, "a")
+    assert histogram.get_count("a") == 4
+    assert histogram.get_sum("a") == 6.05
+    lines = registry.render().splitlines()
+    assert 'test_seconds_bucket{kind="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{kind="a",le="1"} 3' in lines
+    assert 'test_seconds_bucket{kind="a",le="+Inf"} 4' in lines
+    assert 'test_seconds_count{kind="a"} 4' in lines
+    assert "# TYPE test_seconds histogram" in lines
+
+
+def test_metrics_route(handler: handler.Handler):
+    """Tests if request latencies are served on /metrics."""
+    client = create_client()
+    labels = ("/api/cash", "GET", 200)
+    count = REQUEST_SECONDS.get_count(*labels)
+    client.get("/api/cash")
+    client.get("/api/cash")
+    assert REQUEST_SECONDS.get_count(*labels) == count + 2
+    res = client.get("/metrics")
+    assert res.mimetype == "text/plain"
+    text = res.get_data(as_text=True)
+    series = 'http_request_seconds_count{route="/api/cash",method="GET",status="200"}'
+    assert f"{series} {count + 2}" in text.splitlines()
+    assert "sessions 1" in text.splitlines()
+
+
+def test_metrics_valuation(handler: handler.Handler):
+    """Tests if valuations and price cache lookups are counted."""
+    stock_handler = Handler(
+        pd.Timestamp("2020-03-02 16:00:00"), init_cash, seed_store("2020-02-03", "2020-03-10")
+    )
+    stock_handler.download = fail_download
+    valuations = VALUATION_SECONDS.get_count("portfolio_value")
+    hits = LOOKUPS.get("hit")
+    stock_handler.buy("AAPL", 1)
+    stock_handler.get_portfolio_value()
+    stock_handler.get_price("AAPL")
+    stock_handler.get_price("AAPL")
+    assert VALUATION_SECONDS.get_count("portfolio_value") == valuations + 1
+    assert LOOKUPS.get("hit") >= hits + 2
+
+
+metrics_tests = [
+    (test_histogram, "Are histograms rendered with cumulative buckets?"),
+    (test_metrics_route, "Are request latencies served on /metrics?"),
+    (test_metrics_valuation, "Are valuations and price cache lookups counted?"),
+]
+
+
+# provider tests
+def test_synthetic_consistent(handler: handler.Handler):
+    """Tests if synthetic bars are the same however a range is downloaded."""
+    provider = SyntheticProvider()
+    start, end = pd.Timestamp("2020-02-01"), pd.Timestamp("2020-02-10")
+    whole = provider.download(
+        ["AAPL", "MSFT"], "1d", pd.Timestamp("2020-01-01"), pd.Timestamp("2020-03-01")
+    )
+    part = provider.download(["MSFT"], "1d", start, end)
+    # The 43 weekdays but New Year's Day, Martin Luther King Jr. Day and Presidents' Day
+    assert len(whole) == 40
+    assert whole.columns.names == ["Price", "Ticker"]
+    assert whole.loc[part.index, part.columns].equals(part)
+    assert not whole["Close"]["AAPL"].equals(whole["Close"]["MSFT"])
+    other = SyntheticProvider(seed=1).download(["MSFT"], "1d", start, end)
+    assert not other.equals(part)
+
+
+def test_synthetic_minutes(handler: handler.Handler):
+    """Tests if synthetic minute bars cover the trading hours."""
+    provider = SyntheticProvider()
+    start, end = pd.Timestamp("2020-03-06"), pd.Timestamp("2020-03-10")
+    data = provider.download(["AAPL"], "1m", start, end)
+    # Friday and Monday
+    assert len(data) == 2 * 390
+    assert str(data.index.tz) == "America/New_York"
+    assert data.index[0] == pd.Timestamp("2020-03-06 09:30", tz="America/New_York")
+
+
+def test_synthetic_handler(handler: handler.Handler):
+    """Tests if the handler prices with the provider's bars."""
+    start, end = pd.Timestamp("2020-02-28"), pd.Timestamp("2020-03-03")
+    bars = handler.provider.download(["AAPL"], "1d", start, end)
+    price = handler.get_price("AAPL")
+    assert price == bars["Close"]["AAPL"].iloc[-1]
+    assert handler.buy("AAPL", 10)[0]
+    assert handler.cash == init_cash - price * 10
+
+
+def test_fixture_record(handler: handler.Handler):
+    """Tests if fixtures are recorded from another provider and served offline."""
+    root = tempfile.mkdtemp()
+    start, end = pd.Timestamp("2020-02-03"), pd.Timestamp("2020-03-02")
+    recorder = FixtureProvider(root, record_from=SyntheticProvider())
+    recorded = recorder.download(["AAPL"], "1d", start, end)
+    replayed = FixtureProvider(root).download(["AAPL"], "1d", start, end)
+    assert len(replayed) == 19
+    assert replayed.equals(recorded)
+    assert FixtureProvider(root).download(["MSFT"], "1d", start, end).empty
+
+
+
+def test_fixture_record_ranges(handler: handler.Handler):
+    """Tests if only the ranges a fixture does not cover yet are recorded."""
+    root = tempfile.mkdtemp()
+    synthetic = SyntheticProvider()
+    downloads = []
+
+    def download(tickers, interval, start, end):
+        downloads.append((start, end))
+        return SyntheticProvider.download(synthetic, tickers, interval, start, end)
+
+    synthetic.download = download
+    recorder = FixtureProvider(root, record_from=synthetic)
+    assert len(recorder.download(["AAPL"], "1d", pd.Timestamp("2020-01-01"), pd.Timestamp("2020-02-01"))) == 21
+    assert len(recorder.download(["AAPL"], "1d", pd.Timestamp("2020-03-02"), pd.Timestamp("2020-04-01"))) == 22
+    # Only the gap between the recorded months is downloaded
+    assert len(recorder.download(["AAPL"], "1d", pd.Timestamp("2020-01-15"), pd.Timestamp("2020-03-15"))) == 41
+    assert downloads[-1] == (pd.Timestamp("2020-02-01"), pd.Timestamp("2020-03-02"))
+    assert len(downloads) == 3
+    replayed = FixtureProvider(root).download(["AAPL"], "1d", pd.Timestamp("2020-01-01"), pd.Timestamp("2020-04-01"))
+    assert len(replayed) == 62
+
+
+provider_tests = [
+    (test_synthetic_consistent, "Are synthetic bars consistent?"),
+    (test_synthetic_minutes, "Do synthetic minute bars cover the trading hours?"),
+    (test_synthetic_handler, "Does the handler price with the provider's bars?"),
+    (test_fixture_record, "Are fixtures recorded and replayed?"),
+    (test_fixture_record_ranges, "Are only ranges fixtures do not cover recorded?"),
+]
+
+
+# journal tests
+def create_journaled_sessions(path: str, **kwargs) -> SessionManager:
+    """This function creates a session manager whose sessions are journaled to the given path."""
+
+    def create_handler() -> handler.Handler:
+        return Handler(
+            pd.Timestamp("2020-03-02 16:00:00"), init_cash, provider=SyntheticProvider()
+        )
+
+    return SessionManager(create_handler, journal=Journal(path, **kwargs))
+
+
+def assert_same_state(restored: handler.Handler, original: handler.Handler) -> None:
+    """This function asserts that two handlers have the same state."""
+    assert restored.date == original.date
+    assert restored.cash == original.cash
+    assert restored.portfolio.equals(original.portfolio)
+    assert restored.history.equals(original.history)
+
+
+def test_journal_restore(handler: handler.Handler):
+    """Tests if sessions are restored from the journal after a restart."""
+    path = os.path.join(tempfile.mkdtemp(), "journal.sqlite3")
+    original = create_journaled_sessions(path).get("a")
+    original.buy("AAPL", 10)
+    original.buy("MSFT", 5)
+    original.progress_time(days=1)
+    original.sell("AAPL", 4)
+    original.execute_orders([Order("sell", "MSFT", 5), Order("buy", "GOOG", 3)])
+    original.progress_time(days=10)
+    original.progress_time(hours=2)
+    # Nothing is closed, as if the process had crashed after the last flush
+    original.journal._journal.flush()
+    restored = create_journaled_sessions(path).get("a")
+    assert_same_state(restored, original)
+    assert len(restored.history) == 9
+    assert create_journaled_sessions(path).get("b").cash == init_cash
+
+
+def test_journal_snapshots(handler: handler.Handler):
+    """Tests if snapshots bound the number of journaled events."""
+    path = os.path.join(tempfile.mkdtemp(), "journal.sqlite3")
+    sessions = create_journaled_sessions(path, snapshot_every=4)
+    original = sessions.get("a")
+    for _ in range(10):
+        original.buy("AAPL", 1)
+        original.progress_time(days=1)
+    sessions.journal.close()
+    with sqlite3.connect(path) as connection:
+        events = connection.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+        snapshots = connection.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+    assert events < 4
+    assert snapshots == 1
+    assert_same_state(create_journaled_sessions(path).get("a"), original)
+
+
+def test_journal_write_failure(handler: handler.Handler):
+    """Tests if events a write failed for are written by the next flush."""
+    path = os.path.join(tempfile.mkdtemp(), "journal.sqlite3")
+    sessions = create_journaled_sessions(path, flush_interval=60)
+    original = sessions.get("a")
+    original.buy("AAPL", 10)
+    journal = sessions.journal
+    write = journal._write
+
+    def fail_write(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    journal._write = fail_write
+    with contextlib.suppress(sqlite3.OperationalError):
+        journal.flush()
+    journal._write = write
+    original.progress_time(days=1)
+    original.sell("AAPL", 4)
+    journal.flush()
+    assert_same_state(create_journaled_sessions(path).get("a"), original)
+    # A batch that can never be written is dropped rather than blocking the ones after it
+    original.buy("AAPL", 1)
+
+    def corrupt_write(*args):
+        raise sqlite3.IntegrityError("UNIQUE constraint failed")
+
+    journal._write = corrupt_write
+    journal.flush()
+    journal._write = write
+    assert journal._pending == []
+    original.sell("AAPL", 1)
+    journal.flush()
+    assert create_journaled_sessions(path).get("a").cash == original.cash
+
+
+def test_journal_shared_path(handler: handler.Handler):
+    """Tests if processes journaling to one database number their events apart."""
+    path = os.path.join(tempfile.mkdtemp(), "journal.sqlite3")
+    workers = [create_journaled_sessions(path, flush_interval=60) for _ in range(2)]
+    alice, bob = workers[0].get("alice"), workers[1].get("bob")
+    for _ in range(3):
+        alice.buy("AAPL", 1)
+        bob.buy("MSFT", 2)
+    for worker in workers:
+        worker.journal.flush()
+    restored = create_journaled_sessions(path)
+    assert_same_state(restored.get("alice"), alice)
+    assert_same_state(restored.get("bob"), bob)
+
+
+def test_journal_reset(handler: handler.Handler):
+    """Tests if resets and removed sessions are journaled."""
+    path = os.path.join(tempfile.mkdtemp(), "journal.sqlite3")
+    sessions = create_journaled_sessions(path)
+    original = sessions.get("a")
+    original.buy("AAPL", 10)
+    original.reset()
+    original.buy("MSFT", 1)
+    sessions.get("b").buy("AAPL", 1)
+    sessions.remove("b")
+    sessions.journal.close()
+    restored = create_journaled_sessions(path)
+    assert_same_state(restored.get("a"), original)
+    assert restored.get("b").cash == init_cash
+
+
+journal_tests = [
+    (test_journal_restore, "Are sessions restored from the journal?"),
+    (test_journal_snapshots, "Do snapshots bound the journal?"),
+    (test_journal_write_failure, "Are events kept when writing the journal fails?"),
+    (test_journal_shared_path, "Do journals sharing a database number events apart?"),
+    (test_journal_reset, "Are resets and removals journaled?"),
+]
+
+
+# redis stand-in
+class _RedisHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        watched = {}
+        queued = None
+        while True:
+            try:
+                command = _read_reply(self.rfile)
+            except (ConnectionError, OSError, RedisError):
+                return
+            name, args = command[0].decode().upper(), command[1:]
+            if name == "MULTI":
+                queued = []
+                reply = "OK"
+            elif name == "DISCARD":
+                queued, watched = None, {}
+                reply = "OK"
+            elif name == "EXEC":
+                reply = self.server.execute_transaction(queued or [], watched)
+                queued, watched = None, {}
+            elif queued is not None:
+                queued.append((name, args))
+                reply = "QUEUED"
+            elif name == "WATCH":
+                for key in args:
+                    watched[key] = self.server.get_revision(key)
+                reply = "OK"
+            elif name == "UNWATCH":
+                watched = {}
+                reply = "OK"
+            else:
+                reply = self.server.execute(name, args)
+            self.wfile.write(_encode_reply(reply))
+
+
+def _encode_reply(reply) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, RedisError):
+        return f"-{reply}\r\n".encode()
+    if isinstance(reply, str):
+        return f"+{reply}\r\n".encode()
+    if isinstance(reply, int):
+        return f":{reply}\r\n".encode()
+    if isinstance(reply, bytes):
+        return f"${len(reply)}\r\n".encode() + reply + b"\r\n"
+    return f"*{len(reply)}\r\n".encode() + b"".join(_encode_reply(r) for r in reply)
+
+
+class LocalRedisServer(socketserver.ThreadingTCPServer):
+    """An in-process stand-in for a Redis server
+
+    It keeps its data in memory and supports the commands the shared state
+    backend uses: PING, GET, SET with EX, DEL, INCR, WATCH, UNWATCH, MULTI,
+    EXEC and DISCARD.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _RedisHandler)
+        self._data = {}
+        self._expiry = {}
+        # Every write bumps the revision of its key, which is what WATCH compares
+        self._revisions = {}
+        self._lock = threading.RLock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"redis://{host}:{port}"
+
+    def start(self) -> "LocalRedisServer":
+        """Serves in a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stops serving"""
+        self.shutdown()
+        self.server_close()
+
+    def get_revision(self, key: bytes) -> int:
+        with self._lock:
+            self._expire(key)
+            return self._revisions.get(key, 0)
+
+    def _expire(self, key: bytes) -> None:
+        expiry = self._expiry.get(key)
+        if expiry is not None and expiry <= time.monotonic():
+            self._write(key, None)
+
+    def _write(self, key: bytes, value: bytes or None) -> None:
+        if value is None:
+            self._data.pop(key, None)
+        else:
+            self._data[key] = value
+        self._expiry.pop(key, None)
+        self._revisions[key] = self._revisions.get(key, 0) + 1
+
+    def execute_transaction(self, queued: list, watched: dict):
+        with self._lock:
+            if any(self.get_revision(key) != revision for key, revision in watched.items()):
+                return None
+            return [self.execute(name, args) for name, args in queued]
+
+    def execute(self, name: str, args: list):
+        with self._lock:
+            for key in args[:1]:
+                self._expire(key)
+            if name == "PING":
+                return "PONG"
+            if name == "GET":
+                return self._data.get(args[0])
+            if name == "SET":
+                self._write(args[0], args[1])
+                if len(args) == 4 and args[2].upper() == b"EX":
+                    self._expiry[args[0]] = time.monotonic() + int(args[3])
+                return "OK"
+            if name == "DEL":
+                deleted = 0
+                for key in args:
+                    self._expire(key)
+                    if key in self._data:
+                        self._write(key, None)
+                        deleted += 1
+                return deleted
+            if name == "INCR":
+                value = int(self._data.get(args[0], b"0")) + 1
+                self._write(args[0], str(value).encode())
+                return value
+            return RedisError(f"ERR unknown command '{name}'")
+
+
+# shared state tests
+def create_replica(backend: StateBackend) -> SessionManager:
+    """This function creates the sessions of a server replica that shares the given backend."""
+
+    def create_handler() -> handler.Handler:
+        return Handler(
+            pd.Timestamp("2020-03-02 16:00:00"), init_cash, provider=SyntheticProvider()
+        )
+
+    return SessionManager(create_handler, shared=backend)
+
+
+def create_backends() -> list:
+    """This function creates a backend of each kind, with Redis served by the local stand-in."""
+    server = LocalRedisServer().start()
+    return [
+        SQLiteStateBackend(os.path.join(tempfile.mkdtemp(), "state.sqlite3")),
+        RedisStateBackend(RedisClient.from_url(server.url)),
+    ]
+
+
+def test_shared_replicas(handler: handler.Handler):
+    """Tests if replicas see each other's trades."""
+    for backend in create_backends():
+        first, second = create_replica(backend), create_replica(backend)
+        assert first.get("a").buy("AAPL", 10)[0]
+        assert second.get("a").portfolio.iloc[0]["quantity"] == 10
+        assert second.get("a").sell("AAPL", 4)[0]
+        second.get("a").progress_time(days=1)
+        assert_same_state(first.get("a"), second.get("a"))
+        assert first.get("a").portfolio.iloc[0]["quantity"] == 6
+        assert first.get("b").cash == init_cash
+        first.remove("a")
+        assert create_replica(backend).get("a").cash == init_cash
+
+
+def test_shared_conflict(handler: handler.Handler):
+    """Tests if a trade on a stale replica is retried on the latest state."""
+    for backend in create_backends():
+        first, second = create_replica(backend), create_replica(backend)
+        stale = second.get("a")
+        first.get("a").buy("AAPL", 10)
+        # The stale handler is used without syncing it first, as if both traded at once
+        assert stale.buy("AAPL", 5)[0]
+        assert stale.portfolio.iloc[0]["quantity"] == 15
+        assert_same_state(first.get("a"), stale)
+        assert backend.get_version("a") == 2
+
+
+def test_shared_concurrent(handler: handler.Handler):
+    """Tests if concurrent trades on several replicas are all applied."""
+    for backend in create_backends():
+        replicas = [create_replica(backend) for _ in range(3)]
+        for replica in replicas:
+            replica.get("a").buy("AAPL", 1)
+
+        def trade():
+            for replica in replicas:
+                assert replica.get("a").buy("AAPL", 1)[0]
+
+        run_concurrently(trade, 4)
+        stock_handler = replicas[0].get("a")
+        price = stock_handler.get_price("AAPL")
+        assert stock_handler.portfolio.iloc[0]["quantity"] == 15
+        assert abs(stock_handler.cash - (init_cash - 15 * price)) < 1e-6
+
+
+def test_shared_prices(handler: handler.Handler):
+    """Tests if prices are shared between replicas."""
+    for backend in create_backends():
+        key = ("AAPL", "1d", pd.Timestamp("2020-03-03"))
+        PriceCache(backend=backend).put(key, 123.5)
+        PriceCache(backend=backend).put(("MSFT",) + key[1:], None)
+        cache = PriceCache(backend=backend)
+        assert cache.lookup(key) == (True, 123.5)
+        assert cache.lookup(("MSFT",) + key[1:]) == (True, None)
+        assert cache.lookup(("GOOG",) + key[1:]) == (False, None)
+        assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_shared_prices_failure(handler: handler.Handler):
+    """Tests if a price a download failed for is not cached or shared."""
+    for backend in create_backends():
+        store = seed_store("2020-02-03", "2020-04-01")
+        provider = SyntheticProvider()
+        download = provider.download
+        provider.download = lambda *args: pd.DataFrame()
+        replicas = []
+        for _ in range(2):
+            replica = Handler(pd.Timestamp("2020-03-02 16:00:00"), init_cash, store, provider=provider)
+            replica.price_cache = PriceCache(backend=backend)
+            replicas.append(replica)
+        assert replicas[0].get_price("MSFT") is None
+        provider.download = download
+        assert replicas[0].get_price("MSFT") is not None
+        replicas[0].buy("MSFT", 1)
+        assert replicas[1].get_price("MSFT") == replicas[0].get_price("MSFT")
+
+
+def test_redis_watch(handler: handler.Handler):
+    """Tests if the Redis stand-in aborts transactions on watched keys that changed."""
+    server = LocalRedisServer().start()
+    first, second = RedisClient.from_url(server.url), RedisClient.from_url(server.url)
+    first.execute("SET", "key", "a")
+    first.execute("WATCH", "key")
+    second.execute("SET", "key", "b")
+    first.execute("MULTI")
+    first.execute("SET", "key", "c")
+    assert first.execute("EXEC") is None
+    assert first.execute("GET", "key") == b"b"
+    first.execute("MULTI")
+    first.execute("INCR", "count")
+    assert first.execute("EXEC") == [1]
+    server.stop()
+
+
+def test_redis_transaction_failure(handler: handler.Handler):
+    """Tests if a transaction that fails halfway does not hold on to the connection's MULTI."""
+    server = LocalRedisServer().start()
+    client = RedisClient.from_url(server.url)
+    with contextlib.suppress(ValueError), client.transaction():
+        client.execute("WATCH", "key")
+        client.execute("MULTI")
+        client.execute("SET", "key", "a")
+        raise ValueError("Failed halfway")
+    assert client.execute("SET", "key", "b") == "OK"
+    assert client.execute("GET", "key") == b"b"
+    server.stop()
+
+
+shared_state_tests = [
+    (test_shared_replicas, "Do replicas see each other's trades?"),
+    (test_shared_conflict, "Are trades on stale replicas retried?"),
+    (test_shared_concurrent, "Are concurrent trades on replicas all applied?"),
+    (test_shared_prices, "Are prices shared between replicas?"),
+    (test_shared_prices_failure, "Are prices of failed downloads left uncached?"),
+    (test_redis_watch, "Does the Redis stand-in honour WATCH?"),
+    (test_redis_transaction_failure, "Are failed transactions dropped with their connection?"),
+]
+
+
+# startup tests
+def test_lazy_imports(handler: handler.Handler):
+    """Tests if the server starts without importing yfinance."""
+    code = "import sys, main; main.create_app(); print('yfinance' in sys.modules)"
+    env = dict(os.environ, JOURNAL_PATH="", LOG_SAMPLE_RATE="0")
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=tempfile.mkdtemp(),
+        env=dict(env, PYTHONPATH=os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert output.splitlines()[-1] == "False"
+    assert output.startswith("Started in ")
+
+
+def test_warm_up(handler: handler.Handler):
+    """Tests if the warm-up prices the watchlist from the store without downloading."""
+    store = seed_store("2020-02-03", "2020-04-01", ["AAPL", "MSFT"])
+
+    def create_handler() -> Handler:
+        stock_handler = Handler(pd.Timestamp("2020-03-02 16:00:00"), init_cash, store)
+        stock_handler.download = fail_download
+        stock_handler.download_many = fail_download
+        return stock_handler
+
+    sessions = SessionManager(create_handler)
+    warm_up = WarmUp(sessions, ["AAPL", "MSFT", "GOOG"])
+    warm_up.run()
+    assert warm_up.is_ready()
+    assert warm_up.warmed == ["AAPL", "MSFT"]
+    stock_handler = sessions.get(DEFAULT_SESSION)
+    key = ("AAPL",) + stock_handler.get_bar(stock_handler.date)
+    assert stock_handler.price_cache.lookup(key) == (True, 120)
+
+
+def test_health_routes(handler: handler.Handler):
+    """Tests if readiness waits for the warm-up while liveness does not."""
+    sessions = SessionManager(lambda: Handler(pd.Timestamp("2020-03-02 16:00:00"), init_cash))
+    warm_up = WarmUp(sessions)
+    started = threading.Event()
+    release = threading.Event()
+    run = warm_up.run
+
+    def slow_run():
+        started.set()
+        release.wait()
+        run()
+
+    warm_up.run = slow_run
+    client = server.create_app(sessions, warm_up).test_client()
+    assert client.get("/healthz").status_code == 200
+    assert started.wait(5)
+    assert client.get("/readyz").status_code == 503
+    release.set()
+    assert warm_up.wait(5)
+    assert client.get("/readyz").status_code == 200
+    assert client.get("/healthz").status_code == 200
+
+
+startup_tests = [
+    (test_lazy_imports, "Does the server start without importing yfinance?"),
+    (test_warm_up, "Does the warm-up price the watchlist from the store?"),
+    (test_health_routes, "Does readiness wait for the warm-up?"),
+]
+
+
+# event tests
+def create_seeded_handler(tickers: list = ["AAPL", "MSFT"]) -> handler.Handler:
+    """This function creates a handler that prices from a seeded store only."""
+    stock_handler = Handler(
+        pd.Timestamp("2020-03-02 16:00:00"), init_cash, seed_store("2020-02-03", "2020-04-01", tickers)
+    )
+    stock_handler.download = fail_download
+    stock_handler.download_many = fail_download
+    return stock_handler
+
+
+def pop_until(subscription: Subscription, kinds: set, timeout: float = 5) -> dict:
+    """This function collects the updates of a subscription until it got every kind."""
+    received = {}
+    deadline = time.monotonic() + timeout
+    while not kinds <= received.keys():
+        assert time.monotonic() < deadline, f"Got {received}"
+        for kind, update in subscription.pop(0.1):
+            received.setdefault(kind, {}).update(update)
+    return received
+
+
+def test_events_initial(handler: handler.Handler):
+    """Tests if a subscription starts with the whole state and its prices."""
+    stock_handler = create_seeded_handler()
+    stock_handler.buy("AAPL", 2)
+    subscription = stock_handler.broadcaster.subscribe(["AAPL"])
+    updates = pop_until(subscription, {"state", "prices"})
+    assert updates["prices"] == {"AAPL": 120.0}
+    assert updates["state"]["date"] == "2020-03-02 16:00:00"
+    assert updates["state"]["cash"] == init_cash - 240
+    assert updates["state"]["value"] == 240
+    assert updates["state"]["portfolio"][0]["ticker"] == "AAPL"
+    stock_handler.broadcaster.unsubscribe(subscription)
+
+
+def test_events_deltas(handler: handler.Handler):
+    """Tests if trades and moves of the clock push only what changed."""
+    stock_handler = create_seeded_handler()
+    subscription = stock_handler.broadcaster.subscribe(["AAPL"])
+    pop_until(subscription, {"state", "prices"})
+    stock_handler.buy("AAPL", 10)
+    state = pop_until(subscription, {"state"})["state"]
+    assert state["cash"] == init_cash - 1200
+    assert state["value"] == 1200
+    assert state["portfolio"][0]["quantity"] == 10
+    assert "date" not in state
+    stock_handler.progress_time(days=1)
+    updates = pop_until(subscription, {"state", "prices"})
+    assert updates["state"]["date"] == "2020-03-03 16:00:00"
+    assert updates["state"]["value"] == 1210
+    assert "cash" not in updates["state"] and "portfolio" not in updates["state"]
+    assert updates["prices"] == {"AAPL": 121.0}
+    stock_handler.broadcaster.unsubscribe(subscription)
+
+
+def test_events_fan_out(handler: handler.Handler):
+    """Tests if prices are looked up once per tick for every subscriber."""
+    stock_handler = create_seeded_handler()
+    subscriptions = [
+        stock_handler.broadcaster.subscribe(tickers)
+        for tickers in (["AAPL"], ["AAPL", "MSFT"], ["MSFT"])
+    ]
+    for subscription in subscriptions:
+        pop_until(subscription, {"state", "prices"})
+    calls = []
+    get_prices = stock_handler.get_prices
+
+    def count_prices(tickers: list, date: pd.Timestamp or None = None) -> dict:
+        calls.append(tickers)
+        return get_prices(tickers, date)
+
+    stock_handler.get_prices = count_prices
+    stock_handler.progress_time(days=1)
+    prices = [pop_until(s, {"prices"})["prices"] for s in subscriptions]
+    assert calls == [["AAPL", "MSFT"]]
+    assert prices == [{"AAPL": 121.0}, {"AAPL": 121.0, "MSFT": 221.0}, {"MSFT": 221.0}]
+    for subscription in subscriptions:
+        stock_handler.broadcaster.unsubscribe(subscription)
+
+
+def test_events_coalesce(handler: handler.Handler):
+    """Tests if a slow subscriber gets the latest values instead of a backlog."""
+    subscription = Subscription(["AAPL"])
+    subscription.push("state", {"cash": 1.0, "version": 1})
+    subscription.push("state", {"cash": 2.0})
+    subscription.push("prices", {})
+    assert subscription.pop(0) == [("state", {"cash": 2.0, "version": 1})]
+    assert subscription.pop(0) == []
+
+
+def test_events_route(handler: handler.Handler):
+    """Tests if GET /api/events streams the state and its changes."""
+    sessions = SessionManager(create_seeded_handler)
+    client = server.create_app(sessions).test_client()
+    res = client.get("/api/events?tickers=AAPL")
+    assert res.status_code == 200
+    assert res.mimetype == "text/event-stream"
+    assert res.headers["Cache-Control"] == "no-cache"
+    chunks = iter(res.response)
+    assert next(chunks) == b"retry: 1000\n\n"
+    events = next(chunks)
+    if b"event: prices" not in events:
+        events += next(chunks)
+    assert b"event: state\ndata: {" in events
+    assert b'event: prices\ndata: {"AAPL":120.0}\n\n' in events
+    client.post("/api/buy/AAPL/1")
+    assert b'"cash":' in next(chunks)
+    res.close()
+    session_id = client.get_cookie("session_id").value
+    assert len(sessions.get(session_id).broadcaster) == 0
+
+
+def test_events_slow_subscribe(handler: handler.Handler):
+    """Tests if a subscription reading slow prices neither blocks others nor misses a trade."""
+    stock_handler = create_seeded_handler()
+    get_prices, started, release = stock_handler.get_prices, threading.Event(), threading.Event()
+
+    def slow_prices(tickers: list, date: pd.Timestamp or None = None) -> dict:
+        if "MSFT" in tickers and not release.is_set():
+            started.set()
+            assert release.wait(10)
+        return get_prices(tickers, date)
+
+    stock_handler.get_prices = slow_prices
+    subscriptions = []
+    thread = threading.Thread(
+        target=lambda: subscriptions.append(stock_handler.broadcaster.subscribe(["MSFT"]))
+    )
+    thread.start()
+    assert started.wait(5)
+    subscription = stock_handler.broadcaster.subscribe(["AAPL"])
+    assert pop_until(subscription, {"prices"})["prices"] == {"AAPL": 120.0}
+    stock_handler.buy("AAPL", 1)
+    release.set()
+    thread.join()
+    updates = pop_until(subscriptions[0], {"state", "prices"})
+    assert updates["state"]["cash"] == init_cash - 120
+    assert updates["prices"] == {"MSFT": 220.0}
+    for subscription in subscriptions + [subscription]:
+        stock_handler.broadcaster.unsubscribe(subscription)
+
+
+event_tests = [
+    (test_events_initial, "Does a subscription start with the whole state?"),
+    (test_events_deltas, "Are only the changed fields pushed?"),
+    (test_events_fan_out, "Are prices looked up once for every subscriber?"),
+    (test_events_coalesce, "Are updates for slow subscribers merged?"),
+    (test_events_slow_subscribe, "Do subscriptions read the state outside the lock?"),
+    (test_events_route, "Does GET /api/events stream the state?"),
+]
+
+
+# analytics tests
+def test_analytics_values(handler: handler.Handler):
+    """Tests if the analytics match the ones computed over the whole history."""
+    history = History()
+    equity = 1000 * np.cumprod(1 + np.random.default_rng(1).normal(0, 0.01, 300))
+    history.extend(pd.bdate_range("2020-01-01", periods=300).values, 100.0, equity - 100)
+    analytics = HistoryAnalytics()
+    analytics.update(history, len(history))
+    series = analytics.get_series(len(history), 21)
+    summary = analytics.get_summary(len(history))
+    returns = pd.Series(equity).pct_change()
+    assert np.allclose(series["returns"].to_numpy()[1:], returns.to_numpy()[1:])
+    assert np.allclose(
+        series["volatility"].to_numpy()[21:],
+        (returns.rolling(21).std() * np.sqrt(252)).to_numpy()[21:],
+    )
+    assert series["volatility"].isna().sum() == 21
+    drawdown = equity / np.maximum.accumulate(equity) - 1
+    assert np.allclose(series["drawdown"].to_numpy(), drawdown)
+    assert np.isclose(summary["max_drawdown"], drawdown.min())
+    assert np.isclose(summary["volatility"], returns.std() * np.sqrt(252))
+    assert np.isclose(summary["sharpe"], returns.mean() / returns.std() * np.sqrt(252))
+    assert np.isclose(summary["total_return"], equity[-1] / equity[0] - 1)
+
+
+def test_analytics_incremental(handler: handler.Handler):
+    """Tests if only appended history rows are computed, and a new history from scratch."""
+    history = History()
+    equity = 1000 * np.cumprod(1 + np.random.default_rng(2).normal(0, 0.01, 100))
+    dates = pd.bdate_range("2020-01-01", periods=100).values
+    analytics = HistoryAnalytics()
+    history.extend(dates[:60], 0.0, equity[:60])
+    analytics.update(history, 60)
+    read = []
+    get_columns = history.get_columns
+
+    def count_columns(start: int, end: int):
+        read.append((start, end))
+        return get_columns(start, end)
+
+    history.get_columns = count_columns
+    history.extend(dates[60:], 0.0, equity[60:])
+    analytics.update(history, 100)
+    assert read == [(60, 100)]
+    whole = HistoryAnalytics()
+    whole.update(history, 100)
+    expected, summary = whole.get_summary(100), analytics.get_summary(100)
+    assert all(np.isclose(expected[name], summary[name]) for name in expected)
+    pd.testing.assert_frame_equal(whole.get_series(100, 10), analytics.get_series(100, 10))
+    # Older snapshots read the statistics as of their size
+    assert analytics.get_summary(60)["max_drawdown"] == whole.get_series(60, 10)["drawdown"].min()
+    analytics.update(History(), 0)
+    assert len(analytics) == 0
+
+
+def test_analytics_flat(handler: handler.Handler):
+    """Tests if a history with the same return every day has no volatility and no Sharpe ratio."""
+    history = History()
+    volatile = 1000 * np.cumprod(1 + np.random.default_rng(3).normal(0, 0.01, 100))
+    dates = pd.bdate_range("2020-01-01", periods=350).values
+    history.extend(dates[:100], 0.0, volatile)
+    history.extend(dates[100:], 0.0, volatile[-1] * 1.0007 ** np.arange(1, 251))
+    analytics = HistoryAnalytics()
+    analytics.update(history, 350)
+    assert (analytics.get_series(350, 21)["volatility"].to_numpy()[121:] == 0).all()
+    steady = History()
+    steady.extend(dates[:250], 0.0, 1000 * 1.0007 ** np.arange(250))
+    analytics.update(steady, 250)
+    summary = analytics.get_summary(250)
+    assert summary["volatility"] == 0
+    assert summary["sharpe"] is None
+    assert np.isclose(summary["total_return"], 1.0007**249 - 1)
+
+
+def test_position_pnl(handler: handler.Handler):
+    """Tests if positions keep their cost at the average price and the profit of sales."""
+    stock_handler = create_seeded_handler()
+    stock_handler.buy("AAPL", 10)
+    stock_handler.progress_time(days=1)
+    stock_handler.buy("AAPL", 10)
+    stock_handler.progress_time(days=2)
+    stock_handler.sell("AAPL", 5)
+    stock_handler.execute_orders([Order("buy", "MSFT", 2), Order("sell", "AAPL", 15)])
+    pnl = stock_handler.get_position_pnl().set_index("ticker")
+    # 20 shares at an average of 120.5, 20 sold at 123
+    assert pnl.loc["AAPL", "quantity"] == 0
+    assert pnl.loc["AAPL", "cost"] == 0
+    assert pnl.loc["AAPL", "realized"] == 20 * (123 - 120.5)
+    assert pnl.loc["MSFT", "cost"] == 2 * 223
+    assert pnl.loc["MSFT", "value"] == 2 * 223
+    stock_handler.progress_time(days=1)
+    pnl = stock_handler.get_position_pnl().set_index("ticker")
+    assert pnl.loc["MSFT", "unrealized"] == 2
+    assert pnl.loc["AAPL", "pnl"] == 50
+    restored = create_seeded_handler()
+    restored.set_state(pickle.loads(pickle.dumps(stock_handler.get_state())))
+    assert restored.get_position_pnl().equals(stock_handler.get_position_pnl())
+
+
+def test_position_pnl_leg_order(handler: handler.Handler):
+    """Tests if a batch selling shares it buys books the same profit whatever the order of its legs."""
+    pnls = []
+    for orders in [
+        [Order("sell", "AAPL", 3), Order("buy", "AAPL", 5)],
+        [Order("buy", "AAPL", 5), Order("sell", "AAPL", 3)],
+    ]:
+        stock_handler = create_seeded_handler()
+        assert stock_handler.execute_orders(orders) == (True, None)
+        pnls.append(stock_handler.get_position_pnl().set_index("ticker"))
+    assert pnls[0].equals(pnls[1])
+    assert pnls[0].loc["AAPL", "quantity"] == 2
+    assert pnls[0].loc["AAPL", "realized"] == 0
+
+
+def test_analytics_route(handler: handler.Handler):
+    """Tests if GET /api/analytics returns the summary, series and positions."""
+    client = create_client(["AAPL", "MSFT"])
+    client.post("/api/buy/AAPL/10")
+    client.post("/api/date/progress_time/5")
+    res = client.get("/api/analytics?window=2")
+    assert res.status_code == 200
+    body = res.get_json()
+    # A row per weekday from Monday up to Saturday, AAPL gaining 1 a day
+    assert np.isclose(body["summary"]["total_return"], 40 / init_cash)
+    assert body["summary"]["max_drawdown"] == 0
+    assert len(body["series"]["index"]) == 5
+    assert body["series"]["columns"]["returns"][0] is None
+    assert body["positions"] == [
+        {
+            "ticker": "AAPL",
+            "quantity": 10,
+            "cost": 1200,
+            "price": 124,
+            "value": 1240,
+            "unrealized": 40,
+            "realized": 0,
+            "pnl": 40,
+        }
+    ]
+    assert client.get("/api/analytics?window=1").status_code == 400
+
+
+analytics_tests = [
+    (test_analytics_values, "Do the analytics match the ones over the whole history?"),
+    (test_analytics_incremental, "Are only appended history rows computed?"),
+    (test_analytics_flat, "Does a flat history have no volatility?"),
+    (test_position_pnl, "Do positions keep their cost and realized profit?"),
+    (test_position_pnl_leg_order, "Is the profit of a batch independent of its leg order?"),
+    (test_analytics_route, "Does GET /api/analytics return the performance?"),
+]
+
+
+# job tests
+def wait_for_job(job, timeout: float = 5) -> None:
+    """This function waits until a job is finished."""
+    deadline = time.monotonic() + timeout
+    while not job.is_finished():
+        assert time.monotonic() < deadline, f"Job is still {job.status}"
+        time.sleep(0.005)
+
+
+def test_job_dedupe(handler: handler.Handler):
+    """Tests if identical jobs share a single run and its result."""
+    jobs = JobQueue()
+    release = threading.Event()
+    runs = []
+
+    def run(job):
+        runs.append(job.id)
+        release.wait(5)
+        return {"answer": 42}
+
+    job = jobs.submit(("answer",), "test", run)
+    assert jobs.submit(("answer",), "test", run) is job
+    release.set()
+    wait_for_job(job)
+    assert job.status == "done"
+    assert job.result == {"answer": 42}
+    assert jobs.submit(("answer",), "test", run) is job
+    assert runs == [job.id]
+    other = jobs.submit(("other",), "test", run)
+    wait_for_job(other)
+    assert runs == [job.id, other.id]
+
+
+def test_job_queue_bound(handler: handler.Handler):
+    """Tests if jobs beyond the queue depth are refused."""
+    jobs = JobQueue(max_workers=1, max_queued=1)
+    release = threading.Event()
+    running = jobs.submit(("running",), "test", lambda job: release.wait(5))
+    deadline = time.monotonic() + 5
+    while running.status != "running":
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+    queued = jobs.submit(("queued",), "test", lambda job: True)
+    assert jobs.queued == 1
+    try:
+        jobs.submit(("refused",), "test", lambda job: True)
+        raise AssertionError("The job was queued")
+    except QueueFull:
+        pass
+    release.set()
+    wait_for_job(queued)
+    assert jobs.queued == 0
+
+
+def test_job_cancel(handler: handler.Handler):
+    """Tests if queued jobs are cancelled right away and running ones at their next step."""
+    jobs = JobQueue(max_workers=1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def run(job):
+        started.set()
+        release.wait(5)
+        return None if job.is_cancelled() else "finished"
+
+    running = jobs.submit(("running",), "test", run)
+    queued = jobs.submit(("queued",), "test", run)
+    assert started.wait(5)
+    assert jobs.cancel(queued.id).status == "cancelled"
+    jobs.cancel(running.id)
+    assert running.status == "running"
+    release.set()
+    wait_for_job(running)
+    assert running.status == "cancelled"
+    # Cancelled and failed jobs are run again
+    assert jobs.submit(("running",), "test", run) is not running
+    failed = jobs.submit(("failed",), "test", lambda job: 1 / 0)
+    wait_for_job(failed)
+    assert failed.status == "failed" and failed.error == "division by zero"
+    assert jobs.submit(("failed",), "test", lambda job: 1) is not failed
+    assert jobs.cancel("unknown") is None
+
+
+def test_progress_time_cancelled(handler: handler.Handler):
+    """Tests if a cancelled jump leaves the time as it was."""
+    stock_handler = create_seeded_handler()
+    stock_handler.buy("AAPL", 1)
+    assert not stock_handler.progress_time(days=10, is_cancelled=lambda: True)
+    assert stock_handler.date == pd.Timestamp("2020-03-02 16:00:00")
+    assert len(stock_handler.history_rows) == 0
+    assert stock_handler.progress_time(days=10, is_cancelled=lambda: False)
+    assert stock_handler.date == pd.Timestamp("2020-03-12 16:00:00")
+
+
+def poll_job(client, res) -> object:
+    """This function polls the result of the job a response points to until it is done."""
+    assert res.status_code == 202
+    location = res.headers["Location"]
+    deadline = time.monotonic() + 5
+    while True:
+        result = client.get(location + "/result")
+        if result.status_code != 202:
+            return result
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_job_routes(handler: handler.Handler):
+    """Tests if heavy routes run as jobs that can be polled and cancelled."""
+    client = create_client(["AAPL"])
+    res = client.post("/api/date/progress_time/10?async=1")
+    assert res.get_json()["kind"] == "progress_time"
+    result = poll_job(client, res)
+    assert result.status_code == 200
+    assert result.get_json() == {"date": "2020-03-12 16:00:00"}
+    assert client.get("/api/date").get_data(as_text=True) == "2020-03-12 16:00:00"
+    job_id = res.get_json()["id"]
+    assert client.get(f"/api/jobs/{job_id}").get_json()["status"] == "done"
+    res = client.get(
+        "/api/stocks/AAPL/2020-02-03/2020-03-02", headers={"Prefer": "respond-async"}
+    )
+    result = poll_job(client, res)
+    assert result.get_json()["columns"]["Close"] == list(np.arange(100.0, 120.0))
+    # The same range is served by the same job
+    again = client.get("/api/stocks/AAPL/2020-02-03/2020-03-02?async=1")
+    assert again.get_json()["id"] == res.get_json()["id"]
+    assert client.delete(f"/api/jobs/{job_id}").get_json()["status"] == "done"
+    assert client.get("/api/jobs/unknown").status_code == 404
+    assert client.get("/api/jobs/unknown/result").status_code == 404
+    assert client.delete("/api/jobs/unknown").status_code == 404
+
+
+job_tests = [
+    (test_job_dedupe, "Do identical jobs share a run?"),
+    (test_job_queue_bound, "Are jobs beyond the queue depth refused?"),
+    (test_job_cancel, "Can jobs be cancelled?"),
+    (test_progress_time_cancelled, "Does a cancelled jump leave the time as it was?"),
+    (test_job_routes, "Do heavy routes run as background jobs?"),
+]
+
+
 # test setup
 def run_tests():
     """This function runs all the tests."""
     failed = []
-    for test in buy_tests + sell_tests + date_tests + reset_tests:
+    tests = (
+        buy_tests
+        + sell_tests
+        + date_tests
+        + reset_tests
+        + store_tests
+        + price_cache_tests
+        + batched_price_tests
+        + bulk_order_tests
+        + valuation_tests
+        + trading_calendar_tests
+        + position_tests
+        + session_tests
+        + concurrency_tests
+        + fetcher_tests
+        + prefetch_tests
+        + fast_forward_tests
+        + stocks_route_tests
+        + http_cache_tests
+        + compression_tests
+        + metrics_tests
+        + provider_tests
+        + journal_tests
+        + shared_state_tests
+        + startup_tests
+        + event_tests
+        + analytics_tests
+        + job_tests
+    )
+    for test in tests:
         setup_test()
         print(f"Running test: {test[1]}")
         try: